@@ -26,6 +26,7 @@ from .stream cimport InputStream, OutputStream
 
 
 cdef object loads, dumps, create_InputStream, create_OutputStream
+cdef object ByteCountingOutputStream, observable
 cdef type WindowedValue
 
 
@@ -34,6 +35,12 @@ cdef class CoderImpl(object):
   cpdef decode_from_stream(self, InputStream stream, bint nested)
   cpdef bytes encode(self, value)
   cpdef decode(self, bytes encoded)
+  @cython.locals(out=OutputStream)
+  cpdef bytes encode_all(self, values)
+  @cython.locals(in_stream=InputStream, count=libc.stdint.int64_t)
+  cpdef list decode_all(self, bytes encoded)
+  cpdef estimate_size(self, value, bint nested=*)
+  cpdef get_estimated_size_and_observables(self, value, bint nested=*)
 
 
 cdef class SimpleCoderImpl(CoderImpl):
@@ -55,22 +62,63 @@ cdef class DeterministicPickleCoderImpl(CoderImpl):
   cdef bint _check_safe(self, value) except -1
 
 
+cdef unsigned char NONE_TYPE, INT_TYPE, FLOAT_TYPE, STR_TYPE, UNICODE_TYPE
+cdef unsigned char BOOL_TYPE, LONG_TYPE, LIST_TYPE, TUPLE_TYPE, UNKNOWN_TYPE
+cdef object MIN_INT64, MAX_INT64
+
+
+cdef class FastPrimitivesCoderImpl(StreamCoderImpl):
+  cdef CoderImpl _fallback_coder_impl
+  @cython.locals(t=type)
+  cpdef encode_to_stream(self, value, OutputStream stream, bint nested)
+  @cython.locals(t=int)
+  cpdef decode_from_stream(self, InputStream stream, bint nested)
+
+
 cdef class BytesCoderImpl(CoderImpl):
-  pass
+  @cython.locals(out=OutputStream)
+  cpdef bytes encode_all(self, values)
+  @cython.locals(in_stream=InputStream, count=libc.stdint.int64_t)
+  cpdef list decode_all(self, bytes encoded)
 
 
 cdef class FloatCoderImpl(StreamCoderImpl):
-  pass
+  @cython.locals(out=OutputStream)
+  cpdef bytes encode_all(self, values)
+  @cython.locals(in_stream=InputStream, count=libc.stdint.int64_t)
+  cpdef list decode_all(self, bytes encoded)
 
 
 cdef class TimestampCoderImpl(StreamCoderImpl):
   cdef object timestamp_class
 
 
+cdef class OrderedIntCoderImpl(StreamCoderImpl):
+  pass
+
+
+cdef class OrderedTimestampCoderImpl(StreamCoderImpl):
+  cdef object timestamp_class
+
+
+cdef class IntervalWindowCoderImpl(StreamCoderImpl):
+  cdef object _window_class
+  cdef object _timestamp_class
+
+
 cdef list small_ints
+cpdef int get_varint_size(libc.stdint.int64_t value)
 cdef class VarIntCoderImpl(StreamCoderImpl):
   @cython.locals(ivalue=libc.stdint.int64_t)
   cpdef bytes encode(self, value)
+  @cython.locals(out=OutputStream)
+  cpdef bytes encode_all(self, values)
+  @cython.locals(in_stream=InputStream, count=libc.stdint.int64_t)
+  cpdef list decode_all(self, bytes encoded)
+
+
+cdef class BoolCoderImpl(StreamCoderImpl):
+  pass
 
 
 cdef class SingletonCoderImpl(CoderImpl):
@@ -87,6 +135,8 @@ cdef class AbstractComponentCoderImpl(StreamCoderImpl):
   cpdef encode_to_stream(self, value, OutputStream stream, bint nested)
   @cython.locals(c=CoderImpl)
   cpdef decode_from_stream(self, InputStream stream, bint nested)
+  @cython.locals(c=CoderImpl)
+  cpdef get_estimated_size_and_observables(self, value, bint nested=*)
 
 
 cdef class TupleCoderImpl(AbstractComponentCoderImpl):
@@ -102,8 +152,28 @@ cdef class TupleSequenceCoderImpl(SequenceCoderImpl):
   pass
 
 
+cdef class ListCoderImpl(SequenceCoderImpl):
+  pass
+
+
+cdef class SetCoderImpl(SequenceCoderImpl):
+  pass
+
+
+cdef class IterableCoderImpl(SequenceCoderImpl):
+  pass
+
+
+cdef class DictCoderImpl(StreamCoderImpl):
+  cdef CoderImpl _key_coder
+  cdef CoderImpl _value_coder
+
+
 cdef class WindowedValueCoderImpl(StreamCoderImpl):
   """A coder for windowed values."""
   cdef CoderImpl _value_coder
   cdef CoderImpl _timestamp_coder
   cdef CoderImpl _windows_coder
+  cdef tuple _single_windows
+  @cython.locals(count=libc.stdint.int32_t)
+  cpdef decode_from_stream(self, InputStream stream, bint nested)
@@ -25,6 +25,7 @@ coder_impl.pxd file for type hints.
 import collections
 from cPickle import loads, dumps
 
+from google.cloud.dataflow.coders import observable
 
 # pylint: disable=g-import-not-at-top
 try:
@@ -37,9 +38,11 @@ except ImportError:
 try:
   from stream import InputStream as create_InputStream
   from stream import OutputStream as create_OutputStream
+  from stream import ByteCountingOutputStream
 except ImportError:
   from slow_stream import InputStream as create_InputStream
   from slow_stream import OutputStream as create_OutputStream
+  from slow_stream import ByteCountingOutputStream
 # pylint: enable=g-import-not-at-top
 
 
@@ -61,6 +64,54 @@ class CoderImpl(object):
     """Encodes an object to an unnested string."""
     raise NotImplementedError
 
+  def encode_all(self, values):
+    """Encodes a list of objects to a single unnested string.
+
+    The encoding is the number of values as a VarInt followed by the nested
+    encoding of each value, so that a whole bundle is written to one stream.
+    """
+    out = create_OutputStream()
+    out.write_var_int64(len(values))
+    for value in values:
+      self.encode_to_stream(value, out, True)
+    return out.get()
+
+  def decode_all(self, encoded):
+    """Decodes a string written by encode_all to the list of its objects."""
+    in_stream = create_InputStream(encoded)
+    count = in_stream.read_var_int64()
+    return [self.decode_from_stream(in_stream, True) for _ in range(count)]
+
+  def estimate_size(self, value, nested=False):
+    """Estimates the encoded size of the given value, in bytes.
+
+    Subclasses should override this when the size can be computed more
+    cheaply than by encoding the value into a ByteCountingOutputStream.
+    """
+    out = ByteCountingOutputStream()
+    self.encode_to_stream(value, out, nested)
+    return out.get_count()
+
+  def get_estimated_size_and_observables(self, value, nested=False):
+    """Returns the estimated size of value along with any observables.
+
+    Observables are lazy iterables (ObservableMixin instances) whose
+    elements are only read later on. Their size is not included in the
+    returned estimate; instead (observable, elem_coder_impl) pairs are
+    returned so the caller can register observers counting the elements as
+    they are read.
+
+    Args:
+      value: the value to estimate the size of.
+      nested: whether the value is nested within another encoding.
+
+    Returns:
+      A (size, [(observable, elem_coder_impl)]) tuple.
+    """
+    if isinstance(value, observable.ObservableMixin):
+      return 0, [(value, self)]
+    return self.estimate_size(value, nested), []
+
 
 class SimpleCoderImpl(CoderImpl):
   """Subclass of CoderImpl implementing stream methods using encode/decode."""
@@ -109,6 +160,10 @@ class CallbackCoderImpl(CoderImpl):
   def decode(self, encoded):
     return self._decoder(encoded)
 
+  def estimate_size(self, value, nested=False):
+    size = len(self._encoder(value))
+    return size + get_varint_size(size) if nested else size
+
 
 class DeterministicPickleCoderImpl(CoderImpl):
 
@@ -145,6 +200,89 @@ class DeterministicPickleCoderImpl(CoderImpl):
     return self._pickle_coder.decode(encoded)
 
 
+NONE_TYPE = 0
+INT_TYPE = 1
+FLOAT_TYPE = 2
+STR_TYPE = 3
+UNICODE_TYPE = 4
+BOOL_TYPE = 5
+LONG_TYPE = 6
+LIST_TYPE = 7
+TUPLE_TYPE = 8
+UNKNOWN_TYPE = 0xFF
+
+MIN_INT64 = -(1 << 63)
+MAX_INT64 = (1 << 63) - 1
+
+
+class FastPrimitivesCoderImpl(StreamCoderImpl):
+  """A coder tagging simple primitives with their type and encoding them.
+
+  Values of any other type, including subclasses of the primitive types, are
+  encoded by the fallback coder. Ints and longs equal to each other are
+  encoded identically, so that the encoding of primitives is deterministic.
+  """
+
+  def __init__(self, fallback_coder_impl):
+    self._fallback_coder_impl = fallback_coder_impl
+
+  def encode_to_stream(self, value, stream, nested):
+    t = type(value)
+    if value is None:
+      stream.write_byte(NONE_TYPE)
+    elif t is int or t is long and MIN_INT64 <= value <= MAX_INT64:
+      stream.write_byte(INT_TYPE)
+      stream.write_var_int64(value)
+    elif t is float:
+      stream.write_byte(FLOAT_TYPE)
+      stream.write_bigendian_double(value)
+    elif t is str:
+      stream.write_byte(STR_TYPE)
+      stream.write(value, True)
+    elif t is unicode:
+      stream.write_byte(UNICODE_TYPE)
+      stream.write(value.encode('utf-8'), True)
+    elif t is bool:
+      stream.write_byte(BOOL_TYPE)
+      stream.write_byte(1 if value else 0)
+    elif t is long:
+      stream.write_byte(LONG_TYPE)
+      stream.write(str(value), True)
+    elif t is list or t is tuple:
+      stream.write_byte(LIST_TYPE if t is list else TUPLE_TYPE)
+      stream.write_var_int64(len(value))
+      for elem in value:
+        self.encode_to_stream(elem, stream, True)
+    else:
+      stream.write_byte(UNKNOWN_TYPE)
+      self._fallback_coder_impl.encode_to_stream(value, stream, True)
+
+  def decode_from_stream(self, stream, nested):
+    t = stream.read_byte()
+    if t == NONE_TYPE:
+      return None
+    elif t == INT_TYPE:
+      return stream.read_var_int64()
+    elif t == FLOAT_TYPE:
+      return stream.read_bigendian_double()
+    elif t == STR_TYPE:
+      return stream.read_all(True)
+    elif t == UNICODE_TYPE:
+      return stream.read_all(True).decode('utf-8')
+    elif t == BOOL_TYPE:
+      return not not stream.read_byte()
+    elif t == LONG_TYPE:
+      return long(stream.read_all(True))
+    elif t == LIST_TYPE or t == TUPLE_TYPE:
+      size = stream.read_var_int64()
+      elems = [self.decode_from_stream(stream, True) for _ in range(size)]
+      return elems if t == LIST_TYPE else tuple(elems)
+    elif t == UNKNOWN_TYPE:
+      return self._fallback_coder_impl.decode_from_stream(stream, True)
+    else:
+      raise ValueError('Unknown type tag %x' % t)
+
+
 class BytesCoderImpl(CoderImpl):
   """A coder for bytes/str objects."""
 
@@ -161,6 +299,22 @@ class BytesCoderImpl(CoderImpl):
   def decode(self, encoded):
     return encoded
 
+  def encode_all(self, values):
+    out = create_OutputStream()
+    out.write_var_int64(len(values))
+    for value in values:
+      out.write(value, True)
+    return out.get()
+
+  def decode_all(self, encoded):
+    in_stream = create_InputStream(encoded)
+    count = in_stream.read_var_int64()
+    return [in_stream.read_all(True) for _ in range(count)]
+
+  def estimate_size(self, value, nested=False):
+    size = len(value)
+    return size + get_varint_size(size) if nested else size
+
 
 class FloatCoderImpl(StreamCoderImpl):
 
@@ -170,6 +324,21 @@ class FloatCoderImpl(StreamCoderImpl):
   def decode_from_stream(self, in_stream, nested):
     return in_stream.read_bigendian_double()
 
+  def encode_all(self, values):
+    out = create_OutputStream()
+    out.write_var_int64(len(values))
+    for value in values:
+      out.write_bigendian_double(value)
+    return out.get()
+
+  def decode_all(self, encoded):
+    in_stream = create_InputStream(encoded)
+    count = in_stream.read_var_int64()
+    return [in_stream.read_bigendian_double() for _ in range(count)]
+
+  def estimate_size(self, unused_value, nested=False):
+    return 8
+
 
 class TimestampCoderImpl(StreamCoderImpl):
 
@@ -182,10 +351,85 @@ class TimestampCoderImpl(StreamCoderImpl):
   def decode_from_stream(self, in_stream, nested):
     return self.timestamp_class(micros=in_stream.read_bigendian_int64())
 
+  def estimate_size(self, unused_value, nested=False):
+    return 8
+
+
+class OrderedIntCoderImpl(StreamCoderImpl):
+  """A coder for int64 values whose encodings sort in the order of the values.
+
+  Values are written big-endian with their sign bit flipped, so that negative
+  values sort before positive ones.
+  """
+
+  def encode_to_stream(self, value, out, nested):
+    out.write_bigendian_int64(value ^ MIN_INT64)
+
+  def decode_from_stream(self, in_stream, nested):
+    return in_stream.read_bigendian_int64() ^ MIN_INT64
+
+  def estimate_size(self, unused_value, nested=False):
+    return 8
+
+
+class OrderedTimestampCoderImpl(StreamCoderImpl):
+  """A timestamp coder whose encodings sort in the order of the timestamps."""
+
+  def __init__(self, timestamp_class):
+    self.timestamp_class = timestamp_class
+
+  def encode_to_stream(self, value, out, nested):
+    out.write_bigendian_int64(value.micros ^ MIN_INT64)
+
+  def decode_from_stream(self, in_stream, nested):
+    return self.timestamp_class(
+        micros=in_stream.read_bigendian_int64() ^ MIN_INT64)
+
+  def estimate_size(self, unused_value, nested=False):
+    return 8
+
+
+class IntervalWindowCoderImpl(StreamCoderImpl):
+  """A coder for interval windows, written as their end and duration.
+
+  The end is written in microseconds like a timestamp, and the duration as a
+  VarInt, which takes only a few bytes for the windows of typical sizes.
+  """
+
+  def __init__(self, window_class, timestamp_class):
+    self._window_class = window_class
+    self._timestamp_class = timestamp_class
+
+  def encode_to_stream(self, value, out, nested):
+    end = value.end.micros
+    out.write_bigendian_int64(end)
+    out.write_var_int64(end - value.start.micros)
+
+  def decode_from_stream(self, in_stream, nested):
+    end = in_stream.read_bigendian_int64()
+    start = end - in_stream.read_var_int64()
+    return self._window_class(self._timestamp_class(micros=start),
+                              self._timestamp_class(micros=end))
+
+  def estimate_size(self, value, nested=False):
+    return 8 + get_varint_size(value.end.micros - value.start.micros)
+
 
 small_ints = [chr(_) for _ in range(128)]
 
 
+def get_varint_size(value):
+  """Returns the size of the given integer value when encoded as a VarInt."""
+  if value < 0:
+    # Negative values are encoded as their 64-bit two's complement.
+    return 10
+  size = 1
+  while value >= 0x80:
+    value >>= 7
+    size += 1
+  return size
+
+
 class VarIntCoderImpl(StreamCoderImpl):
   """A coder for long/int objects."""
 
@@ -209,6 +453,42 @@ class VarIntCoderImpl(StreamCoderImpl):
         return i
     return StreamCoderImpl.decode(self, encoded)
 
+  def encode_all(self, values):
+    out = create_OutputStream()
+    out.write_var_int64(len(values))
+    for value in values:
+      out.write_var_int64(value)
+    return out.get()
+
+  def decode_all(self, encoded):
+    in_stream = create_InputStream(encoded)
+    count = in_stream.read_var_int64()
+    return [in_stream.read_var_int64() for _ in range(count)]
+
+  def estimate_size(self, value, nested=False):
+    return get_varint_size(value)
+
+
+class BoolCoderImpl(StreamCoderImpl):
+  """A coder for bool objects."""
+
+  def encode_to_stream(self, value, out, nested):
+    out.write_byte(1 if value else 0)
+
+  def decode_from_stream(self, in_stream, nested):
+    byte = in_stream.read_byte()
+    if byte == 0:
+      return False
+    elif byte == 1:
+      return True
+    raise ValueError('Invalid encoded bool byte: %d.' % byte)
+
+  def encode(self, value):
+    return small_ints[1 if value else 0]
+
+  def estimate_size(self, unused_value, nested=False):
+    return 1
+
 
 class SingletonCoderImpl(CoderImpl):
   """A coder that always encodes exactly one value."""
@@ -229,6 +509,9 @@ class SingletonCoderImpl(CoderImpl):
   def decode(self, encoded):
     return self._value
 
+  def estimate_size(self, unused_value, nested=False):
+    return 0
+
 
 class AbstractComponentCoderImpl(StreamCoderImpl):
 
@@ -256,6 +539,21 @@ class AbstractComponentCoderImpl(StreamCoderImpl):
     return self._construct_from_components(
         [c.decode_from_stream(in_stream, True) for c in self._coder_impls])
 
+  def estimate_size(self, value, nested=False):
+    return self.get_estimated_size_and_observables(value, nested)[0]
+
+  def get_estimated_size_and_observables(self, value, nested=False):
+    values = self._extract_components(value)
+    estimated_size = 0
+    observables = []
+    for i in range(0, len(self._coder_impls)):
+      c = self._coder_impls[i]  # type cast
+      child_size, child_observables = c.get_estimated_size_and_observables(
+          values[i], True)
+      estimated_size += child_size
+      observables += child_observables
+    return estimated_size, observables
+
 
 class TupleCoderImpl(AbstractComponentCoderImpl):
   """A coder for tuple objects."""
@@ -288,6 +586,12 @@ class SequenceCoderImpl(StreamCoderImpl):
         [self._elem_coder.decode_from_stream(in_stream, True)
          for _ in range(size)])
 
+  def estimate_size(self, value, nested=False):
+    estimated_size = 4
+    for elem in value:
+      estimated_size += self._elem_coder.estimate_size(elem, True)
+    return estimated_size
+
 
 class TupleSequenceCoderImpl(SequenceCoderImpl):
   """A coder for homogeneous tuple objects."""
@@ -296,6 +600,142 @@ class TupleSequenceCoderImpl(SequenceCoderImpl):
     return tuple(components)
 
 
+class ListCoderImpl(SequenceCoderImpl):
+  """A coder for homogeneous list objects."""
+
+  def _construct_from_sequence(self, components):
+    return components
+
+
+class SetCoderImpl(SequenceCoderImpl):
+  """A coder for homogeneous set objects."""
+
+  def _construct_from_sequence(self, components):
+    return set(components)
+
+
+class IterableCoderImpl(SequenceCoderImpl):
+  """A coder for homogeneous iterables.
+
+  Iterables with a length are encoded like other sequences and decoded as
+  lists. Iterables without a length, e.g. generators or grouped values, are
+  encoded without being materialized, compatibly with Java's
+  IterableLikeCoder: a length of -1 is followed by blocks of elements, each
+  preceded by its VarInt count, and a count of 0 ends the iterable. Such
+  encodings are decoded as a LazyIterable, whose elements are only decoded
+  as they are iterated over.
+  """
+
+  # Elements are buffered into blocks of about this many bytes.
+  _BLOCK_BYTES = 64 << 10
+
+  def _construct_from_sequence(self, components):
+    return components
+
+  def encode_to_stream(self, value, out, nested):
+    if hasattr(value, '__len__'):
+      SequenceCoderImpl.encode_to_stream(self, value, out, nested)
+      return
+    out.write_bigendian_int32(-1)
+    block = create_OutputStream()
+    count = 0
+    for elem in value:
+      self._elem_coder.encode_to_stream(elem, block, True)
+      count += 1
+      if block.get_count() >= IterableCoderImpl._BLOCK_BYTES:
+        out.write_var_int64(count)
+        out.write(block.get())
+        block = create_OutputStream()
+        count = 0
+    if count:
+      out.write_var_int64(count)
+      out.write(block.get())
+    out.write_var_int64(0)
+
+  def decode_from_stream(self, in_stream, nested):
+    size = in_stream.read_bigendian_int32()
+    if size >= 0:
+      return [self._elem_coder.decode_from_stream(in_stream, True)
+              for _ in range(size)]
+    blocks_stream = in_stream.copy()
+    if nested:
+      # The elements must be decoded once to find where the iterable ends.
+      while True:
+        count = in_stream.read_var_int64()
+        if not count:
+          break
+        for _ in range(count):
+          self._elem_coder.decode_from_stream(in_stream, True)
+    return LazyIterable(blocks_stream, self._elem_coder)
+
+  def estimate_size(self, value, nested=False):
+    if hasattr(value, '__len__'):
+      return SequenceCoderImpl.estimate_size(self, value, nested)
+    # Iterating over the value, e.g. a generator, could consume it before it
+    # is encoded, so only the size of the framing of its elements is counted.
+    return 4 + 1
+
+  def get_estimated_size_and_observables(self, value, nested=False):
+    # The elements of lazy iterables are counted as they are read.
+    if isinstance(value, observable.ObservableMixin):
+      return 0, [(value, self._elem_coder)]
+    return self.estimate_size(value, nested), []
+
+
+class LazyIterable(object):
+  """An iterable decoding the blocks of a chunked iterable encoding lazily.
+
+  The elements are decoded anew every time the iterable is iterated over, so
+  that at most one of them is held in memory by the iterable.
+  """
+
+  def __init__(self, blocks_stream, elem_coder):
+    self._blocks_stream = blocks_stream
+    self._elem_coder = elem_coder
+
+  def __iter__(self):
+    in_stream = self._blocks_stream.copy()
+    while True:
+      count = in_stream.read_var_int64()
+      if not count:
+        return
+      for _ in range(count):
+        yield self._elem_coder.decode_from_stream(in_stream, True)
+
+  def __reduce__(self):
+    # The underlying stream cannot be pickled, the elements are instead.
+    return list, (list(self),)
+
+
+class DictCoderImpl(StreamCoderImpl):
+  """A coder for dict objects with homogeneous keys and values."""
+
+  def __init__(self, key_coder, value_coder):
+    self._key_coder = key_coder
+    self._value_coder = value_coder
+
+  def encode_to_stream(self, value, out, nested):
+    out.write_bigendian_int32(len(value))
+    for k, v in value.iteritems():
+      self._key_coder.encode_to_stream(k, out, True)
+      self._value_coder.encode_to_stream(v, out, True)
+
+  def decode_from_stream(self, in_stream, nested):
+    size = in_stream.read_bigendian_int32()
+    result = {}
+    for _ in range(size):
+      k = self._key_coder.decode_from_stream(in_stream, True)
+      result[k] = self._value_coder.decode_from_stream(in_stream, True)
+    return result
+
+  def estimate_size(self, value, nested=False):
+    estimated_size = 4
+    for k, v in value.iteritems():
+      estimated_size += self._key_coder.estimate_size(k, True)
+      estimated_size += self._value_coder.estimate_size(v, True)
+    return estimated_size
+
+
 class WindowedValueCoderImpl(StreamCoderImpl):
   """A coder for windowed values."""
 
@@ -303,14 +743,41 @@ class WindowedValueCoderImpl(StreamCoderImpl):
     self._value_coder = value_coder
     self._timestamp_coder = timestamp_coder
     self._windows_coder = TupleSequenceCoderImpl(window_coder)
+    if isinstance(window_coder, SingletonCoderImpl):
+      # All windows are the same, e.g. the global window, so that only their
+      # number is encoded and the usual single window can be shared.
+      self._single_windows = (window_coder.decode(''),)
+    else:
+      self._single_windows = None
 
   def encode_to_stream(self, value, out, nested):
     self._value_coder.encode_to_stream(value.value, out, True)
     self._timestamp_coder.encode_to_stream(value.timestamp, out, True)
-    self._windows_coder.encode_to_stream(value.windows, out, True)
+    if self._single_windows is None:
+      self._windows_coder.encode_to_stream(value.windows, out, True)
+    else:
+      out.write_bigendian_int32(len(value.windows))
 
   def decode_from_stream(self, in_stream, nested):
-    return WindowedValue(
-        self._value_coder.decode_from_stream(in_stream, True),
-        self._timestamp_coder.decode_from_stream(in_stream, True),
-        self._windows_coder.decode_from_stream(in_stream, True))
+    value = self._value_coder.decode_from_stream(in_stream, True)
+    timestamp = self._timestamp_coder.decode_from_stream(in_stream, True)
+    if self._single_windows is None:
+      windows = self._windows_coder.decode_from_stream(in_stream, True)
+    else:
+      count = in_stream.read_bigendian_int32()
+      windows = (self._single_windows if count == 1
+                 else self._single_windows * count)
+    return WindowedValue(value, timestamp, windows)
+
+  def estimate_size(self, value, nested=False):
+    return self.get_estimated_size_and_observables(value, nested)[0]
+
+  def get_estimated_size_and_observables(self, value, nested=False):
+    value_size, observables = (
+        self._value_coder.get_estimated_size_and_observables(
+            value.value, True))
+    return (value_size
+            + self._timestamp_coder.estimate_size(value.timestamp, True)
+            + (self._windows_coder.estimate_size(value.windows, True)
+               if self._single_windows is None else 4),
+            observables)
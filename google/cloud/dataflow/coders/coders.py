@@ -90,6 +90,10 @@ class Coder(object):
       assert isinstance(self._impl, coder_impl.CoderImpl)
     return self._impl
 
+  def estimate_size(self, value):
+    """Estimates the encoded size of the given value, in bytes."""
+    return self.get_impl().estimate_size(value)
+
   def __getstate__(self):
     return self._dict_without_impl()
 
@@ -121,6 +125,18 @@ class Coder(object):
     else:
       raise ValueError('Not a KV coder: %s.' % self)
 
+  def sort_key_coder(self):
+    """Returns a coder of the same values whose encodings sort in their order.
+
+    The values grouped by GroupByKeyAndSortValues are sorted by their encoded
+    sort keys, so the sort keys are encoded with the coder returned here.
+
+    Raises:
+      ValueError: if this coder has no order-preserving counterpart.
+    """
+    raise ValueError(
+        'Coder %s does not preserve the order of the values it encodes.' % self)
+
   def _get_component_coders(self):
     """Returns the internal component coders of this coder."""
     # This is an internal detail of the Coder API and does not need to be
@@ -165,6 +181,10 @@ class StrUtf8Coder(Coder):
   def is_deterministic(self):
     return True
 
+  def sort_key_coder(self):
+    # UTF-8 encodings sort in the order of their code points.
+    return self
+
 
 class ToStringCoder(Coder):
   """A default string coder used if no sink coder is specified."""
@@ -213,6 +233,9 @@ class BytesCoder(FastCoder):
   def is_deterministic(self):
     return True
 
+  def sort_key_coder(self):
+    return self
+
 
 class VarIntCoder(FastCoder):
   """Variable-length integer coder."""
@@ -223,6 +246,22 @@ class VarIntCoder(FastCoder):
   def is_deterministic(self):
     return True
 
+  def sort_key_coder(self):
+    return OrderedIntCoder()
+
+
+class OrderedIntCoder(FastCoder):
+  """A fixed-length integer coder whose encodings sort in numeric order."""
+
+  def _create_impl(self):
+    return coder_impl.OrderedIntCoderImpl()
+
+  def is_deterministic(self):
+    return True
+
+  def sort_key_coder(self):
+    return self
+
 
 class FloatCoder(FastCoder):
   """A coder used for floating-point values."""
@@ -234,6 +273,16 @@ class FloatCoder(FastCoder):
     return True
 
 
+class BoolCoder(FastCoder):
+  """A coder used for bool values."""
+
+  def _create_impl(self):
+    return coder_impl.BoolCoderImpl()
+
+  def is_deterministic(self):
+    return True
+
+
 class TimestampCoder(FastCoder):
   """A coder used for timeutil.Timestamp values."""
 
@@ -243,6 +292,22 @@ class TimestampCoder(FastCoder):
   def is_deterministic(self):
     return True
 
+  def sort_key_coder(self):
+    return OrderedTimestampCoder()
+
+
+class OrderedTimestampCoder(FastCoder):
+  """A timeutil.Timestamp coder whose encodings sort in time order."""
+
+  def _create_impl(self):
+    return coder_impl.OrderedTimestampCoderImpl(Timestamp)
+
+  def is_deterministic(self):
+    return True
+
+  def sort_key_coder(self):
+    return self
+
 
 class SingletonCoder(FastCoder):
   """A coder that always encodes exactly one value."""
@@ -351,6 +416,51 @@ class DeterministicPickleCoder(FastCoder):
     return self
 
 
+class FastPrimitivesCoder(FastCoder):
+  """Encodes simple primitives (e.g. str, int) efficiently.
+
+  Values of other types are encoded by the fallback coder, which defaults to
+  a PickleCoder. The encoding of None, bool, int, long, float, str, unicode
+  and of lists and tuples of these is deterministic.
+  """
+
+  def __init__(self, fallback_coder=PickleCoder()):
+    self._fallback_coder = fallback_coder
+
+  def _create_impl(self):
+    return coder_impl.FastPrimitivesCoderImpl(
+        self._fallback_coder.get_impl())
+
+  def is_deterministic(self):
+    return self._fallback_coder.is_deterministic()
+
+  def as_cloud_object(self, is_pair_like=True):
+    value = super(FastPrimitivesCoder, self).as_cloud_object()
+    # As for the PickleCoder, the service may expect a pair.
+    if is_pair_like:
+      value['is_pair_like'] = True
+      value['component_encodings'] = [
+          self.as_cloud_object(is_pair_like=False),
+          self.as_cloud_object(is_pair_like=False)
+      ]
+
+    return value
+
+  # We allow .key_coder() and .value_coder() to be called on
+  # FastPrimitivesCoder for the same reason as for PickleCoder.
+  def is_kv_coder(self):
+    return True
+
+  def key_coder(self):
+    return self
+
+  def value_coder(self):
+    return self
+
+  def __repr__(self):
+    return 'FastPrimitivesCoder[%s]' % self._fallback_coder
+
+
 class Base64PickleCoder(Coder):
   """Coder of objects by Python pickle, then base64 encoding."""
   # TODO(robertwb): Do base64 encoding where it's needed (e.g. in json) rather
@@ -450,6 +560,122 @@ class TupleSequenceCoder(FastCoder):
     return 'TupleSequenceCoder[%r]' % self._elem_coder
 
 
+class ListCoder(FastCoder):
+  """Coder of homogeneous list objects."""
+
+  def __init__(self, elem_coder):
+    self._elem_coder = elem_coder
+
+  def _create_impl(self):
+    return coder_impl.ListCoderImpl(self._elem_coder.get_impl())
+
+  def is_deterministic(self):
+    return self._elem_coder.is_deterministic()
+
+  @staticmethod
+  def from_type_hint(typehint, registry):
+    return ListCoder(registry.get_coder(typehint.inner_type))
+
+  def _get_component_coders(self):
+    return (self._elem_coder,)
+
+  def __repr__(self):
+    return 'ListCoder[%r]' % self._elem_coder
+
+
+class SetCoder(FastCoder):
+  """Coder of homogeneous set objects."""
+
+  def __init__(self, elem_coder):
+    self._elem_coder = elem_coder
+
+  def _create_impl(self):
+    return coder_impl.SetCoderImpl(self._elem_coder.get_impl())
+
+  def is_deterministic(self):
+    # Sets are encoded in their iteration order, which is not defined.
+    return False
+
+  @staticmethod
+  def from_type_hint(typehint, registry):
+    return SetCoder(registry.get_coder(typehint.inner_type))
+
+  def _get_component_coders(self):
+    return (self._elem_coder,)
+
+  def __repr__(self):
+    return 'SetCoder[%r]' % self._elem_coder
+
+
+class IterableCoder(FastCoder):
+  """Coder of homogeneous iterables, which are decoded as lists."""
+
+  def __init__(self, elem_coder):
+    self._elem_coder = elem_coder
+
+  def _create_impl(self):
+    return coder_impl.IterableCoderImpl(self._elem_coder.get_impl())
+
+  def is_deterministic(self):
+    return self._elem_coder.is_deterministic()
+
+  @staticmethod
+  def from_type_hint(typehint, registry):
+    return IterableCoder(registry.get_coder(typehint.inner_type))
+
+  def _get_component_coders(self):
+    return (self._elem_coder,)
+
+  def elem_coder(self):
+    return self._elem_coder
+
+  def __repr__(self):
+    return 'IterableCoder[%r]' % self._elem_coder
+
+
+class DictCoder(FastCoder):
+  """Coder of dict objects with homogeneous keys and values."""
+
+  def __init__(self, key_coder, value_coder):
+    self._key_coder = key_coder
+    self._value_coder = value_coder
+
+  def _create_impl(self):
+    return coder_impl.DictCoderImpl(
+        self._key_coder.get_impl(), self._value_coder.get_impl())
+
+  def is_deterministic(self):
+    # Dicts are encoded in their iteration order, which is not defined.
+    return False
+
+  @staticmethod
+  def from_type_hint(typehint, registry):
+    return DictCoder(registry.get_coder(typehint.key_type),
+                     registry.get_coder(typehint.value_type))
+
+  def _get_component_coders(self):
+    return (self._key_coder, self._value_coder)
+
+  def __repr__(self):
+    return 'DictCoder[%r, %r]' % (self._key_coder, self._value_coder)
+
+
+class IntervalWindowCoder(FastCoder):
+  """Coder for the IntervalWindows of the built-in windowing functions."""
+
+  def _create_impl(self):
+    # pylint: disable=g-import-not-at-top
+    # Imported here as the windowing module depends on this one.
+    from google.cloud.dataflow.transforms import timeutil
+    from google.cloud.dataflow.transforms.window import IntervalWindow
+    # pylint: enable=g-import-not-at-top
+    return coder_impl.IntervalWindowCoderImpl(
+        IntervalWindow, timeutil.Timestamp)
+
+  def is_deterministic(self):
+    return True
+
+
 class WindowCoder(PickleCoder):
   """Coder for windows in windowed values."""
 
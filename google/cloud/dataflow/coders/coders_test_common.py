@@ -14,6 +14,7 @@
 
 """Tests common to all coder implementations."""
 
+import collections
 import logging
 import math
 import sys
@@ -22,9 +23,26 @@ import unittest
 import dill
 
 import coders
+import observable
+
+
+# pylint: disable=g-import-not-at-top
+try:
+  from google.cloud.dataflow.transforms.timeutil import Timestamp
+  from google.cloud.dataflow.transforms.window import GlobalWindow
+  from google.cloud.dataflow.transforms.window import IntervalWindow
+  from google.cloud.dataflow.transforms.window import WindowedValue
+except ImportError:
+  Timestamp = coders.Timestamp
+  WindowedValue = collections.namedtuple(
+      'WindowedValue', ('value', 'timestamp', 'windows'))
+# pylint: enable=g-import-not-at-top
 
 
 # Defined out of line for picklability.
+Pair = collections.namedtuple('Pair', ['x', 'y'])
+
+
 class CustomCoder(coders.Coder):
 
   def encode(self, x):
@@ -77,6 +95,9 @@ class CodersTest(unittest.TestCase):
     self._observe(coder)
     for v in values:
       self.assertEqual(v, coder.decode(coder.encode(v)))
+      self.assertEqual(len(coder.encode(v)), coder.estimate_size(v))
+    impl = coder.get_impl()
+    self.assertEqual(list(values), impl.decode_all(impl.encode_all(values)))
     copy1 = dill.loads(dill.dumps(coder))
     copy2 = dill.loads(dill.dumps(coder))
     for v in values:
@@ -102,6 +123,23 @@ class CodersTest(unittest.TestCase):
     self.check_coder(coders.TupleCoder((coder, coders.PickleCoder())),
                      (1, dict()), ('a', [dict()]))
 
+  def test_fast_primitives_coder(self):
+    coder = coders.FastPrimitivesCoder(coders.PickleCoder())
+    self.check_coder(coder, None, 1, -1, 1.5, 'str\0str', u'unicode\0\u0101')
+    self.check_coder(coder, (), (1, 2, 3), [], [1, 2, 3], True, False)
+    self.check_coder(coder, 1 << 63, -1 << 64, sys.maxint, -sys.maxint - 1)
+    self.check_coder(coder, dict(), {'a': 1}, [dict(), (1, [None])])
+    self.check_coder(coders.TupleCoder((coder, coder)), (1, 'a'), ([], {}))
+    # Equal ints and longs must share their encoding for use in keys.
+    self.assertEqual(coder.encode(1), coder.encode(1L))
+    self.assertEqual(coder.encode((1, 'a')), coder.encode((1L, 'a')))
+    # Values of unknown types, e.g. namedtuples, use the fallback coder.
+    self.assertEqual(Pair, type(coder.decode(coder.encode(Pair(1, 2)))))
+    self.assertFalse(coder.is_deterministic())
+    self.assertTrue(coders.FastPrimitivesCoder(
+        coders.DeterministicPickleCoder(coders.PickleCoder(), 'step'))
+                    .is_deterministic())
+
   def test_dill_coder(self):
     cell_value = (lambda x: lambda: x)(0).func_closure[0]
     self.check_coder(coders.DillCoder(), 'a', 1, cell_value)
@@ -129,6 +167,15 @@ class CodersTest(unittest.TestCase):
                      *[float(2 ** (0.1 * x)) for x in range(-100, 100)])
     self.check_coder(coders.FloatCoder(), float('-Inf'), float('Inf'))
 
+  def test_encode_all(self):
+    impl = coders.VarIntCoder().get_impl()
+    self.assertEqual('\x03\x01\x02\x80\x01', impl.encode_all([1, 2, 128]))
+    self.assertEqual([], impl.decode_all(impl.encode_all([])))
+    impl = coders.TupleCoder(
+        (coders.BytesCoder(), coders.PickleCoder())).get_impl()
+    values = [('a', 1), ('', {'b': 2})]
+    self.assertEqual(values, impl.decode_all(impl.encode_all(values)))
+
   def test_singleton_coder(self):
     a = 'anything'
     b = 'something else'
@@ -147,6 +194,35 @@ class CodersTest(unittest.TestCase):
                      coders.Timestamp(micros=-1234567890123456789),
                      coders.Timestamp(micros=1234567890123456789))
 
+  def test_ordered_coders(self):
+    ints = [-(1 << 63), -1000, -1, 0, 1, 127, 128, 1000, (1 << 63) - 1]
+    timestamps = [coders.Timestamp(micros=x) for x in ints]
+    int_coder = coders.VarIntCoder().sort_key_coder()
+    timestamp_coder = coders.TimestampCoder().sort_key_coder()
+    self.check_coder(int_coder, *ints)
+    self.check_coder(timestamp_coder, *timestamps)
+    self.check_coder(coders.TupleCoder((int_coder, timestamp_coder)),
+                     *zip(ints, timestamps))
+    self.assertEqual(ints, sorted(ints, key=int_coder.encode))
+    self.assertEqual(
+        timestamps, sorted(reversed(timestamps), key=timestamp_coder.encode))
+    self.assertIs(int_coder, int_coder.sort_key_coder())
+    unicodes = [u'', u'a', u'ab', u'b', u'\xe9', u'\u1234', u'\U0001f600']
+    unicode_coder = coders.StrUtf8Coder().sort_key_coder()
+    self.assertEqual(
+        unicodes, sorted(reversed(unicodes), key=unicode_coder.encode))
+    with self.assertRaises(ValueError):
+      coders.PickleCoder().sort_key_coder()
+
+  def test_interval_window_coder(self):
+    coder = coders.IntervalWindowCoder()
+    self.check_coder(coder, IntervalWindow(0, 10), IntervalWindow(-1.5, 1e6),
+                     IntervalWindow(3600, 3600))
+    self.check_coder(coders.TupleCoder((coder, coders.VarIntCoder())),
+                     (IntervalWindow(10, 20), 1))
+    # The end and a small duration take 9 bytes.
+    self.assertEqual(9, len(coder.encode(IntervalWindow(3600, 3600.0001))))
+
   def test_tuple_coder(self):
     self.check_coder(
         coders.TupleCoder((coders.VarIntCoder(), coders.BytesCoder())),
@@ -168,6 +244,129 @@ class CodersTest(unittest.TestCase):
         coders.TupleCoder((coders.VarIntCoder(), int_tuple_coder)),
         (1, (1, 2, 3)))
 
+  def test_list_coder(self):
+    list_coder = coders.ListCoder(coders.VarIntCoder())
+    self.check_coder(list_coder, [1, -1, 0], [], range(1000))
+    self.check_coder(
+        coders.TupleCoder((coders.BytesCoder(), list_coder)), ('a', [1, 2]))
+
+  def test_set_coder(self):
+    set_coder = coders.SetCoder(coders.BytesCoder())
+    self.check_coder(set_coder, set(['a', 'b', '']), set())
+    self.check_coder(
+        coders.TupleCoder((coders.VarIntCoder(), set_coder)), (1, set(['a'])))
+
+  def test_iterable_coder(self):
+    iterable_coder = coders.IterableCoder(coders.VarIntCoder())
+    self.check_coder(iterable_coder, [1, -1, 0], [], range(1000))
+    self.check_coder(
+        coders.TupleCoder((coders.VarIntCoder(), iterable_coder)), (1, [2, 3]))
+
+  def test_iterable_coder_unsized(self):
+    iterable_coder = coders.IterableCoder(coders.VarIntCoder())
+    # Iterables without a length are encoded in blocks and decoded lazily.
+    values = (x for x in range(3))
+    # Estimating the size must not consume the generator.
+    self.assertEqual(5, iterable_coder.estimate_size(values))
+    encoded = iterable_coder.encode(values)
+    decoded = iterable_coder.decode(encoded)
+    self.assertFalse(isinstance(decoded, list))
+    self.assertEqual([0, 1, 2], list(decoded))
+    # Lazy iterables can be iterated over more than once, and pickled.
+    self.assertEqual([0, 1, 2], list(decoded))
+    self.assertEqual([0, 1, 2], dill.loads(dill.dumps(decoded)))
+    self.assertEqual([], list(iterable_coder.decode(
+        iterable_coder.encode(x for x in []))))
+    # A nested lazy iterable is skipped over to decode what follows it.
+    coder = coders.TupleCoder(
+        (iterable_coder, coders.BytesCoder(), iterable_coder))
+    a, b, c = coder.decode(
+        coder.encode((iter([1, 2]), 'abc', (x for x in range(5)))))
+    self.assertEqual(([1, 2], 'abc', range(5)), (list(a), b, list(c)))
+    # Large iterables are split across several blocks.
+    iterable_coder = coders.IterableCoder(coders.BytesCoder())
+    values = ['%04d' % i * 250 for i in range(300)]
+    encoded = iterable_coder.encode(iter(values))
+    self.assertEqual(values, list(iterable_coder.decode(encoded)))
+    self.assertEqual(values, list(coders.TupleCoder(
+        (iterable_coder, coders.VarIntCoder())).decode(encoded + '\x01')[0]))
+
+  def test_dict_coder(self):
+    dict_coder = coders.DictCoder(coders.BytesCoder(), coders.VarIntCoder())
+    self.check_coder(dict_coder, {'a': 1, 'b': -1, '': 1000}, {})
+    self.check_coder(
+        coders.TupleCoder((coders.VarIntCoder(), dict_coder)), (1, {'a': 2}))
+
+  def test_bool_coder(self):
+    self.check_coder(coders.BoolCoder(), True, False)
+    self.check_coder(
+        coders.TupleCoder((coders.BoolCoder(), coders.BoolCoder())),
+        (True, False))
+    with self.assertRaises(ValueError):
+      coders.BoolCoder().decode('\x02')
+
+  def test_windowed_value_coder_estimate_size(self):
+    coder = coders.WindowedValueCoder(
+        coders.TupleCoder((coders.BytesCoder(), coders.VarIntCoder())))
+    value = WindowedValue(
+        ('abc', 300), Timestamp(micros=1000), ('window',))
+    self.assertEqual(len(coder.encode(value)), coder.estimate_size(value))
+
+  def test_windowed_value_coder_global_window(self):
+    value_coder = coders.TupleCoder((coders.BytesCoder(), coders.VarIntCoder()))
+    window_coder = coders.SingletonCoder(GlobalWindow())
+    coder = coders.WindowedValueCoder(
+        value_coder, coders.TimestampCoder(), window_coder)
+    for windows in [(GlobalWindow(),), (), (GlobalWindow(), GlobalWindow())]:
+      value = WindowedValue(('abc', 300), Timestamp(micros=1000), windows)
+      encoded = coder.encode(value)
+      # Only the number of windows is encoded, as it would be in general.
+      general_coder = coders.TupleCoder(
+          (value_coder, coders.TimestampCoder(),
+           coders.TupleSequenceCoder(window_coder)))
+      self.assertEqual(
+          general_coder.encode((value.value, value.timestamp, windows)),
+          encoded)
+      self.assertEqual(len(encoded), coder.estimate_size(value))
+      decoded = coder.decode(encoded)
+      self.assertEqual(
+          (value.value, 1000, windows),
+          (decoded.value, decoded.timestamp.micros, decoded.windows))
+
+  def test_get_estimated_size_and_observables(self):
+    class Values(observable.ObservableMixin):
+      pass
+    values = Values()
+    coder = coders.WindowedValueCoder(
+        coders.TupleCoder((coders.BytesCoder(), coders.VarIntCoder())))
+    value = WindowedValue(
+        ('abc', values), Timestamp(micros=1000), ('window',))
+    size, observables = coder.get_impl().get_estimated_size_and_observables(
+        value)
+    # The observable iterable is left out of the estimate and returned
+    # together with the coder of its elements.
+    value_without_values = WindowedValue(
+        ('abc', 0), Timestamp(micros=1000), ('window',))
+    self.assertEqual(len(coder.encode(value_without_values)) - 1, size)
+    self.assertEqual(1, len(observables))
+    self.assertIs(values, observables[0][0])
+    self.assertIs(coders.VarIntCoder().get_impl().__class__,
+                  observables[0][1].__class__)
+
+  def test_iterable_coder_observables(self):
+    class Values(observable.ObservableMixin):
+      pass
+    values = Values()
+    coder = coders.TupleCoder(
+        (coders.BytesCoder(), coders.IterableCoder(coders.VarIntCoder())))
+    size, observables = coder.get_impl().get_estimated_size_and_observables(
+        ('abc', values))
+    self.assertEqual(4, size)
+    # The elements of the iterable are counted with the element coder.
+    self.assertEqual([values], [o for o, _ in observables])
+    self.assertIs(coders.VarIntCoder().get_impl().__class__,
+                  observables[0][1].__class__)
+
   def test_base64_pickle_coder(self):
     self.check_coder(coders.Base64PickleCoder(), 'a', 1, 1.5, (1, 2, 3))
 
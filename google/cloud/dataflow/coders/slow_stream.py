@@ -22,15 +22,18 @@ class OutputStream(object):
 
   def __init__(self):
     self.data = []
+    self.count = 0
 
   def write(self, b, nested=False):
     assert isinstance(b, str)
     if nested:
       self.write_var_int64(len(b))
     self.data.append(b)
+    self.count += len(b)
 
   def write_byte(self, val):
     self.data.append(chr(val))
+    self.count += 1
 
   def write_var_int64(self, v):
     if v < 0:
@@ -58,6 +61,9 @@ class OutputStream(object):
   def get(self):
     return ''.join(self.data)
 
+  def get_count(self):
+    return self.count
+
 
 class ByteCountingOutputStream(OutputStream):
   """A pure Python implementation of stream.ByteCountingOutputStream."""
@@ -134,3 +140,24 @@ class InputStream(object):
 
   def read_bigendian_double(self):
     return struct.unpack('>d', self.read(8))[0]
+
+  def read_prefixed_fields(self, count):
+    data, pos = self.data, self.pos
+    fields = []
+    for _ in xrange(count):
+      if pos + 4 > len(data):
+        raise ValueError('Truncated length-prefixed field.')
+      length, = struct.unpack_from('>I', data, pos)
+      pos += 4
+      if pos + length > len(data):
+        raise ValueError('Truncated length-prefixed field.')
+      fields.append(data[pos:pos + length])
+      pos += length
+    self.pos = pos
+    return tuple(fields)
+
+  def copy(self):
+    """Returns a stream reading the same data from the current position."""
+    result = InputStream(self.data)
+    result.pos = self.pos
+    return result
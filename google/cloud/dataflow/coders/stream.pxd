@@ -28,6 +28,7 @@ cdef class OutputStream(object):
   cpdef write_bigendian_double(self, double d)
 
   cpdef bytes get(self)
+  cpdef size_t get_count(self)
 
   cdef extend(self, size_t missing)
 
@@ -56,3 +57,5 @@ cdef class InputStream(object):
   cpdef libc.stdint.int32_t read_bigendian_int32(self) except? -1
   cpdef double read_bigendian_double(self) except? -1
   cpdef bytes read_all(self, bint nested=*)
+  cpdef tuple read_prefixed_fields(self, int count)
+  cpdef InputStream copy(self)
@@ -89,6 +89,9 @@ cdef class OutputStream(object):
   cpdef bytes get(self):
     return self.data[:self.pos]
 
+  cpdef size_t get_count(self):
+    return self.pos
+
   cdef extend(self, size_t missing):
     while missing > self.size - self.pos:
       self.size *= 2
@@ -199,3 +202,32 @@ cdef class InputStream(object):
   cpdef double read_bigendian_double(self) except? -1:
     cdef libc.stdint.int64_t as_long = self.read_bigendian_int64()
     return (<double*><char*>&as_long)[0]
+
+  cpdef tuple read_prefixed_fields(self, int count):
+    """Reads count byte strings, each preceded by its 4-byte big-endian length.
+
+    Unlike the other read methods this one checks the data is long enough.
+    """
+    cdef size_t total = len(self.all)
+    cdef size_t length
+    cdef int i
+    cdef list fields = []
+    for i in range(count):
+      if self.pos + 4 > total:
+        raise ValueError('Truncated length-prefixed field.')
+      length = (<unsigned char>self.allc[self.pos + 3]
+          | <libc.stdint.uint32_t><unsigned char>self.allc[self.pos + 2] <<  8
+          | <libc.stdint.uint32_t><unsigned char>self.allc[self.pos + 1] << 16
+          | <libc.stdint.uint32_t><unsigned char>self.allc[self.pos] << 24)
+      self.pos += 4
+      if self.pos + length > total:
+        raise ValueError('Truncated length-prefixed field.')
+      fields.append(self.allc[self.pos : self.pos + length])
+      self.pos += length
+    return tuple(fields)
+
+  cpdef InputStream copy(self):
+    """Returns a stream reading the same data from the current position."""
+    cdef InputStream result = InputStream(self.all)
+    result.pos = self.pos
+    return result
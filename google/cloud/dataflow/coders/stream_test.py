@@ -112,6 +112,34 @@ class StreamTest(unittest.TestCase):
     for v in values:
       self.assertEquals(v, in_s.read_bigendian_int32())
 
+  def test_read_prefixed_fields(self):
+    data = ('\0\0\0\3abc' '\0\0\0\0' '\0\0\1\0' + 'x' * 256 +
+            '\0\0\0\1z')
+    in_s = self.InputStream(data)
+    self.assertEquals(('abc', '', 'x' * 256), in_s.read_prefixed_fields(3))
+    self.assertEquals(('z',), in_s.read_prefixed_fields(1))
+    self.assertEquals(0, in_s.size())
+    with self.assertRaises(ValueError):
+      self.InputStream('\0\0\0\4abc').read_prefixed_fields(1)
+    with self.assertRaises(ValueError):
+      self.InputStream('\0\0\0').read_prefixed_fields(1)
+
+  def test_get_count(self):
+    out_s = self.OutputStream()
+    self.assertEquals(0, out_s.get_count())
+    out_s.write('abc', nested=True)
+    out_s.write_bigendian_int32(1)
+    self.assertEquals(8, out_s.get_count())
+    self.assertEquals(8, len(out_s.get()))
+
+  def test_copy(self):
+    in_s = self.InputStream('abcdef')
+    self.assertEquals('ab', in_s.read(2))
+    copy = in_s.copy()
+    self.assertEquals('cdef', in_s.read_all(False))
+    self.assertEquals('cd', copy.read(2))
+    self.assertEquals(2, copy.size())
+
   def test_byte_counting(self):
     bc_s = self.ByteCountingOutputStream()
     self.assertEquals(0, bc_s.get_count())
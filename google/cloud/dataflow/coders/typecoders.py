@@ -78,14 +78,22 @@ class CoderRegistry(object):
   def register_standard_coders(self, fallback_coder):
     """Register coders for all basic and composite types."""
     self._register_coder_internal(int, coders.VarIntCoder)
+    self._register_coder_internal(bool, coders.BoolCoder)
     self._register_coder_internal(float, coders.FloatCoder)
     self._register_coder_internal(str, coders.BytesCoder)
     self._register_coder_internal(bytes, coders.BytesCoder)
     self._register_coder_internal(unicode, coders.StrUtf8Coder)
     self._register_coder_internal(typehints.TupleConstraint, coders.TupleCoder)
+    self._register_coder_internal(typehints.TupleSequenceConstraint,
+                                  coders.TupleSequenceCoder)
+    self._register_coder_internal(typehints.ListConstraint, coders.ListCoder)
+    self._register_coder_internal(typehints.DictConstraint, coders.DictCoder)
+    self._register_coder_internal(typehints.SetTypeConstraint, coders.SetCoder)
+    self._register_coder_internal(typehints.IterableTypeConstraint,
+                                  coders.IterableCoder)
     self._register_coder_internal(typehints.AnyTypeConstraint,
-                                  coders.PickleCoder)
-    self._fallback_coder = fallback_coder or coders.PickleCoder
+                                  coders.FastPrimitivesCoder)
+    self._fallback_coder = fallback_coder or coders.FastPrimitivesCoder
 
   def _register_coder_internal(self, typehint_type, typehint_coder_class):
     self._coders[typehint_type] = typehint_coder_class
@@ -111,13 +119,7 @@ class CoderRegistry(object):
         raise RuntimeError(
             'Coder registry has no fallback coder. This can happen if the '
             'fast_coders module could not be imported.')
-      if isinstance(typehint, typehints.IterableTypeConstraint):
-        # In this case, we suppress the warning message for using the fallback
-        # coder, since Iterable is hinted as the output of a GroupByKey
-        # operation and that direct output will not be coded.
-        # TODO(ccy): refine this behavior.
-        pass
-      elif typehint is None:
+      if typehint is None:
         # In some old code, None is used for Any.
         # TODO(robertwb): Clean this up.
         pass
@@ -145,7 +147,10 @@ class CoderRegistry(object):
       if isinstance(key_coder, (coders.PickleCoder, self._fallback_coder)):
         if not silent:
           logging.warning(error_msg)
-        return coders.DeterministicPickleCoder(key_coder, op_name)
+        # Primitive keys are still encoded deterministically by the
+        # FastPrimitivesCoder, other keys are checked and pickled.
+        return coders.FastPrimitivesCoder(
+            coders.DeterministicPickleCoder(coders.PickleCoder(), op_name))
       else:
         raise ValueError(error_msg)
     else:
@@ -78,6 +78,15 @@ class TypeCodersTest(unittest.TestCase):
     coder = typecoders.registry.get_coder(typehints.Any)
     self.assertEqual(('abc', 123), coder.decode(coder.encode(('abc', 123))))
 
+  def test_verify_deterministic_fallbackcoder(self):
+    coder = typecoders.registry.verify_deterministic(
+        typecoders.registry.get_coder(typehints.Any), 'GroupByKey "gbk"')
+    self.assertTrue(coder.is_deterministic())
+    key = ('abc', 123, [1.5, None], u'\u00e9')
+    self.assertEqual(key, coder.decode(coder.encode(key)))
+    with self.assertRaises(TypeError):
+      coder.encode(('abc', object()))
+
   def test_get_coder_can_be_pickled(self):
     coder = typecoders.registry.get_coder(typehints.Tuple[str, int])
     revived_coder = pickler.loads(pickler.dumps(coder))
@@ -109,6 +118,25 @@ class TypeCodersTest(unittest.TestCase):
         real_coder.encode('abc'), expected_coder.encode('abc'))
     self.assertEqual('abc', real_coder.decode(real_coder.encode('abc')))
 
+  def test_standard_collection_coders(self):
+    registry = typecoders.registry
+    self.assertEqual(coders.BoolCoder(), registry.get_coder(bool))
+    self.assertEqual(coders.ListCoder(coders.VarIntCoder()),
+                     registry.get_coder(typehints.List[int]))
+    self.assertEqual(coders.SetCoder(coders.BytesCoder()),
+                     registry.get_coder(typehints.Set[str]))
+    self.assertEqual(
+        coders.DictCoder(coders.BytesCoder(), coders.FloatCoder()),
+        registry.get_coder(typehints.Dict[str, float]))
+    self.assertEqual(coders.IterableCoder(coders.VarIntCoder()),
+                     registry.get_coder(typehints.Iterable[int]))
+    self.assertEqual(coders.TupleSequenceCoder(coders.VarIntCoder()),
+                     registry.get_coder(typehints.Tuple[int, ...]))
+    coder = registry.get_coder(
+        typehints.KV[str, typehints.Iterable[typehints.List[bool]]])
+    value = ('a', [[True, False], []])
+    self.assertEqual(value, coder.decode(coder.encode(value)))
+
 
 if __name__ == '__main__':
   unittest.main()
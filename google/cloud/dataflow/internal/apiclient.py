@@ -724,18 +724,10 @@ class DataflowWorkerClient(object):
       work_item_status.requestedLeaseDuration = desired_lease_duration
 
     if progress is not None:
-      work_item_progress = dataflow.ApproximateProgress()
-      work_item_status.progress = work_item_progress
-
-      if progress.position is not None:
-        work_item_progress.position = (
-            reader_position_to_cloud_position(progress.position))
-      elif progress.percent_complete is not None:
-        work_item_progress.percentComplete = progress.percent_complete
-      elif progress.remaining_time is not None:
-        work_item_progress.remainingTime = progress.remaining_time
-      else:
+      if (progress.position is None and progress.percent_complete is None
+          and progress.remaining_time is None):
         raise TypeError('Unknown type of progress')
+      work_item_status.progress = reader_progress_to_cloud_progress(progress)
 
     if dynamic_split_result_to_report is not None:
       assert isinstance(dynamic_split_result_to_report,
@@ -656,8 +656,18 @@ class TextFileReader(iobase.NativeSourceReader):
       yield self.source.coder.decode(line)
 
   def get_progress(self):
+    return self.progress_from_snapshot(self.get_progress_snapshot())
+
+  @property
+  def supports_progress_snapshots(self):
+    return True
+
+  def get_progress_snapshot(self):
+    return self.range_tracker.last_record_start
+
+  def progress_from_snapshot(self, snapshot):
     return iobase.ReaderProgress(position=iobase.ReaderPosition(
-        byte_offset=self.range_tracker.last_record_start))
+        byte_offset=snapshot))
 
   def request_dynamic_split(self, dynamic_split_request):
     assert dynamic_split_request is not None
@@ -89,6 +89,20 @@ class TestTextFileSource(unittest.TestCase):
     self.assertEqual(len(progress_record), 3)
     self.assertEqual(progress_record, [0, 6, 13])
 
+  def test_progress_snapshots(self):
+    lines = ['First', 'Second', 'Third']
+    source = fileio.TextFileSource(
+        file_path=self.create_temp_file('\n'.join(lines)))
+    snapshots = []
+    with source.reader() as reader:
+      self.assertTrue(reader.supports_progress_snapshots)
+      for _ in reader:
+        snapshots.append(reader.get_progress_snapshot())
+      self.assertEqual(
+          13, reader.progress_from_snapshot(
+              reader.get_progress_snapshot()).position.byte_offset)
+    self.assertEqual([0, 6, 13], snapshots)
+
   def try_splitting_reader_at(self, reader, split_request, expected_response):
     actual_response = reader.request_dynamic_split(split_request)
 
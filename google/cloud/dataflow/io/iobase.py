@@ -104,6 +104,30 @@ class NativeSourceReader(object):
     """
     return
 
+  @property
+  def supports_progress_snapshots(self):
+    """Returns whether this reader implements get_progress_snapshot."""
+    return False
+
+  def get_progress_snapshot(self):
+    """Returns a cheap snapshot of how far the reader has read.
+
+    Unlike get_progress, this may be called by a progress reporting thread
+    while another thread iterates over the reader. It must therefore only
+    read state that the iterating thread updates atomically, e.g. a single
+    attribute holding a number, and should not build any objects. Readers
+    supporting this let their progress be pulled on demand instead of having
+    get_progress called after every record.
+
+    Returns:
+      An opaque value, to be converted by progress_from_snapshot.
+    """
+    raise NotImplementedError
+
+  def progress_from_snapshot(self, snapshot):
+    """Returns the ReaderProgress for a get_progress_snapshot result."""
+    raise NotImplementedError
+
   def request_dynamic_split(self, dynamic_split_request):
     """Attempts to split the input in two parts.
 
@@ -15,6 +15,7 @@
 """iobase.RangeTracker implementations provided with Dataflow SDK.
 """
 
+import binascii
 import logging
 import math
 import threading
@@ -160,8 +161,16 @@ class GroupedShuffleRangeTracker(iobase.RangeTracker):
   first group at a particular position is considered a split point (because
   it is the first to be returned when reading a position range starting at this
   position), others are not.
+
+  Progress and split fractions are estimated by interpolation, treating
+  positions as big-endian fixed point numbers in [0, 1). An empty start
+  position stands for 0 and an empty stop position for 1.
   """
 
+  # Bytes of resolution added past the longest range bound when computing a
+  # position at a given fraction.
+  _POSITION_PRECISION_BYTES = 4
+
   def __init__(self, decoded_start_pos, decoded_stop_pos):
     super(GroupedShuffleRangeTracker, self).__init__()
     self._decoded_start_pos = decoded_start_pos
@@ -255,16 +264,55 @@ class GroupedShuffleRangeTracker(iobase.RangeTracker):
 
       logging.debug('Agreeing to split %r at %r'
                     , self, decoded_split_position)
+      split_fraction = self._fraction_at_position(decoded_split_position)
       self._decoded_stop_pos = decoded_split_position
-
-      # Since GroupedShuffleRangeTracker cannot determine relative sizes of the
-      # two splits, returning 0.5 as the fraction below so that the framework
-      # assumes the splits to be of the same size.
-      return self._decoded_stop_pos, 0.5
+      return self._decoded_stop_pos, split_fraction
+
+  def _fraction_at_position(self, decoded_position):
+    start, stop = self.start_position() or '', self.stop_position() or ''
+    length = max(len(start), len(stop), len(decoded_position))
+    start_value = _position_to_long(start, length)
+    stop_value = (_position_to_long(stop, length) if stop
+                  else 1 << (8 * length))
+    if stop_value <= start_value:
+      return 0.0
+    # Long division keeps the estimate exact however long the positions are.
+    scale = 1 << 32
+    fraction = (float((_position_to_long(decoded_position, length)
+                       - start_value) * scale // (stop_value - start_value))
+                / scale)
+    return max(0.0, min(1.0, fraction))
 
   def fraction_consumed(self):
-    # GroupingShuffle sources have special support on the service and the
-    # service will estimate progress from positions for us.
-    raise RuntimeError('GroupedShuffleRangeTracker does not measure fraction'
-                       ' consumed due to positions being opaque strings'
-                       ' that are interpretted by the service')
+    with self._lock:
+      if self.last_group_start() is None:
+        return 0.0
+      return self._fraction_at_position(self.last_group_start())
+
+  def position_at_fraction(self, fraction):
+    with self._lock:
+      start, stop = self.start_position() or '', self.stop_position() or ''
+      length = (max(len(start), len(stop)) +
+                GroupedShuffleRangeTracker._POSITION_PRECISION_BYTES)
+      start_value = _position_to_long(start, length)
+      stop_value = (_position_to_long(stop, length) if stop
+                    else 1 << (8 * length))
+      scale = 1 << 32
+      position_value = min(stop_value - 1, start_value + (
+          (stop_value - start_value) * long(fraction * scale) // scale))
+      # Trailing zero bytes are dropped to keep positions short. Positions
+      # compare byte-wise, so a stripped position sorts before the same
+      # position with zero bytes and may fall before a start position ending
+      # with zero bytes; it is then clamped to the start.
+      return max(start,
+                 _long_to_position(position_value, length).rstrip('\0'))
+
+
+def _position_to_long(position, length):
+  """Returns a position as a big-endian number, zero-padded to length bytes."""
+  return long(binascii.hexlify(position.ljust(length, '\0')) or '0', 16)
+
+
+def _long_to_position(value, length):
+  """Returns the length bytes long big-endian position for a number."""
+  return binascii.unhexlify('%0*x' % (2 * length, value))
@@ -312,6 +312,59 @@ class GroupedShuffleRangeTrackerTest(unittest.TestCase):
     self.assertFalse(tracker.try_claim(
         self.bytes_to_position([3, 2, 1])))
 
+  def test_get_fraction_consumed(self):
+    tracker = range_trackers.GroupedShuffleRangeTracker(
+        self.bytes_to_position([0, 0]), self.bytes_to_position([4, 0]))
+    self.assertEqual(0.0, tracker.fraction_consumed())
+    self.assertTrue(tracker.try_claim(self.bytes_to_position([1])))
+    self.assertEqual(0.25, tracker.fraction_consumed())
+    self.assertTrue(tracker.try_claim(self.bytes_to_position([2, 0, 0])))
+    self.assertEqual(0.5, tracker.fraction_consumed())
+    self.assertTrue(tracker.try_claim(self.bytes_to_position([3, 128])))
+    self.assertEqual(0.875, tracker.fraction_consumed())
+
+  def test_get_fraction_consumed_infinite_range(self):
+    tracker = range_trackers.GroupedShuffleRangeTracker('', '')
+    self.assertTrue(tracker.try_claim(self.bytes_to_position([64])))
+    self.assertEqual(0.25, tracker.fraction_consumed())
+    self.assertTrue(tracker.try_claim(self.bytes_to_position([192, 0, 1])))
+    self.assertAlmostEqual(0.75, tracker.fraction_consumed(), places=6)
+
+  def test_position_at_fraction(self):
+    tracker = range_trackers.GroupedShuffleRangeTracker(
+        self.bytes_to_position([1, 0]), self.bytes_to_position([3, 0]))
+    self.assertEqual(self.bytes_to_position([1, 0]),
+                     tracker.position_at_fraction(0.0))
+    self.assertEqual(self.bytes_to_position([2]),
+                     tracker.position_at_fraction(0.5))
+    self.assertEqual(self.bytes_to_position([2, 128]),
+                     tracker.position_at_fraction(0.75))
+    tracker = range_trackers.GroupedShuffleRangeTracker(
+        self.bytes_to_position([1]), self.bytes_to_position([1, 0, 1]))
+    self.assertEqual(self.bytes_to_position([1, 0, 0, 128]),
+                     tracker.position_at_fraction(0.5))
+    tracker = range_trackers.GroupedShuffleRangeTracker('', '')
+    self.assertEqual(self.bytes_to_position([64]),
+                     tracker.position_at_fraction(0.25))
+
+  def test_position_at_fraction_with_start_ending_in_zero(self):
+    start = self.bytes_to_position([1, 0, 0])
+    tracker = range_trackers.GroupedShuffleRangeTracker(
+        start, self.bytes_to_position([1, 0, 0, 0, 0, 0, 0, 0, 1]))
+    for fraction in (0.0, 1e-9, 0.5):
+      position = tracker.position_at_fraction(fraction)
+      self.assertGreaterEqual(position, start)
+      self.assertLess(position, tracker.stop_position())
+    self.assertEqual(start, tracker.position_at_fraction(0.0))
+
+  def test_try_split_returns_fraction(self):
+    tracker = range_trackers.GroupedShuffleRangeTracker(
+        self.bytes_to_position([0]), self.bytes_to_position([4]))
+    self.assertTrue(tracker.try_claim(self.bytes_to_position([1])))
+    self.assertEqual((self.bytes_to_position([3]), 0.75),
+                     tracker.try_split(self.bytes_to_position([3])))
+    self.assertAlmostEqual(1.0 / 3, tracker.fraction_consumed())
+
 
 if __name__ == '__main__':
   logging.getLogger().setLevel(logging.INFO)
@@ -19,10 +19,13 @@ cdef class DoFnRunner(object):
   cdef object dofn
   cdef object window_fn
   cdef object context
+  cdef object batch_context
+  cdef object dofn_process_batch
   cdef object tagged_receivers
   cdef object logger
   cdef object step_name
 
   cdef object main_receivers
 
+  cpdef process_batch(self, list elements)
   cpdef _process_outputs(self, element, results)
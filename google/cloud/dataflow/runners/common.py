@@ -26,6 +26,11 @@ from google.cloud.dataflow.transforms.window import WindowedValue
 from google.cloud.dataflow.transforms.window import WindowFn
 
 
+# The most main outputs of a DoFn.process_batch call held before being passed
+# downstream.
+MAX_OUTPUT_BATCH_SIZE = 100
+
+
 class FakeLogger(object):
   def PerThreadLoggingContext(self, *unused_args, **unused_kwargs):
     return self
@@ -51,6 +56,7 @@ class DoFnRunner(object):
                step_name=None):
     if not args and not kwargs:
       self.dofn = fn
+      self.dofn_process_batch = getattr(fn, 'process_batch', None)
     else:
       args, kwargs = util.insert_values_in_args(args, kwargs, side_inputs)
 
@@ -65,8 +71,15 @@ class DoFnRunner(object):
         def finish_bundle(self, context):
           return fn.finish_bundle(context, *args, **kwargs)
       self.dofn = CurriedFn()
+      if getattr(fn, 'process_batch', None) is None:
+        self.dofn_process_batch = None
+      else:
+        self.dofn_process_batch = (
+            lambda context: fn.process_batch(context, *args, **kwargs))
     self.window_fn = windowing.windowfn
     self.context = context
+    self.batch_context = core.DoFnProcessBatchContext(
+        context.label, state=context.state)
     self.tagged_receivers = tagged_receivers
     self.logger = logger or FakeLogger()
     self.step_name = step_name
@@ -96,6 +109,46 @@ class DoFnRunner(object):
     except BaseException as exn:
       self.reraise_augmented(exn)
 
+  def process_batch(self, elements):
+    """Processes a list of windowed values.
+
+    If the DoFn has a process_batch method, it is called once for the whole
+    batch and its main outputs are handed to the main receivers in batches of
+    at most MAX_OUTPUT_BATCH_SIZE values. Otherwise its process method is
+    called for each element, and the outputs stream downstream as they are
+    produced.
+    """
+    if self.dofn_process_batch is None:
+      for element in elements:
+        self.process(element)
+      return
+    main_receivers = self.main_receivers
+    collector = _BatchCollector(main_receivers, MAX_OUTPUT_BATCH_SIZE)
+    self.main_receivers = collector
+    try:
+      self._process_batch_outputs(elements)
+    finally:
+      self.main_receivers = main_receivers
+    collector.flush()
+
+  def _process_batch_outputs(self, elements):
+    try:
+      with self.logger.PerThreadLoggingContext(step_name=self.step_name):
+        self.batch_context.set_batch(elements)
+        try:
+          results = self.dofn_process_batch(self.batch_context)
+        finally:
+          # The DoFn may be reused, so its context must not keep the batch.
+          self.batch_context.set_batch(None)
+        if len(results) != len(elements):
+          raise ValueError(
+              'process_batch returned %d results for %d elements' % (
+                  len(results), len(elements)))
+        for element, result in zip(elements, results):
+          self._process_outputs(element, result)
+    except BaseException as exn:
+      self.reraise_augmented(exn)
+
   def reraise_augmented(self, exn):
     if getattr(exn, '_tagged_with_step', False) or not self.step_name:
       raise
@@ -150,6 +203,30 @@ class DoFnRunner(object):
       else:
         self.tagged_receivers[tag].output(windowed_value)
 
+
+class _BatchCollector(object):
+  """Stands in for the main receivers while a batch is being processed.
+
+  Outputs are passed on in batches of at most max_size values, so that the
+  outputs of a fanning out DoFn are never all held in memory.
+  """
+
+  def __init__(self, receivers, max_size):
+    self.receivers = receivers
+    self.max_size = max_size
+    self.windowed_values = []
+
+  def output(self, windowed_value):
+    self.windowed_values.append(windowed_value)
+    if len(self.windowed_values) >= self.max_size:
+      self.flush()
+
+  def flush(self):
+    if self.windowed_values:
+      self.receivers.output_batch(self.windowed_values)
+      self.windowed_values = []
+
+
 class NoContext(WindowFn.AssignContext):
   """An uninspectable WindowFn.AssignContext."""
   NO_VALUE = object()
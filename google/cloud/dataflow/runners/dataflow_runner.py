@@ -33,6 +33,7 @@ from google.cloud.dataflow.runners.runner import PipelineResult
 from google.cloud.dataflow.runners.runner import PipelineRunner
 from google.cloud.dataflow.runners.runner import PipelineState
 from google.cloud.dataflow.runners.runner import PValueCache
+from google.cloud.dataflow.transforms.core import GroupByKeyAndSortValues
 from google.cloud.dataflow.typehints import typehints
 from google.cloud.dataflow.utils import names
 from google.cloud.dataflow.utils.names import PropertyNames
@@ -325,6 +326,14 @@ class DataflowPipelineRunner(PipelineRunner):
     # TODO(robertwb): Update the coder itself if it changed.
     coders.registry.verify_deterministic(
         coder.key_coder(), 'GroupByKey operation "%s"' % transform.label)
+    if isinstance(transform, GroupByKeyAndSortValues):
+      value_coder = coder.value_coder()
+      if not value_coder.is_kv_coder():
+        raise ValueError(('Coder for the values of the GroupByKeyAndSortValues '
+                          'operation "%s" is not a key-value coder: %s.') % (
+                              transform.label, value_coder))
+      # The shuffle sorts the values by their encoded sort keys.
+      value_coder.key_coder().sort_key_coder()
 
     return pvalue.PCollection(pcoll.pipeline)
 
@@ -348,6 +357,9 @@ class DataflowPipelineRunner(PipelineRunner):
     windowing = transform_node.transform.get_windowing(
         transform_node.inputs)
     step.add_property(PropertyNames.SERIALIZED_FN, pickler.dumps(windowing))
+    if isinstance(transform_node.transform, GroupByKeyAndSortValues):
+      # The shuffle sorts the values of each key by their encoded sort keys.
+      step.add_property(PropertyNames.SORT_VALUES, True)
 
   def run_ParDo(self, transform_node):
     transform = transform_node.transform
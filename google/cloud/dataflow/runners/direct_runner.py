@@ -175,10 +175,14 @@ class DirectPipelineRunner(PipelineRunner):
                         side_inputs, transform_node.inputs[0].windowing,
                         context, TaggedReceivers(),
                         step_name=transform_node.full_label)
-    runner.start()
-    for v in self._cache.get_pvalue(transform_node.inputs[0]):
-      runner.process(v)
-    runner.finish()
+    transform.dofn.setup()
+    try:
+      runner.start()
+      for v in self._cache.get_pvalue(transform_node.inputs[0]):
+        runner.process(v)
+      runner.finish()
+    finally:
+      transform.dofn.teardown()
 
     self._cache.cache_output(transform_node, [])
     for tag, value in results.items():
@@ -61,6 +61,47 @@ class RunnerTest(unittest.TestCase):
     remote_runner.job = apiclient.Job(p.options)
     super(DataflowPipelineRunner, remote_runner).run(p)
 
+  def test_remote_runner_sort_values_translation(self):
+    remote_runner = DataflowPipelineRunner()
+    p = Pipeline(remote_runner,
+                 options=PipelineOptions([
+                     '--dataflow_endpoint=ignored',
+                     '--job_name=test-job',
+                     '--project=test-project',
+                     '--staging_location=ignored',
+                     '--temp_location=/dev/null',
+                     '--no_auth=True'
+                 ]))
+
+    (p | ptransform.Create('create', [1, 2, 3])  # pylint: disable=expression-not-assigned
+     | ptransform.FlatMap('do', lambda x: [(x, (str(x), x))])
+     | ptransform.GroupByKeyAndSortValues('gbk'))
+    remote_runner.job = apiclient.Job(p.options)
+    super(DataflowPipelineRunner, remote_runner).run(p)
+    sort_values = {}
+    for step in remote_runner.job.proto.steps:
+      for prop in step.properties.additionalProperties:
+        if prop.key == 'sort_values':
+          sort_values[step.kind] = prop.value
+    self.assertEqual(['GroupByKey'], sort_values.keys())
+
+  def test_remote_runner_rejects_unordered_sort_keys(self):
+    remote_runner = DataflowPipelineRunner()
+    p = Pipeline(remote_runner,
+                 options=PipelineOptions([
+                     '--dataflow_endpoint=ignored',
+                     '--job_name=test-job',
+                     '--project=test-project',
+                     '--staging_location=ignored',
+                     '--temp_location=/dev/null',
+                     '--no_auth=True'
+                 ]))
+
+    pcoll = (p | ptransform.Create('create', [1, 2, 3])
+             | ptransform.FlatMap('do', lambda x: [(x, (float(x), x))]))
+    with self.assertRaisesRegexp(ValueError, 'does not preserve the order'):
+      pcoll | ptransform.GroupByKeyAndSortValues('gbk')  # pylint: disable=expression-not-assigned
+
 
 if __name__ == '__main__':
   unittest.main()
@@ -20,6 +20,7 @@ import heapq
 import itertools
 import random
 
+from google.cloud.dataflow.coders.coder_impl import get_varint_size
 from google.cloud.dataflow.transforms import core
 from google.cloud.dataflow.transforms import cy_combiners
 from google.cloud.dataflow.transforms import ptransform
@@ -134,6 +135,9 @@ class CountCombineFn(core.CombineFn):
   def extract_output(self, accumulator):
     return accumulator
 
+  def estimate_accumulator_size(self, accumulator):
+    return get_varint_size(accumulator)
+
 
 class Top(object):
   """Combiners for obtaining extremal elements."""
@@ -488,6 +492,9 @@ def curry_combine_fn(fn, args, kwargs):
       def apply(self, elements):
         return fn.apply(elements, *args, **kwargs)
 
+      def estimate_accumulator_size(self, accumulator):
+        return fn.estimate_accumulator_size(accumulator)
+
     return CurriedFn()
 
 
@@ -51,6 +51,13 @@ class CombineTest(unittest.TestCase):
     assert_that(result_key_count, equal_to([('a', size)]), label='key:size')
     pipeline.run()
 
+  def test_count_accumulator_size(self):
+    count_fn = combine.CountCombineFn()
+    # Counts are sized as varints.
+    self.assertEqual(1, count_fn.estimate_accumulator_size(0))
+    self.assertEqual(2, count_fn.estimate_accumulator_size(300))
+    self.assertEqual(5, count_fn.estimate_accumulator_size(1 << 30))
+
   def test_top(self):
     pipeline = Pipeline('DirectPipelineRunner')
 
@@ -107,6 +107,32 @@ class DoFnProcessContext(object):
     self.state.counter_for(aggregator).update(input_value)
 
 
+class DoFnProcessBatchContext(DoFnProcessContext):
+  """A processing context passed to DoFn.process_batch during execution.
+
+  Attributes:
+    label: label of the ParDo whose elements are being processed.
+    elements: list of the elements being processed.
+    windowed_values: list of the WindowedValues holding the elements, in the
+      same order as elements.
+    state: a DoFnState object, which holds the runner's internal state
+      for this batch.  For example, aggregator state is here.
+      Not used by the pipeline code.
+  """
+
+  def __init__(self, label, windowed_values=None, state=None):
+    super(DoFnProcessBatchContext, self).__init__(label, state=state)
+    self.set_batch(windowed_values)
+
+  def set_batch(self, windowed_values):
+    if windowed_values is None:
+      # Not currently processing a batch.
+      self.windowed_values = self.elements = None
+    else:
+      self.windowed_values = windowed_values
+      self.elements = [wv.value for wv in windowed_values]
+
+
 class DoFn(WithTypeHints):
   """A function object used by a transform with custom processing.
 
@@ -117,6 +143,13 @@ class DoFn(WithTypeHints):
   In order to have concrete DoFn objects one has to subclass from DoFn and
   define the desired behavior (start_bundle/finish_bundle and process) or wrap a
   callable object using the CallableWrapperDoFn class.
+
+  A DoFn may additionally define a process_batch(context, *args, **kwargs)
+  method taking a DoFnProcessBatchContext. Runners that hand elements over in
+  batches will then call it instead of process. It must return a list with
+  one entry per element of context.elements, each entry being what process
+  would have returned for that element. This lets DoFns amortize their
+  per-element overhead, e.g. by operating on whole arrays at once.
   """
 
   def default_label(self):
@@ -128,6 +161,23 @@ class DoFn(WithTypeHints):
     return self._strip_output_annotations(
         trivial_inference.infer_return_type(self.process, [input_type]))
 
+  def setup(self):
+    """Called once to initialize a DoFn instance, before any bundle.
+
+    Runners may reuse a DoFn instance for many bundles, so this is the place
+    for expensive initialization such as loading a model or opening a
+    connection pool, rather than start_bundle.
+    """
+    pass
+
+  def teardown(self):
+    """Called once when a DoFn instance is discarded by a runner.
+
+    Undoes the work of setup. Runners call it on a best-effort basis, so it
+    may not be called at all, e.g. if a worker crashes.
+    """
+    pass
+
   def start_bundle(self, context, *args, **kwargs):
     """Called before a bundle of elements is processed on a worker.
 
@@ -341,6 +391,20 @@ class CombineFn(WithTypeHints):
             *args, **kwargs),
         *args, **kwargs)
 
+  def estimate_accumulator_size(self, accumulator):
+    """Returns an estimate of the encoded size of accumulator, in bytes.
+
+    Runners use this to bound the memory held by accumulators that are
+    combined before a GroupByKey. Returning None, as the default
+    implementation does, makes them fall back to encoding the accumulator
+    with its coder, so overriding this is only worthwhile when the size is
+    much cheaper to compute than the encoding.
+
+    Args:
+      accumulator: the accumulator to estimate the size of.
+    """
+    return None
+
   def for_input_type(self, input_type):
     """Returns a specialized implementation of self, if it exists.
 
@@ -1045,6 +1109,35 @@ class GroupByKey(PTransform):
                       self.GroupAlsoByWindow(pcoll.windowing)))
 
 
+class GroupByKeyAndSortValues(GroupByKey):
+  """A group by key transform also sorting the values of each key.
+
+  Processes an input PCollection consisting of key/value pairs whose values are
+  (sort key, value) pairs. The result is a PCollection where the values having a
+  common key are grouped together, in the order of their sort keys. For example
+  (a, (2, x)), (b, (1, y)), (a, (1, z)) will result into
+  (a, [(1, z), (2, x)]), (b, [(1, y)]).
+
+  When run by the Dataflow service the values are sorted by the shuffle, as they
+  are grouped, rather than in memory. The shuffle compares the sort keys as
+  encoded by the sort_key_coder() of their coder, so they must be of a type with
+  an order-preserving encoding, such as str, unicode, int or Timestamp.
+  """
+
+  class SortValues(DoFn):
+
+    def process(self, context):
+      k, vs = context.element
+      return [(k, sorted(vs, key=lambda sort_key_and_value: (
+          sort_key_and_value[0])))]
+
+  def apply(self, pcoll):
+    # This code path is only used in the local direct runner, which sorts the
+    # values of each key in memory once they are grouped.
+    return (super(GroupByKeyAndSortValues, self).apply(pcoll)
+            | ParDo('sort_values', self.SortValues()))
+
+
 K = typehints.TypeVariable('K')
 V = typehints.TypeVariable('V')
 @typehints.with_input_types(typehints.KV[K, V])
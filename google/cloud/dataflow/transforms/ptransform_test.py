@@ -24,12 +24,16 @@ import unittest
 import google.cloud.dataflow as df
 from google.cloud.dataflow.pipeline import Pipeline
 import google.cloud.dataflow.pvalue as pvalue
+from google.cloud.dataflow.runners.common import DoFnRunner
 import google.cloud.dataflow.transforms.combiners as combine
 from google.cloud.dataflow.transforms.ptransform import PTransform
 from google.cloud.dataflow.transforms.util import assert_that, equal_to
+from google.cloud.dataflow.transforms.window import GlobalWindows
 import google.cloud.dataflow.typehints as typehints
 from google.cloud.dataflow.typehints import with_input_types
 from google.cloud.dataflow.typehints import with_output_types
+from google.cloud.dataflow.typehints.typecheck import OutputCheckWrapperDoFn
+from google.cloud.dataflow.typehints.typecheck import TypeCheckWrapperDoFn
 from google.cloud.dataflow.typehints.typehints_test import TypeHintTestCase
 from google.cloud.dataflow.utils.options import PipelineOptions
 from google.cloud.dataflow.utils.options import TypeOptions
@@ -322,6 +326,23 @@ class PTransformTest(unittest.TestCase):
     assert_that(result, equal_to([(1, [1, 2, 3]), (2, [1, 2]), (3, [1])]))
     pipeline.run()
 
+  def test_group_by_key_and_sort_values(self):
+    pipeline = Pipeline('DirectPipelineRunner')
+    pcoll = pipeline | df.Create(
+        'start', [(1, ('b', 1)), (2, ('a', 1)), (1, ('c', 2)), (1, ('a', 3))])
+    result = pcoll | df.GroupByKeyAndSortValues('group')
+    assert_that(result, equal_to([(1, [('a', 3), ('b', 1), ('c', 2)]),
+                                  (2, [('a', 1)])]))
+    pipeline.run()
+
+  def test_group_by_key_and_sort_values_in_numeric_order(self):
+    pipeline = Pipeline('DirectPipelineRunner')
+    pcoll = pipeline | df.Create(
+        'start', [(1, (200, 'a')), (1, (-1, 'b')), (1, (3, 'c'))])
+    result = pcoll | df.GroupByKeyAndSortValues('group')
+    assert_that(result, equal_to([(1, [(-1, 'b'), (3, 'c'), (200, 'a')])]))
+    pipeline.run()
+
   def test_partition_with_partition_fn(self):
 
     class SomePartitionFn(df.PartitionFn):
@@ -1025,6 +1046,89 @@ class PTransformTypeCheckTestCase(TypeHintTestCase):
                                   (4, ['t', 'e', 't'])]))
     self.p.run()
 
+  def run_type_checked_batch(self, dofn, elements):
+    outputs = []
+
+    class RecordingReceivers(object):
+
+      def output(self, windowed_value):
+        outputs.append(windowed_value.value)
+
+      def output_batch(self, windowed_values):
+        outputs.extend(v.value for v in windowed_values)
+
+    pardo = df.ParDo('to str', dofn)
+    dofn = OutputCheckWrapperDoFn(
+        TypeCheckWrapperDoFn(dofn, pardo.get_type_hints()), 'to str')
+    runner = DoFnRunner(
+        dofn, [], {}, [], df.core.Windowing(GlobalWindows()),
+        df.DoFnProcessContext('to str'), {None: RecordingReceivers()})
+    runner.process_batch(
+        [GlobalWindows.windowed_value(e) for e in elements])
+    return outputs
+
+  def test_run_time_type_checking_of_process_batch(self):
+    batches = []
+
+    @with_input_types(int)
+    @with_output_types(str)
+    class ToStr(df.DoFn):
+
+      def process(self, context):
+        return [str(context.element)]
+
+      def process_batch(self, context):
+        batches.append(context.elements)
+        return [[str(e)] for e in context.elements]
+
+    # The DoFn's process_batch is called through the type-checking wrappers.
+    self.assertEqual(['1', '2'], self.run_type_checked_batch(ToStr(), [1, 2]))
+    self.assertEqual([[1, 2]], batches)
+
+    with self.assertRaises(typehints.TypeCheckError) as e:
+      self.run_type_checked_batch(ToStr(), [1, 'a'])
+    self.assertStartswith(
+        e.exception.message,
+        "Runtime type violation detected within ParDo(to str): "
+        "Type-hint for argument: 'context.element' violated. "
+        "Expected an instance of <type 'int'>, "
+        "instead found a, an instance of <type 'str'>.")
+
+  def test_run_time_type_checking_without_process_batch(self):
+
+    @with_input_types(int)
+    @with_output_types(str)
+    class ToStr(df.DoFn):
+
+      def process(self, context):
+        return [str(context.element)]
+
+    # Batches are processed one element at a time.
+    self.assertEqual(['1', '2'], self.run_type_checked_batch(ToStr(), [1, 2]))
+    with self.assertRaises(typehints.TypeCheckError):
+      self.run_type_checked_batch(ToStr(), ['a'])
+
+  def test_run_time_type_checking_of_process_batch_outputs(self):
+
+    @with_input_types(int)
+    @with_output_types(str)
+    class ToInt(df.DoFn):
+
+      def process(self, context):
+        return [context.element]
+
+      def process_batch(self, context):
+        return [[e] for e in context.elements]
+
+    with self.assertRaises(typehints.TypeCheckError) as e:
+      self.run_type_checked_batch(ToInt(), [1])
+    self.assertStartswith(
+        e.exception.message,
+        "Runtime type violation detected within ParDo(to str): "
+        "According to type-hint expected output should be of type "
+        "<type 'str'>. Instead, received '1', an instance of type "
+        "<type 'int'>.")
+
   def test_pipeline_checking_satisfied_but_run_time_types_violate(self):
     self.p.options.view_as(TypeOptions).pipeline_type_check = False
     self.p.options.view_as(TypeOptions).runtime_type_check = True
@@ -310,6 +310,9 @@ class FixedWindows(WindowFn):
   def merge(self, merge_context):
     pass  # No merging.
 
+  def get_window_coder(self):
+    return coders.IntervalWindowCoder()
+
 
 class SlidingWindows(WindowFn):
   """A windowing function that assigns each element to a set of sliding windows.
@@ -342,6 +345,9 @@ class SlidingWindows(WindowFn):
   def merge(self, merge_context):
     pass  # No merging.
 
+  def get_window_coder(self):
+    return coders.IntervalWindowCoder()
+
 
 class Sessions(WindowFn):
   """A windowing function that groups elements into sessions.
@@ -381,3 +387,6 @@ class Sessions(WindowFn):
         end = w.end
     if len(to_merge) > 1:
       merge_context.merge(to_merge, IntervalWindow(to_merge[0].start, end))
+
+  def get_window_coder(self):
+    return coders.IntervalWindowCoder()
@@ -50,6 +50,15 @@ class TypeCheckWrapperDoFn(DoFn):
     self.context_var = 'context'
     # TODO(robertwb): Multi-output.
     self._output_type_hint = type_hints.simple_output_type(label)
+    if getattr(dofn, 'process_batch', None) is None:
+      # Runners call process for each element when there is no process_batch.
+      self.process_batch = None
+
+  def setup(self):
+    self._dofn.setup()
+
+  def teardown(self):
+    self._dofn.teardown()
 
   def start_bundle(self, context, *args, **kwargs):
     return self._type_check_result(
@@ -61,16 +70,28 @@ class TypeCheckWrapperDoFn(DoFn):
 
   def process(self, context, *args, **kwargs):
     if self._input_hints:
-      actual_inputs = inspect.getcallargs(
-          self._process_fn, context.element, *args, **kwargs)
-      for var, hint in self._input_hints.items():
-        if hint is actual_inputs[var]:
-          # self parameter
-          continue
-        var_name = var + '.element' if var == self.context_var else var
-        _check_instance_type(hint, actual_inputs[var], var_name, True)
+      self._type_check_inputs(context.element, args, kwargs)
     return self._type_check_result(self._dofn.process(context, *args, **kwargs))
 
+  def process_batch(self, context, *args, **kwargs):
+    if self._input_hints:
+      for element in context.elements:
+        self._type_check_inputs(element, args, kwargs)
+    results = self._dofn.process_batch(context, *args, **kwargs)
+    if results is None:
+      return results
+    return [self._type_check_result(result) for result in results]
+
+  def _type_check_inputs(self, element, args, kwargs):
+    actual_inputs = inspect.getcallargs(
+        self._process_fn, element, *args, **kwargs)
+    for var, hint in self._input_hints.items():
+      if hint is actual_inputs[var]:
+        # self parameter
+        continue
+      var_name = var + '.element' if var == self.context_var else var
+      _check_instance_type(hint, actual_inputs[var], var_name, True)
+
   def _type_check_result(self, transform_results):
     if self._output_type_hint is None or transform_results is None:
       return transform_results
@@ -125,6 +146,9 @@ class OutputCheckWrapperDoFn(DoFn):
   def __init__(self, dofn, full_label):
     self.dofn = dofn
     self.full_label = full_label
+    if getattr(dofn, 'process_batch', None) is None:
+      # Runners call process for each element when there is no process_batch.
+      self.process_batch = None
 
   def run(self, method, context, args, kwargs):
     try:
@@ -136,6 +160,12 @@ class OutputCheckWrapperDoFn(DoFn):
     else:
       return self._check_type(result)
 
+  def setup(self):
+    self.dofn.setup()
+
+  def teardown(self):
+    self.dofn.teardown()
+
   def start_bundle(self, context, *args, **kwargs):
     return self.run(self.dofn.start_bundle, context, args, kwargs)
 
@@ -145,6 +175,13 @@ class OutputCheckWrapperDoFn(DoFn):
   def process(self, context, *args, **kwargs):
     return self.run(self.dofn.process, context, args, kwargs)
 
+  def process_batch(self, context, *args, **kwargs):
+    # Each entry of the list is what process returns for one element.
+    results = self.run(self.dofn.process_batch, context, args, kwargs)
+    if results is None:
+      return results
+    return [self._check_type(result) for result in results]
+
   def _check_type(self, output):
     if output is None:
       return output
@@ -66,6 +66,7 @@ class PropertyNames(object):
   PUBSUB_ID_LABEL = 'pubsub_id_label'
   SERIALIZED_FN = 'serialized_fn'
   SHARD_NAME_TEMPLATE = 'shard_template'
+  SORT_VALUES = 'sort_values'
   SOURCE_STEP_INPUT = 'custom_source_step_input'
   STEP_NAME = 'step_name'
   USER_FN = 'user_fn'
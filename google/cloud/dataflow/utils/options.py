@@ -339,6 +339,104 @@ class WorkerOptions(PipelineOptions):
         help=
         ('The teardown policy for the VMs. By default this is left unset and '
          'the service sets the default policy.'))
+    parser.add_argument(
+        '--pgbk_max_buffer_bytes',
+        type=int,
+        default=None,
+        help=
+        ('Estimated encoded size, in bytes, of the values a worker buffers in '
+         'memory for a partial group-by-key before flushing the least '
+         'recently used keys. If not set, a reasonable default is used.'))
+    parser.add_argument(
+        '--side_input_cache_max_bytes',
+        type=int,
+        default=None,
+        help=
+        ('Estimated encoded size, in bytes, of the side inputs a worker keeps '
+         'cached across work items, in memory or spilled to local disk. '
+         'Cached side inputs are shared by all the DoFns reading them, which '
+         'must not mutate them. If not set, side inputs are not cached.'))
+    parser.add_argument(
+        '--side_input_spill_threshold_bytes',
+        type=int,
+        default=None,
+        help=
+        ('Estimated encoded size, in bytes, over which list and dict side '
+         'inputs are written to an indexed, memory-mapped local file and '
+         'decoded on demand instead of being kept in memory. If not set, side '
+         'inputs are always kept in memory.'))
+    parser.add_argument(
+        '--dofn_cache_max_entries',
+        type=int,
+        default=None,
+        help=
+        ('Number of idle deserialized DoFn instances a worker keeps for reuse '
+         'by later work items, so that their setup is not repeated. Use 0 to '
+         'disable the cache. If not set, a reasonable default is used.'))
+    parser.add_argument(
+        '--shuffle_read_ahead_chunks',
+        type=int,
+        default=None,
+        help=
+        ('Number of chunks shuffle readers fetch ahead in the background '
+         'while the current chunk is processed, within a bounded memory '
+         'budget. If not set, chunks are fetched on demand.'))
+    parser.add_argument(
+        '--shuffle_write_buffer_bytes',
+        type=int,
+        default=None,
+        help=
+        ('Size, in bytes, of the buffers in which shuffle entries are encoded '
+         'before being written to the shuffler. If not set, a reasonable '
+         'default is used.'))
+    parser.add_argument(
+        '--shuffle_write_queue_depth',
+        type=int,
+        default=None,
+        help=
+        ('Number of full shuffle write buffers that may wait to be written '
+         'by a background thread while the next one is encoded. Use 0 to '
+         'write buffers synchronously. If not set, a reasonable default is '
+         'used.'))
+    parser.add_argument(
+        '--shuffle_compression_level',
+        type=int,
+        choices=range(-1, 10),
+        default=None,
+        help=
+        ('If set, the values written to shuffle with the same key are '
+         'zlib-compressed together in blocks, at this level from 0 (no '
+         'compression) to 9 (best compression), or -1 for the zlib default. '
+         'Compression trades some CPU for less shuffle I/O on compressible '
+         'data. Shuffle readers decompress values when it is set, so it '
+         'applies to all the shuffles of the job. If not set, values are not '
+         'compressed.'))
+    parser.add_argument(
+        '--shuffle_reiteration_cache_bytes',
+        type=int,
+        default=None,
+        help=
+        ('Encoded size, in bytes, up to which the values of a key read from '
+         'a grouped shuffle are kept in memory, so that iterating over them '
+         'again does not read them from the shuffle again. Use 0 to disable '
+         'the cache. If not set, a reasonable default is used.'))
+    parser.add_argument(
+        '--shuffle_concurrent_read_ranges',
+        type=int,
+        default=None,
+        help=
+        ('Number of sub-ranges a grouped shuffle read cuts its position range '
+         'into and reads concurrently, each with its own shuffle reader. If '
+         'not set, the range is read sequentially.'))
+    parser.add_argument(
+        '--shuffle_read_ahead_spill_bytes',
+        type=int,
+        default=None,
+        help=
+        ('Number of bytes a grouped shuffle read with concurrent sub-ranges '
+         'may spill to local disk, in total, for the sub-ranges waiting to be '
+         'consumed to keep reading ahead once their memory is full. If not '
+         'set, nothing is spilled.'))
 
   def validate(self, validator):
     errors = []
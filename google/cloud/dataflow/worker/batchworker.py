@@ -57,6 +57,7 @@ from google.cloud.dataflow.worker import environment
 from google.cloud.dataflow.worker import executor
 from google.cloud.dataflow.worker import logger
 from google.cloud.dataflow.worker import maptask
+from google.cloud.dataflow.worker import sideinputs
 from google.cloud.dataflow.worker import workitem
 
 from apitools.base.py.exceptions import HttpError
@@ -296,6 +297,8 @@ class BatchWorker(object):
   STATUS_HTTP_PORT = 0  # A value of 0 will pick a random unused port.
   MEMORY_USAGE_REPORTING_INTERVAL_SECS = 5 * 60
   DEFAULT_LEASE_DURATION_SECS = 3 * 60.0
+  # Number of idle DoFn instances kept for reuse by later work items.
+  DEFAULT_DOFN_CACHE_MAX_ENTRIES = 100
 
   last_memory_usage_report_time = None
 
@@ -309,6 +312,19 @@ class BatchWorker(object):
     self.environment_info_path = properties.get('environment_info_path', None)
     self.pipeline_options = options.PipelineOptions.from_dictionary(
         sdk_pipeline_options)
+    worker_options = self.pipeline_options.view_as(options.WorkerOptions)
+    # Cached side input views are shared by the work items of the worker, so
+    # the cache is only used when asked for.
+    side_input_cache_max_bytes = worker_options.side_input_cache_max_bytes
+    self.side_input_cache = (
+        sideinputs.SideInputCache(side_input_cache_max_bytes)
+        if side_input_cache_max_bytes else None)
+    dofn_cache_max_entries = worker_options.dofn_cache_max_entries
+    if dofn_cache_max_entries is None:
+      dofn_cache_max_entries = self.DEFAULT_DOFN_CACHE_MAX_ENTRIES
+    self.dofn_cache = (
+        executor.DoFnCache(dofn_cache_max_entries)
+        if dofn_cache_max_entries > 0 else None)
     self.capabilities = [self.worker_id, 'remote_source', 'custom_source']
     self.work_types = ['map_task', 'seq_map_task', 'remote_source_task']
     # The following properties are passed to the worker when its container
@@ -337,6 +353,8 @@ class BatchWorker(object):
     self.profile_location = sdk_pipeline_options.get('profile_location', None)
 
     self._shutdown = False
+    # The executor of the work item being executed, shown by the status server.
+    self.current_executor = None
 
   def worker_info_for_client(self):
     return BatchWorkerInfo(self.worker_id, self.project_id, self.job_id,
@@ -425,7 +443,9 @@ class BatchWorker(object):
 
   def get_executor_for_work_item(self, work_item):
     if work_item.map_task is not None:
-      return executor.MapTaskExecutor(work_item.map_task)
+      return executor.MapTaskExecutor(
+          work_item.map_task, pipeline_options=self.pipeline_options,
+          side_input_cache=self.side_input_cache, dofn_cache=self.dofn_cache)
     elif work_item.source_operation_split_task is not None:
       return executor.CustomSourceSplitExecutor(
           work_item.source_operation_split_task)
@@ -438,6 +458,7 @@ class BatchWorker(object):
     BatchWorker.log_memory_usage_if_needed(self.worker_id, force=True)
 
     work_executor = self.get_executor_for_work_item(work_item)
+    self.current_executor = work_executor
     progress_reporter = ProgressReporter(
         work_item, work_executor, self, self.client)
 
@@ -492,6 +513,7 @@ class BatchWorker(object):
 
   def status_server(self):
     """Executes the serving loop for the status server."""
+    worker = self
 
     class StatusHttpHandler(BaseHTTPServer.BaseHTTPRequestHandler):
       """HTTP handler for serving stacktraces of all worker threads."""
@@ -505,6 +527,13 @@ class BatchWorker(object):
         for t in threading.enumerate():
           self.wfile.write('--- Thread #%s name: %s ---\n' % (t.ident, t.name))
           self.wfile.write(''.join(traceback.format_stack(frames[t.ident])))
+        # Time spent so far in the steps of the current (or last) work item.
+        state_sampler = getattr(worker.current_executor, 'state_sampler', None)
+        if state_sampler is not None:
+          self.wfile.write('--- Execution time per step ---\n')
+          for state in state_sampler.get_states():
+            self.wfile.write('%s %s: %d msecs\n' % (
+                state.step_name, state.state_name, state.msecs))
 
       def log_message(self, f, *args):
         """Do not log any messages."""
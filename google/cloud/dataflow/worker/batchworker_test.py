@@ -40,6 +40,13 @@ class BatchWorkerTest(unittest.TestCase):
         'temp_gcs_directory': 'test_temp_gcs_directory'
     }
 
+  def test_side_input_cache_is_opt_in(self):
+    worker = batchworker.BatchWorker(self.dummy_properties(), {})
+    self.assertIsNone(worker.side_input_cache)
+    worker = batchworker.BatchWorker(
+        self.dummy_properties(), {'side_input_cache_max_bytes': 1 << 20})
+    self.assertEqual(1 << 20, worker.side_input_cache.max_bytes)
+
   @patch('google.cloud.dataflow.worker.batchworker.workitem')
   @patch.object(apiclient.DataflowWorkerClient, 'lease_work')
   def test_worker_requests_for_work(self, mock_lease_work, mock_workitem):
@@ -22,13 +22,18 @@ cdef class Operation(object):
   cdef readonly bint debug_logging_enabled
 
   cdef public step_name  # initialized lazily
+  cdef public object state_sampler
 
   cpdef start(self)
   cpdef process(self, windowed_value)
+  cpdef process_batch(self, list windowed_values)
   cpdef finish(self)
+  cpdef abort(self)
 
   @cython.locals(receiver=Operation)
   cpdef output(self, windowed_value, object coder=*, int output_index=*)
+  cpdef output_batch(self, list windowed_values, object coder=*,
+                     int output_index=*)
 
 cdef class ReadOperation(Operation):
   cdef object _current_progress
@@ -37,7 +42,16 @@ cdef class ReadOperation(Operation):
 cdef class DoOperation(Operation):
   cdef object state
   cdef object context
-  cdef object dofn_runner
+  cdef object side_input_cache
+  cdef object side_input_spill_bytes
+  cdef object dofn_cache
+  cdef object fn_data
+  cdef public object dofn_runner
+
+cdef class FusedDoOperation(Operation):
+  cdef public list operations
+  cdef object _process
+  cdef object _process_batch
 
 cdef class CombineOperation(Operation):
   cdef object phased_combine_fn
@@ -46,14 +60,26 @@ cdef class ShuffleWriteOperation(Operation):
   cdef object shuffle_sink
   cdef object writer
   cdef object _write_coder
+  cdef object _secondary_key_coder
   cdef bint is_ungrouped
+  cdef bint sorts_values
+  cdef object write_buffer_bytes
+  cdef object write_queue_depth
+  cdef object compression_level
 
 cdef class GroupedShuffleReadOperation(Operation):
   cdef object shuffle_source
+  cdef int read_ahead_chunks
+  cdef object reiteration_cache_bytes
+  cdef int concurrent_ranges
+  cdef bint compressed_values
+  cdef long read_ahead_spill_bytes
   cdef object _reader
 
 cdef class UngroupedShuffleReadOperation(Operation):
   cdef object shuffle_source
+  cdef int read_ahead_chunks
+  cdef bint compressed_values
   cdef object _reader
 
 cdef class FlattenOperation(Operation):
@@ -74,7 +100,12 @@ cdef class StreamingGroupAlsoByWindowsOperation(Operation):
 cdef class PGBKCVOperation(Operation):
   cdef public object combine_fn
   cdef dict table
-  cdef long max_keys
-  cdef long key_count
+  cdef object lru_keys
+  cdef public long max_size
+  cdef public long size
+  cdef object key_coder
+  cdef object accumulator_coder
+  cdef object evicted_keys_counter
+  cdef object evicted_bytes_counter
 
   cpdef output_key(self, tuple wkey, value)
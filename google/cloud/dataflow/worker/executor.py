@@ -17,13 +17,17 @@
 """Worker operations executor."""
 
 import collections
+import hashlib
 import itertools
 import logging
 import random
+import sys
+import threading
 
 
 from google.cloud.dataflow import pvalue
 from google.cloud.dataflow.coders import BytesCoder
+from google.cloud.dataflow.coders import IterableCoder
 from google.cloud.dataflow.coders import TupleCoder
 from google.cloud.dataflow.coders import WindowedValueCoder
 from google.cloud.dataflow.internal import apiclient
@@ -32,7 +36,6 @@ from google.cloud.dataflow.io import iobase
 from google.cloud.dataflow.pvalue import EmptySideInput
 from google.cloud.dataflow.runners import common
 import google.cloud.dataflow.transforms as ptransform
-from google.cloud.dataflow.transforms import combiners
 from google.cloud.dataflow.transforms import trigger
 from google.cloud.dataflow.transforms.combiners import curry_combine_fn
 from google.cloud.dataflow.transforms.combiners import PhasedCombineFnExecutor
@@ -40,12 +43,15 @@ from google.cloud.dataflow.transforms.trigger import InMemoryUnmergedState
 from google.cloud.dataflow.transforms.window import GlobalWindows
 from google.cloud.dataflow.transforms.window import MIN_TIMESTAMP
 from google.cloud.dataflow.transforms.window import WindowedValue
+from google.cloud.dataflow.utils.counters import Counter
 from google.cloud.dataflow.utils.names import PropertyNames
+from google.cloud.dataflow.utils.options import WorkerOptions
 from google.cloud.dataflow.worker import logger
 from google.cloud.dataflow.worker import maptask
 from google.cloud.dataflow.worker import opcounters
 from google.cloud.dataflow.worker import shuffle
 from google.cloud.dataflow.worker import sideinputs
+from google.cloud.dataflow.worker import statesampler
 
 
 class ReceiverSet(object):
@@ -63,24 +69,58 @@ class ReceiverSet(object):
     self.counter_factory = counter_factory
     self.output_index = output_index
     self.coder = coder
+    self.state_sampler = None
+    self.receiver_states = None
 
   def add_receiver(self, receiving_operation):
     self.receivers.append(receiving_operation)
 
-  def start(self, step_name):
+  def start(self, step_name, state_sampler=None):
     self.opcounter = opcounters.OperationCounters(
         self.counter_factory, step_name, self.coder, self.output_index)
+    # Time spent in the receivers is attributed to their process state.
+    self.state_sampler = state_sampler
+    if state_sampler is not None:
+      self.receiver_states = [
+          state_sampler.get_state(receiver.step_name, 'process')
+          for receiver in self.receivers]
 
   def output(self, windowed_value, coder=None):
     self.update_counters_start(windowed_value, coder)
-    for receiver in self.receivers:
-      receiver.process(windowed_value)
+    sampler = self.state_sampler
+    if sampler is None:
+      for receiver in self.receivers:
+        receiver.process(windowed_value)
+    else:
+      saved_state = sampler.current_state
+      for i, receiver in enumerate(self.receivers):
+        sampler.current_state = self.receiver_states[i]
+        receiver.process(windowed_value)
+      sampler.current_state = saved_state
+    self.update_counters_finish()
+
+  def output_batch(self, windowed_values, coder=None):
+    self.update_counters_start_batch(windowed_values, coder)
+    sampler = self.state_sampler
+    if sampler is None:
+      for receiver in self.receivers:
+        receiver.process_batch(windowed_values)
+    else:
+      saved_state = sampler.current_state
+      for i, receiver in enumerate(self.receivers):
+        sampler.current_state = self.receiver_states[i]
+        receiver.process_batch(windowed_values)
+      sampler.current_state = saved_state
     self.update_counters_finish()
 
   def update_counters_start(self, windowed_value, coder=None):
     if self.opcounter:
       self.opcounter.update_from(windowed_value, coder)
 
+  def update_counters_start_batch(self, windowed_values, coder=None):
+    if self.opcounter:
+      self.opcounter.update_from_batch(windowed_values, coder)
+
   def update_counters_finish(self):
     if self.opcounter:
       self.opcounter.update_collect()
@@ -97,6 +137,58 @@ class ReceiverSet(object):
         ' '.join([r.str_internal(is_recursive=True) for r in self.receivers]))
 
 
+class FusedReceiverSet(ReceiverSet):
+  """A ReceiverSet linking two DoOperations of a FusedDoOperation chain.
+
+  The edge has exactly one receiver, a DoOperation, so elements are handed
+  straight to its DoFnRunner instead of looping over receivers and going
+  through Operation.process. The output counters of the producing step are
+  still updated for every element.
+  """
+
+  def __init__(self, receiver_set):
+    super(FusedReceiverSet, self).__init__(
+        receiver_set.counter_factory, receiver_set.coder,
+        receiver_set.output_index)
+    self.receivers = receiver_set.receivers
+    assert len(self.receivers) == 1
+    self._process = None
+    self._process_batch = None
+
+  def start(self, step_name, state_sampler=None):
+    super(FusedReceiverSet, self).start(step_name, state_sampler)
+    # The consumer is always started before its producer (see
+    # FusedDoOperation.start) so its DoFnRunner exists by now.
+    self._process = self.receivers[0].dofn_runner.process
+    self._process_batch = self.receivers[0].dofn_runner.process_batch
+
+  def output(self, windowed_value, coder=None):
+    opcounter = self.opcounter
+    opcounter.update_from(windowed_value, coder)
+    sampler = self.state_sampler
+    if sampler is None:
+      self._process(windowed_value)
+    else:
+      saved_state = sampler.current_state
+      sampler.current_state = self.receiver_states[0]
+      self._process(windowed_value)
+      sampler.current_state = saved_state
+    opcounter.update_collect()
+
+  def output_batch(self, windowed_values, coder=None):
+    opcounter = self.opcounter
+    opcounter.update_from_batch(windowed_values, coder)
+    sampler = self.state_sampler
+    if sampler is None:
+      self._process_batch(windowed_values)
+    else:
+      saved_state = sampler.current_state
+      sampler.current_state = self.receiver_states[0]
+      self._process_batch(windowed_values)
+      sampler.current_state = saved_state
+    opcounter.update_collect()
+
+
 class Operation(object):
   """An operation representing the live version of a work item specification.
 
@@ -114,6 +206,9 @@ class Operation(object):
     self.counter_factory = counter_factory
     self.spec = spec
     self.receivers = []
+    # The statesampler.StateSampler attributing execution time to steps, if
+    # any. Set by the executor before the operation is started.
+    self.state_sampler = None
     # Everything except WorkerSideInputSource, which is not a
     # top-level operation, should have output_coders
     if getattr(self.spec, 'output_coders', None):
@@ -126,19 +221,40 @@ class Operation(object):
         logging.DEBUG)
     # Start our receivers, now that we know our step name.
     for receiver in self.receivers:
-      receiver.start(self.step_name)
+      receiver.start(self.step_name, self.state_sampler)
 
   def finish(self):
     """Finish operation."""
     pass
 
+  def abort(self):
+    """Releases the resources of an operation whose bundle failed.
+
+    Called instead of finish() for every operation of a failed map task,
+    whether or not the operation was started.
+    """
+    pass
+
   def process(self, o):
     """Process element in operation."""
     pass
 
+  def process_batch(self, windowed_values):
+    """Process a list of elements in operation.
+
+    Operations that can handle several elements at once more efficiently
+    than one at a time override this; by default each element of the batch
+    is passed to process() in order.
+    """
+    for windowed_value in windowed_values:
+      self.process(windowed_value)
+
   def output(self, windowed_value, coder=None, output_index=0):
     self.receivers[output_index].output(windowed_value, coder)
 
+  def output_batch(self, windowed_values, coder=None, output_index=0):
+    self.receivers[output_index].output_batch(windowed_values, coder)
+
   def add_receiver(self, operation, output_index=0):
     """Adds a receiver operation for the specified output."""
     self.receivers[output_index].add_receiver(operation)
@@ -182,7 +298,13 @@ class Operation(object):
 
 
 class ReadOperation(Operation):
-  """A generic read operation that reads from proper input source."""
+  """A generic read operation that reads from proper input source.
+
+  Values are passed on to the receivers in batches of at most
+  READ_BATCH_SIZE elements.
+  """
+
+  READ_BATCH_SIZE = 100
 
   def __init__(self, spec, counter_factory):
     super(ReadOperation, self).__init__(spec, counter_factory)
@@ -190,19 +312,30 @@ class ReadOperation(Operation):
     self._reader = None
 
   def start(self):
-    # We cache reader progress to make sure that the progress reporting
-    # thread does not get blocked due to any reader related operations.
+    # Readers supporting progress snapshots have their progress pulled on
+    # demand by get_progress. For other readers we cache the progress after
+    # every record to make sure that the progress reporting thread does not
+    # get blocked due to any reader related operations.
     self._current_progress = None
     super(ReadOperation, self).start()
+    batch_size = self.READ_BATCH_SIZE
     with self.spec.source.reader() as reader:
       self._reader = reader
+      returns_windowed_values = reader.returns_windowed_values
+      cache_progress = not reader.supports_progress_snapshots
+      batch = []
       for value in reader:
-        self._current_progress = reader.get_progress()
-        if reader.returns_windowed_values:
-          windowed_value = value
+        if cache_progress:
+          self._current_progress = reader.get_progress()
+        if returns_windowed_values:
+          batch.append(value)
         else:
-          windowed_value = GlobalWindows.windowed_value(value)
-        self.output(windowed_value)
+          batch.append(GlobalWindows.windowed_value(value))
+        if len(batch) >= batch_size:
+          self.output_batch(batch)
+          batch = []
+      if batch:
+        self.output_batch(batch)
 
   def request_dynamic_split(self, dynamic_split_request):
     if self._reader is not None:
@@ -217,11 +350,14 @@ class ReadOperation(Operation):
     This method is invoked by the progress reporting thread. No need to lock
     the variable "current_progress" since it is updated by a simple variable
     assignment and we are OK with current_progress value returned here being
-    slightly stale.
+    slightly stale. The same goes for reader progress snapshots.
 
     Returns:
       Progress of the ReadOperation.
     """
+    reader = self._reader
+    if reader is not None and reader.supports_progress_snapshots:
+      return reader.progress_from_snapshot(reader.get_progress_snapshot())
     return self._current_progress
 
 
@@ -253,6 +389,19 @@ class WriteOperation(Operation):
       self.writer.Write(o.value)
     self.receivers[0].update_counters_finish()
 
+  def process_batch(self, windowed_values):
+    if self.debug_logging_enabled:
+      logging.debug('Processing batch of %d in %s', len(windowed_values), self)
+    self.receivers[0].update_counters_start_batch(windowed_values)
+    write = self.writer.Write
+    if self.use_windowed_value:
+      for o in windowed_values:
+        write(o)
+    else:
+      for o in windowed_values:
+        write(o.value)
+    self.receivers[0].update_counters_finish()
+
 
 class InMemoryWriteOperation(Operation):
   """A write operation that will write to an in-memory sink."""
@@ -269,25 +418,67 @@ class InMemoryWriteOperation(Operation):
     self.spec.output_buffer.append(o.value)
     self.receivers[0].update_counters_finish()
 
+  def process_batch(self, windowed_values):
+    self.receivers[0].update_counters_start_batch(windowed_values)
+    self.spec.output_buffer.extend([o.value for o in windowed_values])
+    self.receivers[0].update_counters_finish()
+
+
+def _sorted_value_coders(value_coder):
+  """Returns the secondary key and value coders of (sort key, value) pairs.
+
+  Reified pairs are windowed values, whose timestamps and windows stay with
+  the values once the sort keys are taken out of them.
+  """
+  secondary_key_coder = value_coder.key_coder().sort_key_coder()
+  if isinstance(value_coder, WindowedValueCoder):
+    return secondary_key_coder, WindowedValueCoder(
+        value_coder.value_coder(), value_coder.timestamp_coder,
+        value_coder.window_coder)
+  return secondary_key_coder, value_coder.value_coder()
+
 
 class GroupedShuffleReadOperation(Operation):
   """A shuffle read operation that will read from a grouped shuffle source."""
 
-  def __init__(self, spec, counter_factory, shuffle_source=None):
+  def __init__(self, spec, counter_factory, shuffle_source=None,
+               read_ahead_chunks=0, reiteration_cache_bytes=None,
+               concurrent_ranges=1, compressed_values=False,
+               read_ahead_spill_bytes=0):
     super(GroupedShuffleReadOperation, self).__init__(spec, counter_factory)
     self.shuffle_source = shuffle_source
+    self.read_ahead_chunks = read_ahead_chunks
+    self.reiteration_cache_bytes = reiteration_cache_bytes
+    self.concurrent_ranges = concurrent_ranges
+    self.compressed_values = compressed_values
+    self.read_ahead_spill_bytes = read_ahead_spill_bytes
     self._reader = None
 
   def start(self):
     super(GroupedShuffleReadOperation, self).start()
     write_coder = None
     if self.shuffle_source is None:
-      coders = (self.spec.coder.key_coder(), self.spec.coder.value_coder())
+      value_coder = self.spec.coder.value_coder()
+      if isinstance(value_coder, IterableCoder):
+        # The values of each key are read one at a time.
+        value_coder = value_coder.elem_coder()
+      coders = (self.spec.coder.key_coder(), value_coder)
       write_coder = WindowedValueCoder(TupleCoder(coders))
+      secondary_key_coder = None
+      if self.spec.sort_values:
+        # Values are (secondary key, value) pairs sorted by secondary key.
+        secondary_key_coder, value_coder = _sorted_value_coders(coders[1])
+        coders = (coders[0], value_coder)
       self.shuffle_source = shuffle.GroupedShuffleSource(
           self.spec.shuffle_reader_config, coder=coders,
           start_position=self.spec.start_shuffle_position,
-          end_position=self.spec.end_shuffle_position)
+          end_position=self.spec.end_shuffle_position,
+          read_ahead_chunks=self.read_ahead_chunks,
+          reiteration_cache_bytes=self.reiteration_cache_bytes,
+          secondary_key_coder=secondary_key_coder,
+          concurrent_ranges=self.concurrent_ranges,
+          compressed_values=self.compressed_values,
+          read_ahead_spill_bytes=self.read_ahead_spill_bytes)
     with self.shuffle_source.reader() as reader:
       for key, key_values in reader:
         self._reader = reader
@@ -306,9 +497,12 @@ class GroupedShuffleReadOperation(Operation):
 class UngroupedShuffleReadOperation(Operation):
   """A shuffle read operation reading from an ungrouped shuffle source."""
 
-  def __init__(self, spec, counter_factory, shuffle_source=None):
+  def __init__(self, spec, counter_factory, shuffle_source=None,
+               read_ahead_chunks=0, compressed_values=False):
     super(UngroupedShuffleReadOperation, self).__init__(spec, counter_factory)
     self.shuffle_source = shuffle_source
+    self.read_ahead_chunks = read_ahead_chunks
+    self.compressed_values = compressed_values
     self._reader = None
 
   def start(self):
@@ -320,7 +514,9 @@ class UngroupedShuffleReadOperation(Operation):
       self.shuffle_source = shuffle.UngroupedShuffleSource(
           self.spec.shuffle_reader_config, coder=coders,
           start_position=self.spec.start_shuffle_position,
-          end_position=self.spec.end_shuffle_position)
+          end_position=self.spec.end_shuffle_position,
+          read_ahead_chunks=self.read_ahead_chunks,
+          compressed_values=self.compressed_values)
     with self.shuffle_source.reader() as reader:
       for value in reader:
         self._reader = reader
@@ -328,34 +524,50 @@ class UngroupedShuffleReadOperation(Operation):
         self.output(windowed_value, coder=write_coder)
 
   def get_progress(self):
-    # 'UngroupedShuffleReader' does not support progress reporting.
-    pass
+    if self._reader is not None:
+      return self._reader.get_progress()
 
   def request_dynamic_split(self, dynamic_split_request):
-    # 'UngroupedShuffleReader' does not support dynamic work rebalancing.
-    pass
+    if self._reader is not None:
+      return self._reader.request_dynamic_split(dynamic_split_request)
 
 
 class ShuffleWriteOperation(Operation):
   """A shuffle write operation that will write to a shuffle sink."""
 
-  def __init__(self, spec, counter_factory, shuffle_sink=None):
+  def __init__(self, spec, counter_factory, shuffle_sink=None,
+               write_buffer_bytes=None, write_queue_depth=None,
+               compression_level=None):
     super(ShuffleWriteOperation, self).__init__(spec, counter_factory)
     self.writer = None
     self.shuffle_sink = shuffle_sink
+    self.write_buffer_bytes = write_buffer_bytes
+    self.write_queue_depth = write_queue_depth
+    self.compression_level = compression_level
 
   def start(self):
     super(ShuffleWriteOperation, self).start()
     self.is_ungrouped = self.spec.shuffle_kind == 'ungrouped'
+    self.sorts_values = self.spec.shuffle_kind == 'group_keys_and_sort_values'
     coder = self.spec.output_coders[0]
     if self.is_ungrouped:
       coders = (BytesCoder(), coder)
     else:
       coders = (coder.key_coder(), coder.value_coder())
     self._write_coder = WindowedValueCoder(TupleCoder(coders))
+    if self.sorts_values:
+      # The values are (secondary key, value) pairs. The secondary keys are
+      # written with an order-preserving encoding, for the shuffle to sort
+      # the values by them.
+      secondary_key_coder, value_coder = _sorted_value_coders(coders[1])
+      self._secondary_key_coder = secondary_key_coder.get_impl()
+      coders = (coders[0], value_coder)
     if self.shuffle_sink is None:
       self.shuffle_sink = shuffle.ShuffleSink(
-          self.spec.shuffle_writer_config, coder=coders)
+          self.spec.shuffle_writer_config, coder=coders,
+          buffer_bytes=self.write_buffer_bytes,
+          flush_queue_depth=self.write_queue_depth,
+          compression_level=self.compression_level)
     self.writer = self.shuffle_sink.writer()
     self.writer.__enter__()
 
@@ -363,6 +575,13 @@ class ShuffleWriteOperation(Operation):
     logging.debug('Finishing %s', self)
     self.writer.__exit__(None, None, None)
 
+  def abort(self):
+    # The entries of the failed bundle are dropped, but the shuffle writer
+    # and its background flushing thread must still be released.
+    writer, self.writer = self.writer, None
+    if writer is not None:
+      writer.abort()
+
   def process(self, o):
     if self.debug_logging_enabled:
       logging.debug('Processing [%s] in %s', o, self)
@@ -377,14 +596,23 @@ class ShuffleWriteOperation(Operation):
     # used to reshard workflow outputs into a fixed set of files. This is
     # achieved by using an UngroupedShuffleSource to read back the values
     # written in 'ungrouped' mode.
+    secondary_key = ''
     if self.is_ungrouped:
       # We want to spread the values uniformly to all shufflers.
       k, v = str(random.getrandbits(64)), o.value
+    elif self.sorts_values:
+      k, v = o.value
+      if isinstance(v, WindowedValue):
+        # Reified values keep their timestamp and windows without the sort
+        # key.
+        sort_key, value = v.value
+        v = v.with_value(value)
+      else:
+        sort_key, v = v
+      secondary_key = self._secondary_key_coder.encode(sort_key)
     else:
       k, v = o.value
-    # TODO(silviuc): Use timestamps for the secondary key to get values in
-    # times-sorted order.
-    self.writer.Write(k, '', v)
+    self.writer.Write(k, secondary_key, v)
     self.receivers[0].update_counters_finish()
 
 
@@ -395,18 +623,87 @@ class _TaggedReceivers(dict):
     def output(self, element):
       pass
 
+    def output_batch(self, elements):
+      pass
+
   def __missing__(self, unused_key):
     if not getattr(self, '_null_receiver', None):
       self._null_receiver = _TaggedReceivers.NullReceiver()
     return self._null_receiver
 
 
+class DoFnCache(object):
+  """A worker-level cache of deserialized DoFns.
+
+  The fn data of a DoOperation (see fn_data in dataflow_runner.py) is keyed
+  by a hash of its serialized form. An instance is used by a single
+  operation at a time: acquire() takes an idle instance out of the cache, or
+  deserializes a new one and calls its DoFn's setup(), and release() gives
+  it back once its bundle is finished. Once more than max_entries instances
+  are idle, the least recently released ones are evicted and their DoFn's
+  teardown() is called.
+  """
+
+  def __init__(self, max_entries):
+    self.max_entries = max_entries
+    self.hits = 0
+    self.misses = 0
+    # Maps keys to lists of idle fn data, least recently used key first.
+    self._entries = collections.OrderedDict()
+    self._size = 0
+    self._lock = threading.Lock()
+
+  def acquire(self, serialized_fn):
+    """Returns fn data for serialized_fn whose DoFn has been set up."""
+    key = hashlib.sha1(serialized_fn).digest()
+    with self._lock:
+      idle = self._entries.get(key)
+      if idle:
+        self.hits += 1
+        self._size -= 1
+        fn_data = idle.pop()
+        if not idle:
+          del self._entries[key]
+        return fn_data
+      self.misses += 1
+    fn_data = pickler.loads(serialized_fn)
+    fn_data[0].setup()
+    return fn_data
+
+  def release(self, serialized_fn, fn_data):
+    """Makes fn data acquired for serialized_fn available again."""
+    key = hashlib.sha1(serialized_fn).digest()
+    evicted = []
+    with self._lock:
+      idle = self._entries.pop(key, [])
+      idle.append(fn_data)
+      self._entries[key] = idle
+      self._size += 1
+      while self._size > self.max_entries:
+        evicted_key = next(iter(self._entries))
+        evicted_idle = self._entries[evicted_key]
+        evicted.append(evicted_idle.pop(0))
+        self._size -= 1
+        if not evicted_idle:
+          del self._entries[evicted_key]
+    for evicted_fn_data in evicted:
+      evicted_fn_data[0].teardown()
+
+  def __len__(self):
+    return self._size
+
+
 class DoOperation(Operation):
   """A Do operation that will execute a custom DoFn for each input element."""
 
-  def __init__(self, spec, counter_factory):
+  def __init__(self, spec, counter_factory, side_input_cache=None,
+               side_input_spill_bytes=None, dofn_cache=None):
     super(DoOperation, self).__init__(spec, counter_factory)
     self.state = common.DoFnState(counter_factory)
+    self.side_input_cache = side_input_cache
+    self.side_input_spill_bytes = side_input_spill_bytes
+    self.dofn_cache = dofn_cache
+    self.fn_data = None
 
   def _read_side_inputs(self, tags_and_types):
     """Generator reading side inputs in the order prescribed by tags_and_types.
@@ -442,42 +739,86 @@ class DoOperation(Operation):
         if not isinstance(si, maptask.WorkerSideInputSource):
           raise NotImplementedError('Unknown side input type: %r' % si)
         sources.append(si.source)
-      iterator_fn = sideinputs.get_iterator_fn_for_sources(sources)
-
-      if view_class == pvalue.SingletonPCollectionView:
-        has_default, default = view_options
-        has_result = False
-        result = None
-        for v in iterator_fn():
-          has_result = True
-          result = v
-          break
-        if has_result:
-          yield result
-        elif has_default:
-          yield default
+
+      # Iterable views are read lazily, every time they are iterated over, so
+      # only the other (materialized) views are worth caching or spilling.
+      materialized = view_class != pvalue.IterablePCollectionView
+      cache_key = None
+      if self.side_input_cache is not None and materialized:
+        cache_key = sideinputs.get_cache_key(sources, view_class, view_options)
+      if cache_key is not None:
+        found, view = self.side_input_cache.get(cache_key)
+        if found:
+          self.counter_factory.get_counter(
+              '%s-SideInputCacheHits' % self.step_name, Counter.SUM).update(1)
+          yield view
+          continue
+        self.counter_factory.get_counter(
+            '%s-SideInputCacheMisses' % self.step_name, Counter.SUM).update(1)
+
+      size_counter = None
+      if cache_key is not None or (
+          materialized and self.side_input_spill_bytes is not None):
+        size_counter = sideinputs.SizeCounter()
+      view = self._read_side_input(
+          view_class, view_options,
+          sideinputs.get_iterator_fn_for_sources(sources, size_counter),
+          sources, size_counter)
+      if cache_key is not None:
+        if isinstance(view, (sideinputs.DiskBackedList,
+                             sideinputs.DiskBackedDict)):
+          # Cached spilled views hold on to their local files as well.
+          self.side_input_cache.put(
+              cache_key, view, view.memory_size + view.disk_size)
         else:
-          yield EmptySideInput()
-      elif view_class == pvalue.IterablePCollectionView:
-        yield sideinputs.EmulatedIterable(iterator_fn)
-      elif view_class == pvalue.ListPCollectionView:
-        # TODO(ccy): this is not yet suitable for lists that do not fit in
-        # memory on a single machine.
-        yield list(iterator_fn())
-      elif view_class == pvalue.DictPCollectionView:
-        # TODO(ccy): this is not yet suitable for dictionaries that do not fit
-        # in memory on a single machine.
-        yield dict(iterator_fn())
+          self.side_input_cache.put(cache_key, view, size_counter.size)
+      yield view
+
+  def _read_side_input(self, view_class, view_options, iterator_fn,
+                       sources=None, size_counter=None):
+    """Returns the side input view of the elements returned by iterator_fn.
+
+    List and dict views whose estimated size, as observed by size_counter,
+    goes over side_input_spill_bytes are spilled to local disk.
+    """
+    spill = (self.side_input_spill_bytes is not None and
+             size_counter is not None)
+    if view_class == pvalue.SingletonPCollectionView:
+      has_default, default = view_options
+      for v in iterator_fn():
+        return v
+      if has_default:
+        return default
       else:
-        raise NotImplementedError('Unknown PCollectionView type: %s' %
-                                  view_class)
+        return EmptySideInput()
+    elif view_class == pvalue.IterablePCollectionView:
+      return sideinputs.EmulatedIterable(iterator_fn)
+    elif view_class == pvalue.ListPCollectionView:
+      if not spill:
+        return list(iterator_fn())
+      return sideinputs.read_list(
+          iterator_fn(), size_counter, self.side_input_spill_bytes,
+          sideinputs.get_coder_for_sources(sources))
+    elif view_class == pvalue.DictPCollectionView:
+      if not spill:
+        return dict(iterator_fn())
+      return sideinputs.read_dict(
+          iterator_fn(), size_counter, self.side_input_spill_bytes,
+          sideinputs.get_coder_for_sources(sources))
+    else:
+      raise NotImplementedError('Unknown PCollectionView type: %s' %
+                                view_class)
 
   def start(self):
     super(DoOperation, self).start()
 
     # See fn_data in dataflow_runner.py
-    fn, args, kwargs, tags_and_types, window_fn = (
-        pickler.loads(self.spec.serialized_fn))
+    if self.dofn_cache is not None:
+      self.fn_data = self.dofn_cache.acquire(self.spec.serialized_fn)
+    else:
+      self.fn_data = pickler.loads(self.spec.serialized_fn)
+      self.fn_data[0].setup()
+    fn, args, kwargs, tags_and_types, window_fn = self.fn_data
 
     self.state.step_name = self.step_name
 
@@ -507,10 +848,131 @@ class DoOperation(Operation):
 
   def finish(self):
     self.dofn_runner.finish()
+    fn_data, self.fn_data = self.fn_data, None
+    if self.dofn_cache is not None:
+      self.dofn_cache.release(self.spec.serialized_fn, fn_data)
+    else:
+      fn_data[0].teardown()
+
+  def abort(self):
+    # The DoFn may be left in an inconsistent state by the failed bundle so it
+    # is torn down rather than given back to the cache.
+    fn_data, self.fn_data = self.fn_data, None
+    if fn_data is not None:
+      fn_data[0].teardown()
 
   def process(self, o):
     self.dofn_runner.process(o)
 
+  def process_batch(self, windowed_values):
+    self.dofn_runner.process_batch(windowed_values)
+
+
+class FusedDoOperation(Operation):
+  """A linear chain of DoOperations executed as a single operation.
+
+  Every operation in the chain except the last one has a single output which
+  is consumed only by the next operation of the chain. Elements move along
+  the chain through FusedReceiverSet edges, while each step keeps its own
+  counters, logging context and start/finish bundle calls.
+  """
+
+  def __init__(self, operations):
+    assert len(operations) > 1
+    head = operations[0]
+    super(FusedDoOperation, self).__init__(head.spec, head.counter_factory)
+    self.step_name = head.step_name
+    self.state_sampler = head.state_sampler
+    self.operations = operations
+    # Outputs of the chain are the outputs of its last operation.
+    self.receivers = operations[-1].receivers
+    for producer in operations[:-1]:
+      producer.receivers[0] = FusedReceiverSet(producer.receivers[0])
+    self._process = None
+    self._process_batch = None
+
+  def start(self):
+    sampler = self.state_sampler
+    for op in reversed(self.operations):
+      if sampler is None:
+        op.start()
+      else:
+        with sampler.scoped_state(sampler.get_state(op.step_name, 'start')):
+          op.start()
+    self._process = self.operations[0].dofn_runner.process
+    self._process_batch = self.operations[0].dofn_runner.process_batch
+
+  def finish(self):
+    sampler = self.state_sampler
+    for op in self.operations:
+      if sampler is None:
+        op.finish()
+      else:
+        with sampler.scoped_state(sampler.get_state(op.step_name, 'finish')):
+          op.finish()
+
+  def abort(self):
+    for op in self.operations:
+      op.abort()
+
+  def process(self, o):
+    self._process(o)
+
+  def process_batch(self, windowed_values):
+    self._process_batch(windowed_values)
+
+  def add_receiver(self, operation, output_index=0):
+    self.operations[-1].add_receiver(operation, output_index)
+
+  def str_internal(self, is_recursive=False):
+    return '<%s [%s]>' % (
+        self.__class__.__name__,
+        ' '.join([op.str_internal(is_recursive=True)
+                  for op in self.operations]))
+
+
+def _is_fusable_edge(producer):
+  """Returns True if producer's only consumer can be fused with it."""
+  if not isinstance(producer, DoOperation) or len(producer.receivers) != 1:
+    return False
+  consumers = producer.receivers[0].receivers
+  return len(consumers) == 1 and type(consumers[0]) is DoOperation
+
+
+def fuse_do_operations(ops):
+  """Replaces linear chains of DoOperations with FusedDoOperations.
+
+  The operations must be fully wired and have their step names set. The
+  returned list keeps the (topological) order of ops, with each chain taking
+  the place of its first operation.
+
+  Args:
+    ops: the list of operations of a map task.
+
+  Returns:
+    A new list of operations.
+  """
+  fused_ops = []
+  in_chain = set()
+  for op in ops:
+    if id(op) in in_chain:
+      continue
+    chain = [op]
+    while _is_fusable_edge(chain[-1]):
+      chain.append(chain[-1].receivers[0].receivers[0])
+    if len(chain) == 1:
+      fused_ops.append(op)
+      continue
+    in_chain.update(id(o) for o in chain)
+    fused_op = FusedDoOperation(chain)
+    # Producers feeding the head of the chain now feed the fused operation.
+    for producer in fused_ops:
+      for receiver_set in producer.receivers:
+        receiver_set.receivers = [
+            fused_op if r is op else r for r in receiver_set.receivers]
+    fused_ops.append(fused_op)
+  return fused_ops
+
 
 class CombineOperation(Operation):
   """A Combine operation executing a CombineFn for each input element."""
@@ -536,11 +998,31 @@ class CombineOperation(Operation):
         o.with_value((key, self.phased_combine_fn.apply(values))))
 
 
-def create_pgbk_op(spec, counter_factory):
+def _pop_least_recently_used(table, keys):
+  """Pops and yields the (key, entry) pairs of table, least recent first.
+
+  This approximates LRU with the second chance (CLOCK) algorithm, which costs
+  nothing more than a dict lookup on hits: keys holds the keys of table in
+  insertion order, and the last item of each entry is a flag set whenever the
+  key is used again. Keys with the flag set have it cleared and go back to
+  the end of keys instead of being popped.
+  """
+  while keys:
+    key = keys.popleft()
+    entry = table[key]
+    if entry[-1]:
+      entry[-1] = False
+      keys.append(key)
+    else:
+      del table[key]
+      yield key, entry
+
+
+def create_pgbk_op(spec, counter_factory, max_buffer_bytes=None):
   if spec.combine_fn:
-    return PGBKCVOperation(spec, counter_factory)
+    return PGBKCVOperation(spec, counter_factory, max_buffer_bytes)
   else:
-    return PGBKOperation(spec, counter_factory)
+    return PGBKOperation(spec, counter_factory, max_buffer_bytes)
 
 
 class PGBKOperation(Operation):
@@ -549,86 +1031,179 @@ class PGBKOperation(Operation):
   This takes (windowed) input (key, value) tuples and outputs
   (key, [value]) tuples, performing a best effort group-by-key for
   values in this bundle, memory permitting.
+
+  Memory use is bounded by the encoded size of the buffered keys and values,
+  as estimated by the output coder. Since estimating a size can cost as much
+  as encoding the value, the values of a key are only sized after 1, 2, 4,
+  8, ... of them, and the others are assumed to have the average size of
+  those. When the estimate goes over max_buffer_bytes the least recently used
+  keys (see _pop_least_recently_used) are flushed until it is back under 90%
+  of the budget, so frequent keys stay in the table.
   """
 
-  def __init__(self, spec, counter_factory):
+  DEFAULT_MAX_BUFFER_BYTES = 64 << 20
+
+  def __init__(self, spec, counter_factory, max_buffer_bytes=None):
     super(PGBKOperation, self).__init__(spec, counter_factory)
     assert not self.spec.combine_fn
-    self.table = collections.defaultdict(list)
+    # Maps (key, windows) to an entry
+    # [windowed_values, size, sampled_value_bytes, value_size, used_again].
+    self.table = {}
+    # The keys of the table, in the order they are to be flushed.
+    self.lru_keys = collections.deque()
     self.size = 0
-    # TODO(robertwb) Make this configurable.
-    self.max_size = 10000
+    self.max_size = max_buffer_bytes or self.DEFAULT_MAX_BUFFER_BYTES
+    coder = self.spec.output_coders[0]
+    if coder.is_kv_coder():
+      self.key_coder = coder.key_coder()
+      self.value_coder = coder.value_coder()
+      if isinstance(self.value_coder, IterableCoder):
+        # Values are output in lists, but sized one at a time.
+        self.value_coder = self.value_coder.elem_coder()
+    else:
+      self.key_coder = self.value_coder = coder
 
   def process(self, o):
     # TODO(robertwb): Structural (hashable) values.
-    key = o.value[0], tuple(o.windows)
-    self.table[key].append(o)
-    self.size += 1
+    key, value = o.value
+    wkey = key, tuple(o.windows)
+    entry = self.table.get(wkey, None)
+    if entry is None:
+      entry = self.table[wkey] = [
+          [], self.key_coder.estimate_size(key), 0, 0, False]
+      self.lru_keys.append(wkey)
+      self.size += entry[1]
+    else:
+      entry[4] = True
+    windowed_values = entry[0]
+    windowed_values.append(o)
+    count = len(windowed_values)
+    if count & (count - 1) == 0:
+      entry[2] += self.value_coder.estimate_size(value)
+      entry[3] = entry[2] // count.bit_length()
+    value_size = entry[3]
+    entry[1] += value_size
+    self.size += value_size
     if self.size > self.max_size:
       self.flush(9 * self.max_size // 10)
 
   def finish(self):
-    self.flush(0)
+    for wkey, entry in self.table.iteritems():
+      self.output_key(wkey, entry[0])
+    self.table = {}
+    self.lru_keys.clear()
+    self.size = 0
 
   def flush(self, target):
-    limit = self.size - target
-    for ix, (kw, vs) in enumerate(self.table.items()):
-      if ix >= limit:
+    """Outputs least recently used keys until the size is at most target."""
+    for wkey, entry in _pop_least_recently_used(self.table, self.lru_keys):
+      self.size -= entry[1]
+      self.output_key(wkey, entry[0])
+      if self.size <= target:
         break
-      del self.table[kw]
-      key, windows = kw
-      output_value = [v.value[1] for v in vs]
-      windowed_value = WindowedValue(
-          (key, output_value),
-          vs[0].timestamp, windows)
-      self.output(windowed_value)
+
+  def output_key(self, wkey, vs):
+    key, windows = wkey
+    output_value = [v.value[1] for v in vs]
+    windowed_value = WindowedValue(
+        (key, output_value),
+        vs[0].timestamp, windows)
+    self.output(windowed_value)
 
 
 class PGBKCVOperation(Operation):
+  """Partial group-by-key operation combining values as they arrive.
 
-  def __init__(self, spec, counter_factory):
+  This takes (windowed) input (key, value) tuples and outputs
+  (key, accumulator) tuples, keeping one accumulator per key and window for
+  as long as memory permits.
+
+  Memory use is bounded by the encoded size of the keys and accumulators, as
+  estimated by the CombineFn's estimate_accumulator_size or else by the
+  output coder. Since accumulators may grow, their size is re-estimated after
+  1, 2, 4, 8, ... updates. When the estimate goes over max_buffer_bytes the
+  least recently used keys (see _pop_least_recently_used) are output until it
+  is back under 90% of the budget. Evictions are reported in the
+  <step>-EvictedKeys and <step>-EvictedBytes counters.
+  """
+
+  def __init__(self, spec, counter_factory, max_buffer_bytes=None):
     super(PGBKCVOperation, self).__init__(spec, counter_factory)
     # Combiners do not accept deferred side-inputs (the ignored fourth
     # argument) and therefore the code to handle the extra args/kwargs is
     # simpler than for the DoFn's of ParDo.
     fn, args, kwargs = pickler.loads(self.spec.combine_fn)[:3]
     self.combine_fn = curry_combine_fn(fn, args, kwargs)
-    # Optimization for the (known tiny accumulator, often wide keyspace)
-    # count function.
-    # TODO(robertwb): Bound by in-memory size rather than key count.
-    self.max_keys = (
-        1000000 if isinstance(fn, combiners.CountCombineFn) else 10000)
-    self.key_count = 0
+    self.max_size = (
+        max_buffer_bytes or PGBKOperation.DEFAULT_MAX_BUFFER_BYTES)
+    self.size = 0
+    # Maps (windows, key) to an entry
+    # [accumulator, key_size, accumulator_size, updates, used_again].
+    # Entries are mutated in place when new values are added.
     self.table = {}
+    # The keys of the table, in the order they are to be evicted.
+    self.lru_keys = collections.deque()
+    coder = self.spec.output_coders[0]
+    if coder.is_kv_coder():
+      self.key_coder = coder.key_coder()
+      self.accumulator_coder = coder.value_coder()
+    else:
+      self.key_coder = self.accumulator_coder = coder
+    self.evicted_keys_counter = None
+    self.evicted_bytes_counter = None
+
+  def start(self):
+    super(PGBKCVOperation, self).start()
+    self.evicted_keys_counter = self.counter_factory.get_counter(
+        '%s-EvictedKeys' % self.step_name, Counter.SUM)
+    self.evicted_bytes_counter = self.counter_factory.get_counter(
+        '%s-EvictedBytes' % self.step_name, Counter.SUM)
+
+  def estimate_accumulator_size(self, accumulator):
+    size = self.combine_fn.estimate_accumulator_size(accumulator)
+    if size is None:
+      size = self.accumulator_coder.estimate_size(accumulator)
+    return size
 
   def process(self, wkv):
     key, value = wkv.value
     wkey = tuple(wkv.windows), key
     entry = self.table.get(wkey, None)
     if entry is None:
-      if self.key_count >= self.max_keys:
-        target = self.key_count * 9 // 10
-        old_wkeys = []
-        # TODO(robertwb): Use an LRU cache?
-        for old_wkey, old_wvalue in self.table.iteritems():
-          old_wkeys.append(old_wkey)  # Can't mutate while iterating.
-          self.output_key(old_wkey, old_wvalue[0])
-          self.key_count -= 1
-          if self.key_count <= target:
-            break
-        for old_wkey in reversed(old_wkeys):
-          del self.table[old_wkey]
-      self.key_count += 1
-      # We save the accumulator as a one element list so we can efficiently
-      # mutate when new values are added without searching the cache again.
-      entry = self.table[wkey] = [self.combine_fn.create_accumulator()]
+      key_size = self.key_coder.estimate_size(key)
+      entry = self.table[wkey] = [
+          self.combine_fn.create_accumulator(), key_size, 0, 0, False]
+      self.lru_keys.append(wkey)
+      self.size += key_size
+    else:
+      entry[4] = True
     entry[0] = self.combine_fn.add_inputs(entry[0], [value])
+    entry[3] += 1
+    updates = entry[3]
+    if updates & (updates - 1) == 0:
+      accumulator_size = self.estimate_accumulator_size(entry[0])
+      self.size += accumulator_size - entry[2]
+      entry[2] = accumulator_size
+      if self.size > self.max_size:
+        self.evict(9 * self.max_size // 10)
+
+  def evict(self, target):
+    """Outputs least recently used keys until the size is at most target."""
+    for wkey, entry in _pop_least_recently_used(self.table, self.lru_keys):
+      entry_size = entry[1] + entry[2]
+      self.size -= entry_size
+      self.evicted_keys_counter.update(1)
+      self.evicted_bytes_counter.update(entry_size)
+      self.output_key(wkey, entry[0])
+      if self.size <= target:
+        break
 
   def finish(self):
-    for wkey, value in self.table.iteritems():
-      self.output_key(wkey, value[0])
+    for wkey, entry in self.table.iteritems():
+      self.output_key(wkey, entry[0])
     self.table = {}
-    self.key_count = 0
+    self.lru_keys.clear()
+    self.size = 0
 
   def output_key(self, wkey, value):
     windows, key = wkey
@@ -648,6 +1223,11 @@ class FlattenOperation(Operation):
     assert isinstance(o, WindowedValue)
     self.output(o)
 
+  def process_batch(self, windowed_values):
+    if self.debug_logging_enabled:
+      logging.debug('Processing batch of %d in %s', len(windowed_values), self)
+    self.output_batch(windowed_values)
+
 
 class ReifyTimestampAndWindowsOperation(Operation):
   """ReifyTimestampAndWindows operation.
@@ -767,7 +1347,8 @@ class MapTaskExecutor(Executor):
       'Found more than one \'read instruction\' in a single \'map task\'')
 
   def __init__(
-      self, map_task, test_shuffle_source=None, test_shuffle_sink=None):
+      self, map_task, test_shuffle_source=None, test_shuffle_sink=None,
+      pipeline_options=None, side_input_cache=None, dofn_cache=None):
     """Initializes MapTaskExecutor.
 
     Args:
@@ -776,6 +1357,12 @@ class MapTaskExecutor(Executor):
         shuffle read operation objects.
       test_shuffle_sink: Used during tests for dependency injection into
         shuffle write operation objects.
+      pipeline_options: The PipelineOptions of the job, used to tune the
+        operations. Defaults are used if None.
+      side_input_cache: A sideinputs.SideInputCache shared by the work items
+        of the worker, or None to read side inputs anew for each work item.
+      dofn_cache: A DoFnCache shared by the work items of the worker, or None
+        to deserialize DoFns anew for each work item.
     """
 
     self._ops = []
@@ -783,6 +1370,38 @@ class MapTaskExecutor(Executor):
     self._test_shuffle_source = test_shuffle_source
     self._test_shuffle_sink = test_shuffle_sink
     self._map_task = map_task
+    self._side_input_cache = side_input_cache
+    self._dofn_cache = dofn_cache
+    # Attributes the time spent executing the map task to its steps.
+    self.state_sampler = statesampler.StateSampler(map_task.counter_factory)
+    if pipeline_options is None:
+      self._pgbk_max_buffer_bytes = None
+      self._side_input_spill_bytes = None
+      self._shuffle_read_ahead_chunks = 0
+      self._shuffle_write_buffer_bytes = None
+      self._shuffle_write_queue_depth = None
+      self._shuffle_compression_level = None
+      self._shuffle_reiteration_cache_bytes = None
+      self._shuffle_concurrent_read_ranges = 1
+      self._shuffle_read_ahead_spill_bytes = 0
+    else:
+      worker_options = pipeline_options.view_as(WorkerOptions)
+      self._pgbk_max_buffer_bytes = worker_options.pgbk_max_buffer_bytes
+      self._side_input_spill_bytes = (
+          worker_options.side_input_spill_threshold_bytes)
+      self._shuffle_read_ahead_chunks = (
+          worker_options.shuffle_read_ahead_chunks or 0)
+      self._shuffle_write_buffer_bytes = (
+          worker_options.shuffle_write_buffer_bytes)
+      self._shuffle_write_queue_depth = worker_options.shuffle_write_queue_depth
+      self._shuffle_compression_level = (
+          worker_options.shuffle_compression_level)
+      self._shuffle_reiteration_cache_bytes = (
+          worker_options.shuffle_reiteration_cache_bytes)
+      self._shuffle_concurrent_read_ranges = (
+          worker_options.shuffle_concurrent_read_ranges or 1)
+      self._shuffle_read_ahead_spill_bytes = (
+          worker_options.shuffle_read_ahead_spill_bytes or 0)
 
   def get_progress(self):
     return (self._read_operation.get_progress()
@@ -819,13 +1438,21 @@ class MapTaskExecutor(Executor):
       elif isinstance(spec, maptask.WorkerCombineFn):
         op = CombineOperation(spec, self._map_task.counter_factory)
       elif isinstance(spec, maptask.WorkerPartialGroupByKey):
-        op = create_pgbk_op(spec, self._map_task.counter_factory)
+        op = create_pgbk_op(spec, self._map_task.counter_factory,
+                            self._pgbk_max_buffer_bytes)
       elif isinstance(spec, maptask.WorkerDoFn):
-        op = DoOperation(spec, self._map_task.counter_factory)
+        op = DoOperation(spec, self._map_task.counter_factory,
+                         self._side_input_cache, self._side_input_spill_bytes,
+                         self._dofn_cache)
       elif isinstance(spec, maptask.WorkerGroupingShuffleRead):
         op = GroupedShuffleReadOperation(
             spec, self._map_task.counter_factory,
-            shuffle_source=self._test_shuffle_source)
+            shuffle_source=self._test_shuffle_source,
+            read_ahead_chunks=self._shuffle_read_ahead_chunks,
+            reiteration_cache_bytes=self._shuffle_reiteration_cache_bytes,
+            concurrent_ranges=self._shuffle_concurrent_read_ranges,
+            compressed_values=self._shuffle_compression_level is not None,
+            read_ahead_spill_bytes=self._shuffle_read_ahead_spill_bytes)
         if self._read_operation is not None:
           raise RuntimeError(
               MapTaskExecutor.multiple_read_instruction_error_msg)
@@ -834,7 +1461,9 @@ class MapTaskExecutor(Executor):
       elif isinstance(spec, maptask.WorkerUngroupedShuffleRead):
         op = UngroupedShuffleReadOperation(
             spec, self._map_task.counter_factory,
-            shuffle_source=self._test_shuffle_source)
+            shuffle_source=self._test_shuffle_source,
+            read_ahead_chunks=self._shuffle_read_ahead_chunks,
+            compressed_values=self._shuffle_compression_level is not None)
         if self._read_operation is not None:
           raise RuntimeError(
               MapTaskExecutor.multiple_read_instruction_error_msg)
@@ -845,7 +1474,10 @@ class MapTaskExecutor(Executor):
       elif isinstance(spec, maptask.WorkerShuffleWrite):
         op = ShuffleWriteOperation(
             spec, self._map_task.counter_factory,
-            shuffle_sink=self._test_shuffle_sink)
+            shuffle_sink=self._test_shuffle_sink,
+            write_buffer_bytes=self._shuffle_write_buffer_bytes,
+            write_queue_depth=self._shuffle_write_queue_depth,
+            compression_level=self._shuffle_compression_level)
       elif isinstance(spec, maptask.WorkerFlatten):
         op = FlattenOperation(spec, self._map_task.counter_factory)
       elif isinstance(spec, maptask.WorkerMergeWindows):
@@ -883,13 +1515,35 @@ class MapTaskExecutor(Executor):
       for ix, op in enumerate(self._ops):
         op.step_name = self._map_task.step_names[ix]
 
-    ix = len(self._ops)
-    for op in reversed(self._ops):
-      ix -= 1
-      logging.debug('Starting op %d %s', ix, op)
-      op.start()
+    sampler = self.state_sampler
     for op in self._ops:
-      op.finish(*())
+      op.state_sampler = sampler
+
+    # Run linear chains of ParDos as single operations.
+    self._ops = fuse_do_operations(self._ops)
+
+    sampler.start()
+    try:
+      ix = len(self._ops)
+      for op in reversed(self._ops):
+        ix -= 1
+        logging.debug('Starting op %d %s', ix, op)
+        with sampler.scoped_state(sampler.get_state(op.step_name, 'start')):
+          op.start()
+      for op in self._ops:
+        with sampler.scoped_state(sampler.get_state(op.step_name, 'finish')):
+          op.finish(*())
+    except:  # pylint: disable=bare-except
+      exc_info = sys.exc_info()
+      for op in self._ops:
+        try:
+          op.abort()
+        except Exception:  # pylint: disable=broad-except
+          # The original failure is the one worth reporting.
+          logging.warning('Failed to abort op %s', op, exc_info=True)
+      raise exc_info[0], exc_info[1], exc_info[2]
+    finally:
+      sampler.stop()
 
 
 class CustomSourceSplitExecutor(Executor):
@@ -15,7 +15,9 @@
 """Tests for work item executor functionality."""
 
 import logging
+import shutil
 import tempfile
+import time
 import unittest
 
 import mock
@@ -25,12 +27,19 @@ from google.cloud.dataflow.internal import pickler
 from google.cloud.dataflow.internal import util
 from google.cloud.dataflow.io import bigquery
 from google.cloud.dataflow.io import fileio
+from google.cloud.dataflow.runners import common
 import google.cloud.dataflow.transforms as ptransform
+from google.cloud.dataflow.transforms import combiners
 from google.cloud.dataflow.transforms import core
 from google.cloud.dataflow.transforms import window
+from google.cloud.dataflow.utils.counters import CounterFactory
+from google.cloud.dataflow.utils.options import PipelineOptions
 from google.cloud.dataflow.worker import executor
 from google.cloud.dataflow.worker import inmemory
+from google.cloud.dataflow.worker import localshuffle
 from google.cloud.dataflow.worker import maptask
+from google.cloud.dataflow.worker import shuffle
+from google.cloud.dataflow.worker import sideinputs
 from google.cloud.dataflow.worker import workitem
 
 
@@ -95,6 +104,44 @@ class DoFnUsingWithUndeclaredSideOutput(ptransform.DoFn):
     yield context.element
 
 
+class DoFnUsingProcessBatch(ptransform.DoFn):
+  """A DoFn class processing whole batches, tagging outputs by batch size."""
+
+  def process(self, context, *args, **kwargs):
+    return ['%s/1' % context.element]
+
+  def process_batch(self, context, *args, **kwargs):
+    size = len(context.elements)
+    return [['%s/%d' % (e, size)] for e in context.elements]
+
+
+class DoFnUsingSetup(ptransform.DoFn):
+  """A DoFn class tagging outputs by the bundles its instance processed."""
+
+  teardowns = []
+
+  def setup(self):
+    self.bundles = 0
+
+  def start_bundle(self, context, *args, **kwargs):
+    self.bundles += 1
+
+  def process(self, context, *args, **kwargs):
+    return ['%s/%d' % (context.element, self.bundles)]
+
+  def teardown(self):
+    DoFnUsingSetup.teardowns.append(self.bundles)
+
+
+class FailingDoFnUsingSetup(DoFnUsingSetup):
+  """A DoFn class using setup whose bundles fail on element 'b'."""
+
+  def process(self, context, *args, **kwargs):
+    if context.element == 'b':
+      raise ValueError('Cannot process b')
+    return super(FailingDoFnUsingSetup, self).process(context, *args, **kwargs)
+
+
 class ProgressRequestRecordingInMemoryReader(inmemory.InMemoryReader):
 
   def __init__(self, source):
@@ -183,6 +230,102 @@ class ExecutorTest(unittest.TestCase):
     with open(finish_path) as f:
       self.assertEqual('finish called.', f.read())
 
+  def run_do_fn_using_setup(self, dofn_cache, dofn=None):
+    output_buffer = []
+    work_item = workitem.BatchWorkItem(None)
+    work_item.map_task = make_map_task([
+        maptask.WorkerRead(
+            inmemory.InMemorySource(
+                elements=[pickler.dumps(e) for e in ['a', 'b']]),
+            output_coders=[self.OUTPUT_CODER]),
+        maptask.WorkerDoFn(serialized_fn=pickle_with_side_inputs(
+            dofn or DoFnUsingSetup()),
+                           output_tags=['out'],
+                           output_coders=[self.OUTPUT_CODER],
+                           input=(0, 0),
+                           side_inputs=None),
+        maptask.WorkerInMemoryWrite(output_buffer=output_buffer,
+                                    input=(1, 0),
+                                    output_coders=(self.OUTPUT_CODER,))])
+    executor.MapTaskExecutor(
+        work_item.map_task, dofn_cache=dofn_cache).execute()
+    return output_buffer
+
+  def test_do_fn_setup_and_teardown(self):
+    DoFnUsingSetup.teardowns = []
+    self.assertEqual(['a/1', 'b/1'], self.run_do_fn_using_setup(None))
+    self.assertEqual(['a/1', 'b/1'], self.run_do_fn_using_setup(None))
+    self.assertEqual([1, 1], DoFnUsingSetup.teardowns)
+
+  def test_do_fn_cache(self):
+    DoFnUsingSetup.teardowns = []
+    dofn_cache = executor.DoFnCache(max_entries=1)
+    self.assertEqual(['a/1', 'b/1'], self.run_do_fn_using_setup(dofn_cache))
+    # The second work item reuses the DoFn instance set up by the first one.
+    self.assertEqual(['a/2', 'b/2'], self.run_do_fn_using_setup(dofn_cache))
+    self.assertEqual((1, 1), (dofn_cache.hits, dofn_cache.misses))
+    self.assertEqual(1, len(dofn_cache))
+    self.assertEqual([], DoFnUsingSetup.teardowns)
+
+  def test_do_fn_torn_down_when_bundle_fails(self):
+    DoFnUsingSetup.teardowns = []
+    dofn_cache = executor.DoFnCache(max_entries=1)
+    with self.assertRaisesRegexp(ValueError, 'Cannot process b'):
+      self.run_do_fn_using_setup(dofn_cache, FailingDoFnUsingSetup())
+    # The DoFn of the failed bundle is not given back to the cache.
+    self.assertEqual(0, len(dofn_cache))
+    self.assertEqual([1], DoFnUsingSetup.teardowns)
+    with self.assertRaisesRegexp(ValueError, 'Cannot process b'):
+      self.run_do_fn_using_setup(None, FailingDoFnUsingSetup())
+    self.assertEqual([1, 1], DoFnUsingSetup.teardowns)
+
+  def test_do_fn_cache_evicts_least_recently_released(self):
+    DoFnUsingSetup.teardowns = []
+    dofn_cache = executor.DoFnCache(max_entries=2)
+    serialized_fn = pickle_with_side_inputs(DoFnUsingSetup())
+    other_serialized_fn = pickle_with_side_inputs(DoFnUsingSetup(), (
+        'tag', pvalue.ListPCollectionView, ()))
+    fn_data = [dofn_cache.acquire(serialized_fn) for _ in range(2)]
+    other_fn_data = dofn_cache.acquire(other_serialized_fn)
+    for n, data in enumerate(fn_data):
+      data[0].bundles = n
+      dofn_cache.release(serialized_fn, data)
+    dofn_cache.release(other_serialized_fn, other_fn_data)
+    self.assertEqual([0], DoFnUsingSetup.teardowns)
+    self.assertEqual(2, len(dofn_cache))
+    self.assertIs(fn_data[1], dofn_cache.acquire(serialized_fn))
+    self.assertIs(other_fn_data, dofn_cache.acquire(other_serialized_fn))
+
+  def test_step_msecs(self):
+    output_buffer = []
+    work_item = workitem.BatchWorkItem(None)
+    work_item.map_task = make_map_task([
+        maptask.WorkerRead(
+            inmemory.InMemorySource(
+                elements=[pickler.dumps(e) for e in ['a', 'b']]),
+            output_coders=[self.OUTPUT_CODER]),
+        maptask.WorkerDoFn(serialized_fn=pickle_with_side_inputs(
+            ptransform.CallableWrapperDoFn(
+                lambda x: time.sleep(0.05) or [x])),
+                           output_tags=['out'],
+                           output_coders=[self.OUTPUT_CODER],
+                           input=(0, 0),
+                           side_inputs=None),
+        maptask.WorkerInMemoryWrite(output_buffer=output_buffer,
+                                    input=(1, 0),
+                                    output_coders=(self.OUTPUT_CODER,))])
+    map_task_executor = executor.MapTaskExecutor(work_item.map_task)
+    map_task_executor.state_sampler.sampling_period_msecs = 1
+    map_task_executor.execute()
+    self.assertEqual(['a', 'b'], output_buffer)
+    counters = dict((c.name, c.value())
+                    for c in work_item.map_task.itercounters())
+    # The time spent in the DoFn is attributed to its step, not to the read
+    # step feeding it.
+    self.assertTrue(counters['step-1-msecs'] >= 50, counters)
+    self.assertTrue(counters['step-1-msecs'] > counters.get('step-0-msecs'),
+                    counters)
+
   def test_read_do_write_with_undeclared_output(self):
     input_path = self.create_temp_file('01234567890123456789\n0123456789')
     output_path = '%s.out' % input_path
@@ -239,6 +382,152 @@ class ExecutorTest(unittest.TestCase):
         [mock.call('a', '', 1), mock.call('b', '', 1),
          mock.call('c', '', 1), mock.call('d', '', 1)])
 
+  def test_ungrouped_shuffle_write_with_compression(self):
+    elements = range(100)
+    work_spec = [
+        maptask.WorkerRead(
+            inmemory.InMemorySource(
+                elements=[pickler.dumps(e) for e in elements]),
+            output_coders=[self.OUTPUT_CODER]),
+        maptask.WorkerShuffleWrite(shuffle_kind='ungrouped',
+                                   shuffle_writer_config='none',
+                                   input=(0, 0),
+                                   output_coders=(self.SHUFFLE_CODER,))
+    ]
+    shuffle_sink_mock = mock.MagicMock()
+    executor.MapTaskExecutor(
+        make_map_task(work_spec), test_shuffle_sink=shuffle_sink_mock,
+        pipeline_options=PipelineOptions(
+            ['--shuffle_compression_level=6'])).execute()
+    calls = shuffle_sink_mock.writer().Write.call_args_list
+    self.assertEqual(elements, [c[0][2] for c in calls])
+    # Compression does not change how values are spread: each one still gets
+    # a random key of its own.
+    self.assertEqual(len(elements), len(set(c[0][0] for c in calls)))
+
+  def test_shuffle_write_with_sorted_values(self):
+    work_spec = [
+        maptask.WorkerRead(
+            inmemory.InMemorySource(
+                elements=[pickler.dumps(e)
+                          for e in [('a', ('x', 1)), ('b', ('y', 2))]]),
+            output_coders=[self.OUTPUT_CODER]),
+        maptask.WorkerShuffleWrite(
+            shuffle_kind='group_keys_and_sort_values',
+            shuffle_writer_config='none',
+            input=(0, 0),
+            output_coders=(coders.TupleCoder(
+                [coders.BytesCoder(),
+                 coders.TupleCoder([coders.BytesCoder(),
+                                    coders.VarIntCoder()])]),))
+    ]
+    shuffle_sink_mock = mock.MagicMock()
+    executor.MapTaskExecutor(make_map_task(work_spec),
+                             test_shuffle_sink=shuffle_sink_mock).execute()
+    # The encoded sort keys are written as secondary keys.
+    shuffle_sink_mock.writer().Write.assert_has_calls(
+        [mock.call('a', 'x', 1), mock.call('b', 'y', 2)])
+
+  def test_shuffle_write_abort(self):
+    spec = maptask.WorkerShuffleWrite(
+        shuffle_kind='group_keys',
+        shuffle_writer_config='none',
+        input=(0, 0),
+        output_coders=(coders.TupleCoder(
+            [coders.BytesCoder(), coders.VarIntCoder()]),))
+    op = executor.ShuffleWriteOperation(spec, CounterFactory())
+    op.step_name = 'write'
+    # Aborting an operation which was not started does nothing.
+    op.abort()
+    shuffle_writer = mock.MagicMock()
+    with mock.patch.object(shuffle, '_create_shuffle_writer',
+                           return_value=shuffle_writer):
+      op.start()
+    flusher = op.writer.flusher
+    op.process(window.GlobalWindows.windowed_value(('a', 1)))
+    op.abort()
+    # The flushing thread has exited, and the buffered entry was dropped.
+    self.assertFalse(flusher._thread.is_alive())
+    self.assertFalse(shuffle_writer.Write.called)
+    shuffle_writer.Close.assert_called_once_with()
+
+  def test_shuffle_write_with_int_sort_keys(self):
+    work_spec = [
+        maptask.WorkerRead(
+            inmemory.InMemorySource(
+                elements=[pickler.dumps(e)
+                          for e in [('a', (200, 'x')), ('a', (-1, 'y'))]]),
+            output_coders=[self.OUTPUT_CODER]),
+        maptask.WorkerShuffleWrite(
+            shuffle_kind='group_keys_and_sort_values',
+            shuffle_writer_config='none',
+            input=(0, 0),
+            output_coders=(coders.TupleCoder(
+                [coders.BytesCoder(),
+                 coders.TupleCoder([coders.VarIntCoder(),
+                                    coders.BytesCoder()])]),))
+    ]
+    shuffle_sink_mock = mock.MagicMock()
+    executor.MapTaskExecutor(make_map_task(work_spec),
+                             test_shuffle_sink=shuffle_sink_mock).execute()
+    # The sort keys are written in an order-preserving encoding.
+    shuffle_sink_mock.writer().Write.assert_has_calls(
+        [mock.call('a', '\x80\x00\x00\x00\x00\x00\x00\xc8', 'x'),
+         mock.call('a', '\x7f\xff\xff\xff\xff\xff\xff\xff', 'y')])
+
+  def test_sorted_shuffle_with_reified_values(self):
+    value_coder = coders.WindowedValueCoder(
+        coders.TupleCoder([coders.BytesCoder(), coders.VarIntCoder()]))
+    shuffle_coder = coders.TupleCoder([coders.BytesCoder(), value_coder])
+    output_buffer = []
+    directory = tempfile.mkdtemp()
+    try:
+      config = localshuffle.local_shuffle_config(directory)
+      executor.MapTaskExecutor(make_map_task([
+          maptask.WorkerRead(
+              inmemory.InMemorySource(
+                  elements=[pickler.dumps(e)
+                            for e in [('a', ('y', 2)), ('a', ('x', 1))]]),
+              output_coders=[self.OUTPUT_CODER]),
+          maptask.WorkerReifyTimestampAndWindows(
+              output_tags=['out'],
+              input=(0, 0),
+              output_coders=[shuffle_coder]),
+          maptask.WorkerShuffleWrite(
+              shuffle_kind='group_keys_and_sort_values',
+              shuffle_writer_config=config,
+              input=(1, 0),
+              output_coders=(shuffle_coder,))
+      ])).execute()
+      executor.MapTaskExecutor(make_map_task([
+          maptask.WorkerGroupingShuffleRead(
+              shuffle_reader_config=config,
+              start_shuffle_position='',
+              end_shuffle_position='',
+              coder=coders.TupleCoder(
+                  [coders.BytesCoder(), coders.IterableCoder(value_coder)]),
+              output_coders=[self.OUTPUT_CODER],
+              sort_values=True),
+          maptask.WorkerDoFn(serialized_fn=pickle_with_side_inputs(
+              ptransform.CallableWrapperDoFn(lambda (k, vs): [(k, list(vs))])),
+                             output_tags=['out'],
+                             output_coders=[self.OUTPUT_CODER],
+                             input=(0, 0),
+                             side_inputs=None),
+          maptask.WorkerInMemoryWrite(output_buffer=output_buffer,
+                                      input=(1, 0),
+                                      output_coders=(self.OUTPUT_CODER,))
+      ])).execute()
+    finally:
+      shutil.rmtree(directory)
+    # The values keep their timestamps and windows, and are sorted.
+    value_coder = value_coder.get_impl()
+    self.assertEqual(
+        [('a', [value_coder.decode(value_coder.encode(
+            window.GlobalWindows.windowed_value(v)))
+                for v in [('x', 1), ('y', 2)]])],
+        output_buffer)
+
   def test_shuffle_read_do_write(self):
     output_path = self.create_temp_file('n/a')
     work_spec = [
@@ -246,7 +535,8 @@ class ExecutorTest(unittest.TestCase):
                                           start_shuffle_position='aaa',
                                           end_shuffle_position='zzz',
                                           coder=self.SHUFFLE_CODER,
-                                          output_coders=[self.SHUFFLE_CODER]),
+                                          output_coders=[self.SHUFFLE_CODER],
+                                          sort_values=False),
         maptask.WorkerDoFn(serialized_fn=pickle_with_side_inputs(
             ptransform.CallableWrapperDoFn(
                 lambda (k, vs): [str((k, v)) for v in vs])),
@@ -310,6 +600,57 @@ class ExecutorTest(unittest.TestCase):
     with open(output_path) as f:
       self.assertEqual('XYZ: ghi\n', f.read())
 
+  def test_fused_do_chain(self):
+    elements = ['abc', 'def', 'ghi']
+    output_buffer = []
+    work_item = workitem.BatchWorkItem(None)
+    work_item.map_task = make_map_task([
+        maptask.WorkerRead(
+            inmemory.InMemorySource(
+                elements=[pickler.dumps(e) for e in elements],
+                start_index=0,
+                end_index=3),
+            output_coders=[self.OUTPUT_CODER]),
+        maptask.WorkerDoFn(serialized_fn=pickle_with_side_inputs(
+            ptransform.CallableWrapperDoFn(lambda x: [x.upper()])),
+                           output_tags=['out'],
+                           output_coders=[self.OUTPUT_CODER],
+                           input=(0, 0),
+                           side_inputs=None),
+        maptask.WorkerDoFn(serialized_fn=pickle_with_side_inputs(
+            ptransform.CallableWrapperDoFn(lambda x: [x, x + '!'])),
+                           output_tags=['out'],
+                           output_coders=[self.OUTPUT_CODER],
+                           input=(1, 0),
+                           side_inputs=None),
+        maptask.WorkerDoFn(serialized_fn=pickle_with_side_inputs(
+            ptransform.CallableWrapperDoFn(
+                lambda x: [x] if x != 'DEF!' else [])),
+                           output_tags=['out'],
+                           output_coders=[self.OUTPUT_CODER],
+                           input=(2, 0),
+                           side_inputs=None),
+        maptask.WorkerInMemoryWrite(output_buffer=output_buffer,
+                                    input=(3, 0),
+                                    output_coders=(self.OUTPUT_CODER,))
+    ])
+    map_executor = executor.MapTaskExecutor(work_item.map_task)
+    map_executor.execute()
+    self.assertEqual(['ABC', 'ABC!', 'DEF', 'GHI', 'GHI!'], output_buffer)
+
+    # pylint: disable=protected-access
+    fused_ops = [op for op in map_executor._ops
+                 if isinstance(op, executor.FusedDoOperation)]
+    self.assertEqual(1, len(fused_ops))
+    self.assertEqual(3, len(fused_ops[0].operations))
+    # Each fused step still reports its own element counts.
+    counters = dict((c.name, c.value())
+                    for c in work_item.map_task.itercounters())
+    self.assertEqual(3, counters['step-0-out0-ElementCount'])
+    self.assertEqual(3, counters['step-1-out0-ElementCount'])
+    self.assertEqual(6, counters['step-2-out0-ElementCount'])
+    self.assertEqual(5, counters['step-3-out0-ElementCount'])
+
   def test_create_do_avro_write(self):
     output_path = self.create_temp_file('n/a')
     elements = ['abc', 'def', 'ghi']
@@ -370,6 +711,130 @@ class ExecutorTest(unittest.TestCase):
     # only the first element appended.
     self.assertEqual(['abc:x', 'def:x', 'ghi:x'], output_buffer)
 
+  def test_read_batch_do_flatten_write(self):
+    elements = ['a', 'b', 'c', 'd', 'e']
+    output_buffer = []
+    work_item = workitem.BatchWorkItem(None)
+    work_item.map_task = make_map_task([
+        maptask.WorkerRead(
+            inmemory.InMemorySource(
+                elements=[pickler.dumps(e) for e in elements],
+                start_index=0,
+                end_index=5),
+            output_coders=[self.OUTPUT_CODER]),
+        maptask.WorkerDoFn(serialized_fn=pickle_with_side_inputs(
+            DoFnUsingProcessBatch()),
+                           output_tags=['out'],
+                           output_coders=[self.OUTPUT_CODER],
+                           input=(0, 0),
+                           side_inputs=None),
+        maptask.WorkerDoFn(serialized_fn=pickle_with_side_inputs(
+            ptransform.CallableWrapperDoFn(
+                lambda x: [x.upper()] if x != 'c/5' else [])),
+                           output_tags=['out'],
+                           output_coders=[self.OUTPUT_CODER],
+                           input=(1, 0),
+                           side_inputs=None),
+        maptask.WorkerFlatten(inputs=[(2, 0)],
+                              output_coders=[self.OUTPUT_CODER]),
+        maptask.WorkerInMemoryWrite(output_buffer=output_buffer,
+                                    input=(3, 0),
+                                    output_coders=(self.OUTPUT_CODER,))
+    ])
+    executor.MapTaskExecutor(work_item.map_task).execute()
+    # All five elements reach the DoFn's process_batch in one batch.
+    self.assertEqual(['A/5', 'B/5', 'D/5', 'E/5'], output_buffer)
+    counters = dict((c.name, c.value())
+                    for c in work_item.map_task.itercounters())
+    self.assertEqual(5, counters['step-0-out0-ElementCount'])
+    self.assertEqual(5, counters['step-1-out0-ElementCount'])
+    self.assertEqual(4, counters['step-2-out0-ElementCount'])
+    self.assertEqual(4, counters['step-3-out0-ElementCount'])
+    self.assertEqual(4, counters['step-4-out0-ElementCount'])
+
+  def test_read_batches_are_bounded(self):
+    elements = range(250)
+    output_buffer = []
+    work_item = workitem.BatchWorkItem(None)
+    work_item.map_task = make_map_task([
+        maptask.WorkerRead(
+            inmemory.InMemorySource(
+                elements=[pickler.dumps(e) for e in elements]),
+            output_coders=[self.OUTPUT_CODER]),
+        maptask.WorkerDoFn(serialized_fn=pickle_with_side_inputs(
+            DoFnUsingProcessBatch()),
+                           output_tags=['out'],
+                           output_coders=[self.OUTPUT_CODER],
+                           input=(0, 0),
+                           side_inputs=None),
+        maptask.WorkerInMemoryWrite(output_buffer=output_buffer,
+                                    input=(1, 0),
+                                    output_coders=(self.OUTPUT_CODER,))
+    ])
+    executor.MapTaskExecutor(work_item.map_task).execute()
+    batch_size = executor.ReadOperation.READ_BATCH_SIZE
+    self.assertEqual(
+        ['%d/%d' % (e, min(batch_size, len(elements) - e // batch_size *
+                                       batch_size))
+         for e in elements],
+        output_buffer)
+
+  def _run_dofn_batch(self, dofn, elements, events):
+
+    class RecordingReceivers(object):
+
+      def output(self, windowed_value):
+        events.append(('output', windowed_value.value))
+
+      def output_batch(self, windowed_values):
+        events.append(('output_batch', [v.value for v in windowed_values]))
+
+    runner = common.DoFnRunner(
+        dofn, [], {}, [], core.Windowing(window.GlobalWindows()),
+        ptransform.DoFnProcessContext('label'), {None: RecordingReceivers()})
+    runner.process_batch(
+        [window.GlobalWindows.windowed_value(e) for e in elements])
+
+  def test_batch_outputs_of_per_element_dofn_are_streamed(self):
+    events = []
+
+    class FanOutDoFn(ptransform.DoFn):
+
+      def process(self, context):
+        events.append(('process', context.element))
+        return [context.element] * 2
+
+    self._run_dofn_batch(FanOutDoFn(), ['a', 'b'], events)
+    # Each element's outputs reach the receivers before the next element is
+    # processed.
+    self.assertEqual([('process', 'a'), ('output', 'a'), ('output', 'a'),
+                      ('process', 'b'), ('output', 'b'), ('output', 'b')],
+                     events)
+
+  def test_process_batch_outputs_are_bounded(self):
+    size = common.MAX_OUTPUT_BATCH_SIZE
+    events = []
+    self._run_dofn_batch(
+        DoFnUsingProcessBatch(), range(size + size // 2), events)
+    self.assertEqual(['output_batch', 'output_batch'],
+                     [event for event, _ in events])
+    self.assertEqual([size, size // 2], [len(values) for _, values in events])
+
+  def test_failed_process_batch_releases_batch(self):
+
+    class FailingDoFn(ptransform.DoFn):
+
+      def process_batch(self, context):
+        self.context = context
+        raise ValueError('process_batch failed')
+
+    dofn = FailingDoFn()
+    with self.assertRaises(ValueError):
+      self._run_dofn_batch(dofn, ['a', 'b'], [])
+    # The context of a reused DoFn does not keep the failed batch.
+    self.assertIsNone(dofn.context.elements)
+    self.assertIsNone(dofn.context.windowed_values)
+
   def test_in_memory_source_progress_reporting(self):
     elements = [101, 201, 301, 401, 501, 601, 701]
     output_buffer = []
@@ -382,12 +847,15 @@ class ExecutorTest(unittest.TestCase):
                                     input=(0, 0),
                                     output_coders=(self.OUTPUT_CODER,))
     ])
-    executor.MapTaskExecutor(work_item.map_task).execute()
+    map_task_executor = executor.MapTaskExecutor(work_item.map_task)
+    map_task_executor.execute()
     self.assertEqual(elements, output_buffer)
 
-    expected_progress_record = range(len(elements))
-    self.assertEqual(expected_progress_record,
-                     source.last_reader.progress_record)
+    # Progress is pulled from a snapshot of the reader on demand, rather than
+    # requested after every element.
+    self.assertEqual([], source.last_reader.progress_record)
+    self.assertEqual(len(elements) - 1,
+                     map_task_executor.get_progress().position.record_index)
 
   def test_create_do_with_side_text_file_write(self):
     input_path = self.create_temp_file('x\ny\n')
@@ -426,6 +894,76 @@ class ExecutorTest(unittest.TestCase):
     self.assertEqual([u'aa:x', u'aa:y', u'bb:x', u'bb:y'],
                      sorted(output_buffer))
 
+  def test_side_input_cache(self):
+    side_input_cache = sideinputs.SideInputCache(max_bytes=1 << 20)
+    for attempt in range(2):
+      output_buffer = []
+      work_item = workitem.BatchWorkItem(None)
+      work_item.map_task = make_map_task([
+          maptask.WorkerRead(
+              inmemory.InMemorySource(
+                  elements=[pickler.dumps(e) for e in ['a', 'b']]),
+              output_coders=[self.OUTPUT_CODER]),
+          maptask.WorkerDoFn(
+              serialized_fn=pickle_with_side_inputs(
+                  ptransform.CallableWrapperDoFn(
+                      lambda x, side: ['%s:%s' % (x, s) for s in side]),
+                  tag_and_type=('inmemory', pvalue.ListPCollectionView, ())),
+              output_tags=['out'], input=(0, 0),
+              side_inputs=[
+                  maptask.WorkerSideInputSource(
+                      inmemory.InMemorySource(
+                          elements=[pickler.dumps(e) for e in ['x', 'y']]),
+                      tag='inmemory')],
+              output_coders=[self.OUTPUT_CODER]),
+          maptask.WorkerInMemoryWrite(output_buffer=output_buffer,
+                                      input=(1, 0),
+                                      output_coders=(self.OUTPUT_CODER,))])
+      executor.MapTaskExecutor(
+          work_item.map_task, side_input_cache=side_input_cache).execute()
+      self.assertEqual(['a:x', 'a:y', 'b:x', 'b:y'], output_buffer)
+      counters = dict((c.name, c.value())
+                      for c in work_item.map_task.itercounters())
+      if attempt == 0:
+        self.assertEqual(1, counters['step-1-SideInputCacheMisses'])
+        self.assertNotIn('step-1-SideInputCacheHits', counters)
+      else:
+        # The side input is not read again by the second work item.
+        self.assertEqual(1, counters['step-1-SideInputCacheHits'])
+        self.assertNotIn('step-1-SideInputCacheMisses', counters)
+    self.assertEqual(1, len(side_input_cache))
+    self.assertTrue(side_input_cache.size > 0)
+
+  def test_spilled_side_inputs(self):
+    output_buffer = []
+    work_item = workitem.BatchWorkItem(None)
+    work_item.map_task = make_map_task([
+        maptask.WorkerRead(
+            inmemory.InMemorySource(
+                elements=[pickler.dumps(e) for e in ['a', 'b']]),
+            output_coders=[self.OUTPUT_CODER]),
+        maptask.WorkerDoFn(
+            serialized_fn=pickle_with_side_inputs(
+                ptransform.CallableWrapperDoFn(
+                    lambda x, side: ['%s:%s' % (x, side.get(x))]),
+                tag_and_type=('inmemory', pvalue.DictPCollectionView, ())),
+            output_tags=['out'], input=(0, 0),
+            side_inputs=[
+                maptask.WorkerSideInputSource(
+                    inmemory.InMemorySource(
+                        elements=[pickler.dumps(e)
+                                  for e in [('a', 1), ('c', 3)]]),
+                    tag='inmemory')],
+            output_coders=[self.OUTPUT_CODER]),
+        maptask.WorkerInMemoryWrite(output_buffer=output_buffer,
+                                    input=(1, 0),
+                                    output_coders=(self.OUTPUT_CODER,))])
+    executor.MapTaskExecutor(
+        work_item.map_task,
+        pipeline_options=PipelineOptions(
+            ['--side_input_spill_threshold_bytes=0'])).execute()
+    self.assertEqual(['a:1', 'b:None'], output_buffer)
+
   def test_create_do_with_singleton_side_bigquery_write(self):
     elements = ['abc', 'def', 'ghi']
     side_elements = ['x', 'y', 'z']
@@ -609,6 +1147,88 @@ class ExecutorTest(unittest.TestCase):
     executor.MapTaskExecutor(work_item.map_task).execute()
     self.assertEqual([('a', [1, 3, 4]), ('b', [2])], sorted(output_buffer))
 
+  def test_pgbk_flushes_least_recently_used_keys(self):
+    elements = [('a', 0), ('b', 1), ('a', 2), ('c', 3), ('a', 4), ('d', 5),
+                ('a', 6)]
+    output_buffer = []
+    work_item = workitem.BatchWorkItem(None)
+    work_item.map_task = make_map_task([
+        maptask.WorkerRead(
+            inmemory.InMemorySource(
+                elements=[pickler.dumps(e) for e in elements],
+                start_index=0,
+                end_index=100),
+            output_coders=[self.OUTPUT_CODER]),
+        maptask.WorkerPartialGroupByKey(
+            combine_fn=None,
+            input=(0, 0),
+            output_coders=[self.OUTPUT_CODER]),
+        maptask.WorkerInMemoryWrite(output_buffer=output_buffer,
+                                    input=(1, 0),
+                                    output_coders=(self.OUTPUT_CODER,))
+    ])
+    # A new key costs 10 bytes and each further value 4 bytes, so the table
+    # goes over budget when 'd' comes in, and 'a' is used again every time.
+    self.assertEqual(6, self.OUTPUT_CODER.estimate_size('a'))
+    self.assertEqual(4, self.OUTPUT_CODER.estimate_size(0))
+    options = PipelineOptions(['--pgbk_max_buffer_bytes=40'])
+    executor.MapTaskExecutor(
+        work_item.map_task, pipeline_options=options).execute()
+    self.assertEqual([('b', [1]), ('c', [3])], output_buffer[:2])
+    self.assertEqual([('a', [0, 2, 4, 6]), ('d', [5])],
+                     sorted(output_buffer[2:]))
+
+  def test_pgbk_samples_value_sizes(self):
+    op = executor.PGBKOperation(
+        maptask.WorkerPartialGroupByKey(
+            combine_fn=None,
+            input=(0, 0),
+            output_coders=[self.OUTPUT_CODER]),
+        CounterFactory())
+    op.value_coder = mock.Mock(wraps=op.value_coder)
+    op.step_name = 'pgbk'
+    op.start()
+    for i in range(100):
+      op.process(window.GlobalWindows.windowed_value(('a', i)))
+    # Values are sized after 1, 2, 4, ..., 64 of them, and the others are
+    # counted at the average size of those.
+    self.assertEqual(7, op.value_coder.estimate_size.call_count)
+    self.assertEqual(6 + 100 * 4, op.size)
+
+  def test_pgbkcv_evicts_least_recently_used_keys(self):
+    elements = [('a', 0), ('b', 1), ('a', 2), ('c', 3), ('a', 4), ('d', 5),
+                ('a', 6)]
+    output_buffer = []
+    work_item = workitem.BatchWorkItem(None)
+    work_item.map_task = make_map_task([
+        maptask.WorkerRead(
+            inmemory.InMemorySource(
+                elements=[pickler.dumps(e) for e in elements],
+                start_index=0,
+                end_index=100),
+            output_coders=[self.OUTPUT_CODER]),
+        maptask.WorkerPartialGroupByKey(
+            combine_fn=pickler.dumps(
+                (combiners.CountCombineFn(), (), {})),
+            input=(0, 0),
+            output_coders=[self.OUTPUT_CODER]),
+        maptask.WorkerInMemoryWrite(output_buffer=output_buffer,
+                                    input=(1, 0),
+                                    output_coders=(self.OUTPUT_CODER,))
+    ])
+    # Each key costs 6 bytes plus 1 for the varint of its count, so the table
+    # holds at most two keys and 'a' is always the most recently used one.
+    self.assertEqual(6, self.OUTPUT_CODER.estimate_size('a'))
+    options = PipelineOptions(['--pgbk_max_buffer_bytes=20'])
+    executor.MapTaskExecutor(
+        work_item.map_task, pipeline_options=options).execute()
+    self.assertEqual([('b', 1), ('c', 1)], output_buffer[:2])
+    self.assertEqual([('a', 4), ('d', 1)], sorted(output_buffer[2:]))
+    counters = dict((c.name, c.value())
+                    for c in work_item.map_task.itercounters())
+    self.assertEqual(2, counters['step-1-EvictedKeys'])
+    self.assertEqual(14, counters['step-1-EvictedBytes'])
+
 if __name__ == '__main__':
   logging.getLogger().setLevel(logging.INFO)
   unittest.main()
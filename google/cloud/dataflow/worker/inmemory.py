@@ -93,11 +93,21 @@ class InMemoryReader(iobase.NativeSourceReader):
         return
 
   def get_progress(self):
-    if self._current_index is None:
+    return self.progress_from_snapshot(self.get_progress_snapshot())
+
+  @property
+  def supports_progress_snapshots(self):
+    return True
+
+  def get_progress_snapshot(self):
+    return self._current_index
+
+  def progress_from_snapshot(self, snapshot):
+    if snapshot is None:
       return None
 
     return iobase.ReaderProgress(
-        position=iobase.ReaderPosition(record_index=self._current_index))
+        position=iobase.ReaderPosition(record_index=snapshot))
 
   def request_dynamic_split(self, dynamic_split_request):
     assert dynamic_split_request is not None
@@ -68,6 +68,18 @@ class InMemoryIO(unittest.TestCase):
       self.assertEqual(5, i)
       self.assertEqual(4, reader.get_progress().position.record_index)
 
+  def test_in_memory_source_progress_snapshots(self):
+    source = inmemory.InMemorySource([1, 2, 3], coder=FakeCoder())
+    with source.reader() as reader:
+      self.assertTrue(reader.supports_progress_snapshots)
+      self.assertIsNone(
+          reader.progress_from_snapshot(reader.get_progress_snapshot()))
+      for i, _ in enumerate(reader):
+        snapshot = reader.get_progress_snapshot()
+        self.assertEqual(i, snapshot)
+        self.assertEqual(
+            i, reader.progress_from_snapshot(snapshot).position.record_index)
+
   def try_splitting_reader_at(self, reader, split_request, expected_response):
     actual_response = reader.request_dynamic_split(split_request)
 
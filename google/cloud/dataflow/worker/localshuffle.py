@@ -0,0 +1,282 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A local, disk-backed shuffle implementing an external sort.
+
+The reader and writer follow the contract of the shuffle client library's
+PyShuffleReader and PyShuffleWriter, so that shuffle sources and sinks can
+be run on a single machine, e.g. for tests and benchmarks:
+
+  - LocalShuffleWriter.Write(entries) takes serialized (key, 2nd-key, value)
+    entries and Close() makes them visible to readers.
+  - LocalShuffleReader.Read(start, end) returns a chunk of serialized
+    (position, key, 2nd-key, value) entries, sorted by key and secondary key,
+    and the position to read the next chunk from ('' after the last chunk).
+
+A shuffle is a directory. Writers sort the entries they buffer and spill them
+as sorted runs, each in a file of its own, whenever the buffer grows too
+large. The first reader k-way merges all the runs into a single file, in
+which an entry's position is its offset, and writes the offsets of all the
+entries to an index file. Positions are 8-byte big-endian offsets, so they
+compare as the entries they point to are ordered.
+
+Shuffle sources and sinks use a local shuffle when configured with the
+config returned by local_shuffle_config(). The config may also ask readers to
+wait a given time on every read, standing in for the network round trips to
+a shuffler in benchmarks.
+"""
+
+from __future__ import absolute_import
+
+import array
+import base64
+import bisect
+import heapq
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+CONFIG_PREFIX = 'local-shuffle:'
+
+_RUN_SUFFIX = '.run'
+_MERGED_FILE_NAME = 'merged'
+_INDEX_FILE_NAME = 'merged.index'
+
+_unpack_length_from = struct.Struct('>I').unpack_from
+_pack_length = struct.Struct('>I').pack
+_pack_position = struct.Struct('>Q').pack
+_unpack_position = struct.Struct('>Q').unpack
+
+
+def local_shuffle_config(directory, read_latency_secs=0):
+  """Returns the shuffle config of a local shuffle stored in directory.
+
+  Args:
+    directory: the directory the shuffle is stored in.
+    read_latency_secs: the time readers of the shuffle wait on every read.
+  """
+  config = CONFIG_PREFIX + directory
+  if read_latency_secs:
+    # Paths cannot contain NUL characters.
+    config += '\0%r' % float(read_latency_secs)
+  return base64.urlsafe_b64encode(config)
+
+
+def is_local_shuffle_config(config):
+  """Tells whether a decoded shuffle config is that of a local shuffle."""
+  return config.startswith(CONFIG_PREFIX)
+
+
+def directory_of_config(config):
+  return config[len(CONFIG_PREFIX):].split('\0')[0]
+
+
+def read_latency_of_config(config):
+  """Returns the time readers of a local shuffle wait on every read."""
+  parts = config[len(CONFIG_PREFIX):].split('\0')
+  return float(parts[1]) if len(parts) > 1 else 0
+
+
+def iter_written_entries(data, pos=0, end=None):
+  """Yields (key, secondary_key, start, end) for entries written in data.
+
+  The entries are serialized as written to a shuffle writer, i.e. without
+  positions, between offsets pos and end of data. The start and end of each
+  entry are its offsets in data.
+  """
+  if end is None:
+    end = len(data)
+  unpack_length_from = _unpack_length_from
+  while pos < end:
+    start = pos
+    length, = unpack_length_from(data, pos)
+    pos += 4
+    key = data[pos:pos + length]
+    pos += length
+    length, = unpack_length_from(data, pos)
+    pos += 4
+    secondary_key = data[pos:pos + length]
+    pos += length
+    length, = unpack_length_from(data, pos)
+    pos += 4 + length
+    if pos > end:
+      raise ValueError('Truncated shuffle entry.')
+    yield key, secondary_key, start, pos
+
+
+class LocalShuffleWriter(object):
+  """Writes entries to a local shuffle as sorted runs."""
+
+  DEFAULT_RUN_BYTES = 64 << 20
+
+  def __init__(self, directory, run_bytes=DEFAULT_RUN_BYTES):
+    self.directory = directory
+    self.run_bytes = run_bytes
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+    # (key, secondary_key, entry) tuples written since the last spill.
+    self._entries = []
+    self._buffered_bytes = 0
+    self._closed = False
+
+  def Write(self, entries):  # pylint: disable=invalid-name
+    if self._closed:
+      raise RuntimeError('Writing to a closed shuffle writer.')
+    for key, secondary_key, start, end in iter_written_entries(entries):
+      self._entries.append((key, secondary_key, entries[start:end]))
+      self._buffered_bytes += end - start
+    if self._buffered_bytes >= self.run_bytes:
+      self._spill()
+
+  def _spill(self):
+    # Sorting is stable, so entries with equal keys keep their write order.
+    self._entries.sort(key=lambda entry: (entry[0], entry[1]))
+    fd, path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+      for _, _, entry in self._entries:
+        f.write(entry)
+    # Readers only ever see complete runs.
+    os.rename(path, path[:-len('.tmp')] + _RUN_SUFFIX)
+    self._entries = []
+    self._buffered_bytes = 0
+
+  def Close(self):  # pylint: disable=invalid-name
+    if not self._closed:
+      if self._entries:
+        self._spill()
+      self._closed = True
+
+
+class LocalShuffleReader(object):
+  """Reads the entries of a local shuffle, sorted, in chunks."""
+
+  DEFAULT_CHUNK_BYTES = 1 << 20
+
+  def __init__(self, directory, chunk_bytes=DEFAULT_CHUNK_BYTES,
+               read_latency_secs=0):
+    self.directory = directory
+    self.chunk_bytes = chunk_bytes
+    self.read_latency_secs = read_latency_secs
+    path = os.path.join(directory, _MERGED_FILE_NAME)
+    if not os.path.exists(path):
+      self._merge_runs(path)
+    self._size = os.path.getsize(path)
+    if self._size:
+      with open(path, 'rb') as f:
+        self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    else:
+      self._data = ''
+    # The offsets of all the entries, only loaded if positions other than
+    # those of entries are read from.
+    self._entry_starts = None
+
+  @property
+  def end_position(self):
+    """The position just past the last entry of the shuffle."""
+    return _pack_position(self._size)
+
+  def _merge_runs(self, path):
+    """Merges all the sorted runs of the shuffle into the file at path."""
+    run_paths = sorted(
+        os.path.join(self.directory, name)
+        for name in os.listdir(self.directory) if name.endswith(_RUN_SUFFIX))
+    # Runs are memory-mapped, so that they are paged in as they are merged.
+    run_data = []
+    try:
+      for run_path in run_paths:
+        with open(run_path, 'rb') as f:
+          run_data.append(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+      runs = [self._iter_run(index, data)
+              for index, data in enumerate(run_data)]
+      entry_starts = array.array('l')
+      fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+      with os.fdopen(fd, 'wb') as out:
+        offset = 0
+        for _, _, _, start, end, data in heapq.merge(*runs):
+          entry_starts.append(offset)
+          out.write(data[start:end])
+          offset += end - start
+      fd, tmp_index_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+      with os.fdopen(fd, 'wb') as out:
+        entry_starts.tofile(out)
+      # The index is in place whenever the merged file is.
+      os.rename(tmp_index_path, os.path.join(self.directory, _INDEX_FILE_NAME))
+      os.rename(tmp_path, path)
+    finally:
+      for data in run_data:
+        data.close()
+
+  @staticmethod
+  def _iter_run(index, data):
+    # The run index breaks ties between equal keys deterministically, and
+    # with the offsets keeps the entries of each run in their order.
+    for key, secondary_key, start, end in iter_written_entries(data):
+      yield key, secondary_key, index, start, end, data
+
+  def _offset(self, position, default):
+    if not position:
+      return default
+    if len(position) == 8:
+      offset, = _unpack_position(position)
+    else:
+      # The smallest 8-byte position at or after position.
+      offset, = _unpack_position(position[:8].ljust(8, '\0'))
+      if position[8:].strip('\0'):
+        offset += 1
+    if offset >= self._size:
+      return self._size
+    # Positions other than those of entries, e.g. positions interpolated to
+    # split a range, stand for the first entry after them.
+    if self._entry_starts is None:
+      with open(os.path.join(self.directory, _INDEX_FILE_NAME), 'rb') as f:
+        self._entry_starts = array.array('l', f.read())
+    index = bisect.bisect_left(self._entry_starts, offset)
+    if index == len(self._entry_starts):
+      return self._size
+    return self._entry_starts[index]
+
+  def Read(self, start_position, end_position):  # pylint: disable=invalid-name
+    """Returns a chunk of entries from start_position up to end_position.
+
+    Args:
+      start_position: The position of the first entry to read, or '' to read
+        from the first entry.
+      end_position: The position of the first entry not to read, or '' to read
+        up to the last entry.
+
+    Returns:
+      A (chunk, next_position) tuple where next_position is the position of the
+      first entry not in chunk, or '' if the chunk has the last entries in the
+      range.
+    """
+    if self.read_latency_secs:
+      time.sleep(self.read_latency_secs)
+    start = self._offset(start_position, 0)
+    end = self._offset(end_position, self._size)
+    pack_length = _pack_length
+    pack_position = _pack_position
+    data = self._data
+    parts = []
+    chunk_bytes = 0
+    for _, _, entry_start, entry_end in iter_written_entries(
+        data, start, end):
+      if chunk_bytes >= self.chunk_bytes:
+        return ''.join(parts), pack_position(entry_start)
+      parts.append(pack_length(8))
+      parts.append(pack_position(entry_start))
+      parts.append(data[entry_start:entry_end])
+      chunk_bytes += 12 + entry_end - entry_start
+    return ''.join(parts), ''
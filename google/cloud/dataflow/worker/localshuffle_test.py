@@ -0,0 +1,216 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the local shuffle."""
+
+import base64
+import cStringIO as StringIO
+import logging
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from google.cloud.dataflow import coders
+from google.cloud.dataflow.io import iobase
+from google.cloud.dataflow.worker import localshuffle
+from google.cloud.dataflow.worker import shuffle
+
+
+def encode_entries(entries):
+  stream = StringIO.StringIO()
+  for key, secondary_key, value in entries:
+    shuffle.ShuffleEntry(key, secondary_key, value, None).to_bytes(
+        stream, with_position=False)
+  return stream.getvalue()
+
+
+class LocalShuffleTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def read_all(self, reader, start_position='', end_position=''):
+    entries = []
+    num_chunks = 0
+    while True:
+      chunk, start_position = reader.Read(start_position, end_position)
+      num_chunks += 1
+      entries.extend(shuffle.iter_chunk_entries(chunk))
+      if not start_position:
+        return entries, num_chunks
+
+  def write(self, entries, run_bytes=localshuffle.LocalShuffleWriter.
+            DEFAULT_RUN_BYTES):
+    writer = localshuffle.LocalShuffleWriter(self.directory, run_bytes)
+    for entry in entries:
+      writer.Write(encode_entries([entry]))
+    writer.Close()
+
+  def test_entries_are_sorted_across_writers_and_runs(self):
+    self.write([('b', '2', 'w1-0'), ('a', '', 'w1-1'), ('b', '1', 'w1-2'),
+                ('c', '', 'w1-3'), ('a', '', 'w1-4')], run_bytes=40)
+    self.write([('a', '', 'w2-0'), ('b', '1', 'w2-1')])
+    self.assertEqual(3, len([name for name in os.listdir(self.directory)
+                             if name.endswith('.run')]))
+
+    reader = localshuffle.LocalShuffleReader(self.directory)
+    entries, num_chunks = self.read_all(reader)
+    self.assertEqual(1, num_chunks)
+    # Entries with equal keys can come in any order.
+    self.assertEqual(
+        [('a', ''), ('a', ''), ('a', ''), ('b', '1'), ('b', '1'), ('b', '2'),
+         ('c', '')],
+        [(e.key, e.secondary_key) for e in entries])
+    self.assertEqual(
+        [('a', '', 'w1-1'), ('a', '', 'w1-4'), ('a', '', 'w2-0'),
+         ('b', '1', 'w1-2'), ('b', '1', 'w2-1'), ('b', '2', 'w1-0'),
+         ('c', '', 'w1-3')],
+        sorted((e.key, e.secondary_key, e.value) for e in entries))
+    positions = [e.position for e in entries]
+    self.assertEqual(sorted(set(positions)), positions)
+
+    # Later readers reuse the merged entries.
+    self.assertEqual(
+        entries, self.read_all(localshuffle.LocalShuffleReader(
+            self.directory))[0])
+
+  def test_read_chunks_and_ranges(self):
+    self.write([('k%02d' % i, '', 'v' * 10) for i in range(50)])
+    reader = localshuffle.LocalShuffleReader(self.directory, chunk_bytes=100)
+    entries, num_chunks = self.read_all(reader)
+    self.assertEqual(['k%02d' % i for i in range(50)],
+                     [e.key for e in entries])
+    self.assertEqual(17, num_chunks)
+
+    start, end = entries[10].position, entries[20].position
+    range_entries, _ = self.read_all(reader, start, end)
+    self.assertEqual(entries[10:20], range_entries)
+    self.assertEqual(entries[45:], self.read_all(
+        reader, entries[45].position, '')[0])
+    self.assertEqual(entries[:5], self.read_all(
+        reader, '', entries[5].position)[0])
+
+  def test_read_between_entries(self):
+    writer = localshuffle.LocalShuffleWriter(self.directory)
+    writer.Write(encode_entries([('k%d' % i, '', 'v') for i in range(5)]))
+    writer.Close()
+    reader = localshuffle.LocalShuffleReader(self.directory)
+    entries, _ = self.read_all(reader)
+    offset, = struct.unpack('>Q', entries[2].position)
+    between = struct.pack('>Q', offset - 1)
+    self.assertEqual(entries[2:], self.read_all(reader, between, '')[0])
+    self.assertEqual(entries[:2], self.read_all(reader, '', between)[0])
+    # Positions of other lengths are compared as byte strings too.
+    self.assertEqual(
+        entries[2:], self.read_all(reader, between + '\x01', '')[0])
+    self.assertEqual(
+        entries, self.read_all(reader, '\0', reader.end_position)[0])
+
+  def test_empty_shuffle(self):
+    localshuffle.LocalShuffleWriter(self.directory).Close()
+    reader = localshuffle.LocalShuffleReader(self.directory)
+    self.assertEqual(('', ''), reader.Read('', ''))
+
+  def test_truncated_entries(self):
+    writer = localshuffle.LocalShuffleWriter(self.directory)
+    with self.assertRaises(ValueError):
+      writer.Write(encode_entries([('a', '', 'value')])[:-1])
+
+  def test_grouped_shuffle_source_and_sink(self):
+    coder = coders.PickleCoder()
+    config = localshuffle.local_shuffle_config(self.directory)
+    sink = shuffle.ShuffleSink(config, coder=coder, buffer_bytes=100)
+    for i in range(2):
+      with sink.writer() as writer:
+        for j in range(100):
+          writer.Write(j % 10, '', (i, j))
+
+    source = shuffle.GroupedShuffleSource(config, coder=coder)
+    with source.reader() as reader:
+      result = dict((key, sorted(values)) for key, values in reader)
+    self.assertEqual(range(10), sorted(result))
+    for key, values in result.items():
+      self.assertEqual(
+          [(i, j) for i in range(2) for j in range(key, 100, 10)], values)
+
+  def test_read_latency_config(self):
+    for latency in (0, 0.001):
+      config = base64.urlsafe_b64decode(
+          localshuffle.local_shuffle_config(self.directory, latency))
+      self.assertTrue(localshuffle.is_local_shuffle_config(config))
+      self.assertEqual(self.directory,
+                       localshuffle.directory_of_config(config))
+      self.assertEqual(latency, localshuffle.read_latency_of_config(config))
+
+  def test_grouped_shuffle_concurrent_ranges(self):
+    coder = coders.PickleCoder()
+    config = localshuffle.local_shuffle_config(self.directory, 0.001)
+    with shuffle.ShuffleSink(config, coder=coder).writer() as writer:
+      for i in range(100):
+        writer.Write(i % 10, '', i)
+    end_position = localshuffle.LocalShuffleReader(
+        self.directory).end_position
+    # The range is cut at positions falling between entries.
+    source = shuffle.GroupedShuffleSource(
+        config, coder=coder,
+        start_position=base64.urlsafe_b64encode('\0' * 8),
+        end_position=base64.urlsafe_b64encode(end_position),
+        read_ahead_chunks=1, concurrent_ranges=3)
+    with source.reader() as reader:
+      self.assertIsInstance(reader.entries_iterable,
+                            shuffle.ConcurrentShuffleEntriesIterable)
+      result = dict((key, sorted(values)) for key, values in reader)
+    self.assertEqual(
+        dict((key, range(key, 100, 10)) for key in range(10)), result)
+
+  def test_grouped_shuffle_dynamic_split(self):
+    coder = coders.PickleCoder()
+    config = localshuffle.local_shuffle_config(self.directory)
+    with shuffle.ShuffleSink(config, coder=coder).writer() as writer:
+      for i in range(100):
+        writer.Write(i % 10, '', i)
+    keys_and_positions = []
+    raw_reader = localshuffle.LocalShuffleReader(self.directory)
+    for entry in self.read_all(raw_reader)[0]:
+      if not keys_and_positions or keys_and_positions[-1][0] != entry.key:
+        keys_and_positions.append((entry.key, entry.position))
+    split_position = base64.urlsafe_b64encode(keys_and_positions[5][1])
+
+    source = shuffle.GroupedShuffleSource(config, coder=coder)
+    with source.reader() as reader:
+      reader_iter = iter(reader)
+      keys = [next(reader_iter)[0]]
+      result = reader.request_dynamic_split(iobase.DynamicSplitRequest(
+          iobase.ReaderProgress(position=iobase.ReaderPosition(
+              shuffle_position=split_position))))
+      self.assertEqual(split_position, result.stop_position.shuffle_position)
+      keys.extend(key for key, _ in reader_iter)
+    self.assertEqual(5, len(keys))
+
+    # The residual range starts at the split position.
+    residual = shuffle.GroupedShuffleSource(
+        config, coder=coder, start_position=split_position)
+    with residual.reader() as reader:
+      keys.extend(key for key, _ in reader)
+    self.assertEqual(range(10), sorted(keys))
+
+
+if __name__ == '__main__':
+  logging.getLogger().setLevel(logging.INFO)
+  unittest.main()
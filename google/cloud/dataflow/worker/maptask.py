@@ -109,7 +109,7 @@ Attributes:
 WorkerGroupingShuffleRead = build_worker_instruction(
     'WorkerGroupingShuffleRead',
     ['start_shuffle_position', 'end_shuffle_position',
-     'shuffle_reader_config', 'coder', 'output_coders'])
+     'shuffle_reader_config', 'coder', 'output_coders', 'sort_values'])
 """Worker details needed to read from a grouping shuffle source.
 
 Attributes:
@@ -122,6 +122,9 @@ Attributes:
     server appliance and various options.
   coder: The KV coder used to decode shuffle entries.
   output_coders: 1-tuple of the coder for the output.
+  sort_values: True if the values of each key were written to the shuffle
+    sorted by a secondary key (see WorkerShuffleWrite). The values coder of
+    coder is then a KV coder for the (secondary key, value) pairs.
 """
 
 
@@ -189,7 +192,10 @@ Attributes:
     ParallelInstruction operation whose output feeds into this operation.
     The output index is 0 except for multi-output operations (like ParDo).
   output_coders: 1-tuple of the coder for input elements. If the
-    shuffle_kind is grouping, this is expected to be a KV coder.
+    shuffle_kind is grouping, this is expected to be a KV coder. For
+    'group_keys_and_sort_values' the values are (secondary key, value) pairs,
+    written with the encoded secondary key as the shuffle secondary key, so
+    that they are read back sorted by it.
 """
 
 
@@ -429,7 +435,9 @@ def get_read_work_item(work, env, context):
         end_shuffle_position=source_spec['end_shuffle_position']['value'],
         shuffle_reader_config=source_spec['shuffle_reader_config']['value'],
         coder=coder,
-        output_coders=get_output_coders(work))
+        output_coders=get_output_coders(work),
+        sort_values=('sort_values' in source_spec and
+                     source_spec['sort_values']['value']))
   elif source_spec['@type'] == 'UngroupedShuffleSource':
     return WorkerUngroupedShuffleRead(
         start_shuffle_position=source_spec['start_shuffle_position']['value'],
@@ -25,6 +25,7 @@ cdef class OperationCounters(object):
   cdef public libc.stdint.int64_t _next_sample
 
   cpdef update_from(self, windowed_value, coder=*)
+  cpdef update_from_batch(self, list windowed_values, coder=*)
   cdef inline do_sample(self, windowed_value, coder)
   cpdef update_collect(self)
 
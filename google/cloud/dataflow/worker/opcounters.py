@@ -17,12 +17,41 @@
 """Counters collect the progress of the Worker for reporting to the service."""
 
 from __future__ import absolute_import
+import logging
 import math
 import random
 
+from google.cloud.dataflow.coders import WindowedValueCoder
 from google.cloud.dataflow.utils.counters import Counter
 
 
+class SumAccumulator(object):
+  """Accumulates the size of an element whose parts are observed lazily."""
+
+  def __init__(self):
+    self._value = 0
+
+  def update(self, value):
+    self._value += value
+
+  def value(self):
+    return self._value
+
+
+class SizeObserver(object):
+  """Adds the sizes of the values read from an observable to an accumulator."""
+
+  def __init__(self, accumulator, elem_coder_impl):
+    self.accumulator = accumulator
+    self.elem_coder_impl = elem_coder_impl
+
+  def __call__(self, value, is_encoded=False):
+    if is_encoded:
+      self.accumulator.update(len(value))
+    else:
+      self.accumulator.update(self.elem_coder_impl.estimate_size(value, True))
+
+
 class OperationCounters(object):
   """The set of basic counters to attach to an Operation."""
 
@@ -43,9 +72,43 @@ class OperationCounters(object):
     if self.should_sample():
       self.do_sample(windowed_value, coder)
 
+  def update_from_batch(self, windowed_values, coder=None):
+    """Add a list of values to this counter."""
+    self.element_counter.update(len(windowed_values))
+    for windowed_value in windowed_values:
+      if self.should_sample():
+        self.do_sample(windowed_value, coder)
+
   def do_sample(self, windowed_value, coder):
-    # TODO(ccy): implement in an efficient way.
-    pass
+    """Estimates the encoded size of an element and records it.
+
+    The size is computed by the coder without materializing the encoding.
+    Lazy iterables in the element (e.g. the values of a grouped shuffle read)
+    are measured as they are read instead, and recorded by update_collect.
+    Size estimation is best effort: elements the coder fails to size are
+    not recorded.
+    """
+    if coder is None:
+      coder = self.coder
+    try:
+      if isinstance(coder, WindowedValueCoder):
+        value = windowed_value
+      else:
+        value = windowed_value.value
+      size, observables = (
+          coder.get_impl().get_estimated_size_and_observables(value))
+    except Exception as exn:  # pylint: disable=broad-except
+      logging.debug('Unable to estimate the size of %r with %s: %s',
+                    windowed_value, coder, exn)
+      return
+    if not observables:
+      self.mean_byte_counter.update(size)
+      return
+    accumulator = SumAccumulator()
+    accumulator.update(size)
+    for observable, elem_coder_impl in observables:
+      observable.register_observer(SizeObserver(accumulator, elem_coder_impl))
+    self._active_accumulators.append(accumulator)
 
   def update_collect(self):
     """Collects the accumulated size estimates.
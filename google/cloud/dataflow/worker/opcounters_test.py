@@ -19,6 +19,7 @@ import random
 import unittest
 
 from google.cloud.dataflow import coders
+from google.cloud.dataflow.coders import observable
 from google.cloud.dataflow.transforms.window import GlobalWindows
 from google.cloud.dataflow.utils.counters import CounterFactory
 from google.cloud.dataflow.worker.opcounters import OperationCounters
@@ -40,6 +41,18 @@ class ObjectThatDoesNotImplementLen(object):
     pass
 
 
+class ObservableValues(observable.ObservableMixin):
+
+  def __init__(self, values):
+    super(ObservableValues, self).__init__()
+    self.values = values
+
+  def __iter__(self):
+    for value in self.values:
+      self.notify_observers(value)
+      yield value
+
+
 class OperationCountersTest(unittest.TestCase):
 
   def verify_counters(self, opcounts, expected_elements):
@@ -92,6 +105,41 @@ class OperationCountersTest(unittest.TestCase):
     opcounts.update_collect()
     self.verify_counters(opcounts, 3)
 
+  def test_mean_byte_count(self):
+    coder = coders.PickleCoder()
+    opcounts = OperationCounters(CounterFactory(), 'some-name', coder, 0)
+    opcounts.update_from(GlobalWindows.windowed_value('abc'))
+    opcounts.update_from(GlobalWindows.windowed_value('abcde'))
+    opcounts.update_collect()
+    self.assertEqual(
+        (len(coder.encode('abc')) + len(coder.encode('abcde'))) / 2,
+        opcounts.mean_byte_counter.value())
+
+  def test_mean_byte_count_of_observed_values(self):
+    coder = coders.WindowedValueCoder(
+        coders.TupleCoder((coders.BytesCoder(), coders.BytesCoder())))
+    opcounts = OperationCounters(CounterFactory(), 'some-name', coder, 0)
+    values = ObservableValues(['a', 'bc', 'def'])
+    windowed_value = GlobalWindows.windowed_value(('key', values))
+    opcounts.update_from(windowed_value)
+    # The values are only sized as they are read.
+    self.assertEqual(['a', 'bc', 'def'], list(values))
+    opcounts.update_collect()
+    without_values = GlobalWindows.windowed_value(('key', ''))
+    self.assertEqual(len(coder.encode(without_values)) - 1 + 2 + 3 + 4,
+                     opcounts.mean_byte_counter.value())
+
+  def test_mean_byte_count_of_generator_values(self):
+    coder = coders.TupleCoder(
+        (coders.BytesCoder(), coders.IterableCoder(coders.VarIntCoder())))
+    opcounts = OperationCounters(CounterFactory(), 'some-name', coder, 0)
+    values = (x for x in range(5))
+    # The first elements are always sampled.
+    opcounts.update_from(GlobalWindows.windowed_value(('k', values)))
+    opcounts.update_collect()
+    # Sampling the element must leave its values to the receivers.
+    self.assertEqual(range(5), list(values))
+
   def test_should_sample(self):
     # Order of magnitude more buckets than highest constant in code under test.
     buckets = [0] * 300
@@ -0,0 +1,124 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Microbenchmarks for the key tables of partial group-by-key operations.
+
+Compares the second chance eviction used by PGBKOperation and PGBKCVOperation
+with an exact LRU kept in an OrderedDict, and with sorting a plain dict by
+last access on every overflow. Keys are drawn half from a small set of hot
+keys and half uniformly from --num_keys keys, and the table evicts down to
+90% of --max_keys keys whenever it holds more. Run with:
+
+  python -m google.cloud.dataflow.worker.pgbk_benchmark
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import argparse
+import collections
+import random
+import time
+
+from google.cloud.dataflow.worker import executor
+
+
+def make_keys(num_elements, num_keys, num_hot_keys=100):
+  return [(random.randrange(num_hot_keys) if random.random() < 0.5
+           else random.randrange(num_keys))
+          for _ in xrange(num_elements)]
+
+
+def second_chance(keys, max_keys):
+  table = {}
+  lru_keys = collections.deque()
+  target = 9 * max_keys // 10
+  evicted = 0
+  for key in keys:
+    entry = table.get(key)
+    if entry is None:
+      entry = table[key] = [0, False]
+      lru_keys.append(key)
+    else:
+      entry[1] = True
+    entry[0] += 1
+    if len(table) > max_keys:
+      for _ in executor._pop_least_recently_used(  # pylint: disable=protected-access
+          table, lru_keys):
+        evicted += 1
+        if len(table) <= target:
+          break
+  return evicted
+
+
+def ordered_dict_lru(keys, max_keys):
+  table = collections.OrderedDict()
+  target = 9 * max_keys // 10
+  evicted = 0
+  for key in keys:
+    entry = table.pop(key, None)
+    if entry is None:
+      entry = [0]
+    table[key] = entry
+    entry[0] += 1
+    if len(table) > max_keys:
+      while len(table) > target:
+        table.popitem(last=False)
+        evicted += 1
+  return evicted
+
+
+def sorted_last_access(keys, max_keys):
+  table = {}
+  target = 9 * max_keys // 10
+  evicted = 0
+  for access_count, key in enumerate(keys):
+    entry = table.get(key)
+    if entry is None:
+      entry = table[key] = [0, 0]
+    entry[0] += 1
+    entry[1] = access_count
+    if len(table) > max_keys:
+      for wkey in sorted(table, key=lambda wkey: table[wkey][1]):
+        if len(table) <= target:
+          break
+        del table[wkey]
+        evicted += 1
+  return evicted
+
+
+def run_benchmark(num_elements, num_keys, max_keys, num_runs):
+  keys = make_keys(num_elements, num_keys)
+  print('%d elements over %d keys, at most %d keys in the table.' % (
+      num_elements, num_keys, max_keys))
+  for policy in (second_chance, ordered_dict_lru, sorted_last_access):
+    timings = []
+    for _ in xrange(num_runs):
+      start = time.time()
+      evicted = policy(keys, max_keys)
+      timings.append(time.time() - start)
+    best = min(timings)
+    print('%-20s %8.2f ms %10.0f elements/s %8d evictions' % (
+        policy.__name__, best * 1000, num_elements / best, evicted))
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--num_elements', type=int, default=300000)
+  parser.add_argument('--num_keys', type=int, default=100000)
+  parser.add_argument('--max_keys', type=int, default=1000)
+  parser.add_argument('--num_runs', type=int, default=3)
+  args = parser.parse_args()
+  run_benchmark(
+      args.num_elements, args.num_keys, args.max_keys, args.num_runs)
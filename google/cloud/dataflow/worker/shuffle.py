@@ -34,20 +34,37 @@ have indefinite lifetimes, are stateless and immutable.
 from __future__ import absolute_import
 
 import base64
+import collections
 import cStringIO as StringIO
+import itertools
 import logging
+import os
+import Queue
 import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
 
+from google.cloud.dataflow.coders import coder_impl
 from google.cloud.dataflow.coders import observable
 from google.cloud.dataflow.io import iobase
 from google.cloud.dataflow.io import range_trackers
+from google.cloud.dataflow.worker import localshuffle
+
+# The compiled input stream, if available, parses shuffle chunks fastest.
+try:
+  from google.cloud.dataflow.coders.stream import InputStream  # pylint: disable=g-import-not-at-top
+except ImportError:
+  InputStream = None
 
 
 # The following import works perfectly fine for the Dataflow SDK properly
 # installed. However in the testing environment the module is not available
 # since it is built elsewhere. The tests rely on the test_reader/test_writer
 # arguments for shuffle readers and writers respectively to inject alternative
-# implementations.
+# implementations, or on a local shuffle (see localshuffle).
 try:
   from google.cloud.dataflow.worker import shuffle_client  # pylint: disable=g-import-not-at-top
 except ImportError:
@@ -77,6 +94,23 @@ def _shuffle_decode(parameter):
   return base64.urlsafe_b64decode(parameter)
 
 
+def _create_shuffle_reader(config):
+  """Returns a shuffle reader for a decoded shuffle reader config."""
+  if localshuffle.is_local_shuffle_config(config):
+    return localshuffle.LocalShuffleReader(
+        localshuffle.directory_of_config(config),
+        read_latency_secs=localshuffle.read_latency_of_config(config))
+  return shuffle_client.PyShuffleReader(config)
+
+
+def _create_shuffle_writer(config):
+  """Returns a shuffle writer for a decoded shuffle writer config."""
+  if localshuffle.is_local_shuffle_config(config):
+    return localshuffle.LocalShuffleWriter(
+        localshuffle.directory_of_config(config))
+  return shuffle_client.PyShuffleWriter(config)
+
+
 class ShuffleEntry(object):
   """A (position, key, 2nd-key, value) tuple as used by the shuffle library."""
 
@@ -154,6 +188,252 @@ class ShuffleEntry(object):
     return ShuffleEntry(key, secondary_key, value, position)
 
 
+_unpack_length_from = struct.Struct('>I').unpack_from
+
+
+def iter_chunk_entries(chunk):
+  """Yields the shuffle entries (with positions) serialized in chunk.
+
+  This is the hot path of shuffle reads. The chunk is parsed in place, with
+  its fields sliced out directly rather than read through a file-like
+  stream, by the compiled InputStream when available.
+  """
+  if InputStream is not None:
+    stream = InputStream(chunk)
+    read_prefixed_fields = stream.read_prefixed_fields
+    while stream.size():
+      position, key, secondary_key, value = read_prefixed_fields(4)
+      yield ShuffleEntry(key, secondary_key, value, position)
+    return
+
+  unpack_length_from = _unpack_length_from
+  pos, end = 0, len(chunk)
+  while pos < end:
+    length, = unpack_length_from(chunk, pos)
+    pos += 4
+    position = chunk[pos:pos + length]
+    pos += length
+    length, = unpack_length_from(chunk, pos)
+    pos += 4
+    key = chunk[pos:pos + length]
+    pos += length
+    length, = unpack_length_from(chunk, pos)
+    pos += 4
+    secondary_key = chunk[pos:pos + length]
+    pos += length
+    length, = unpack_length_from(chunk, pos)
+    pos += 4
+    value = chunk[pos:pos + length]
+    pos += length
+    if pos > end:
+      raise ValueError('Truncated shuffle entry.')
+    yield ShuffleEntry(key, secondary_key, value, position)
+
+
+# When a ShuffleSink compresses values, every value it writes starts with a
+# byte telling how the rest of it is stored: either as a single encoded value,
+# or as a zlib-compressed block of encoded values sharing a key and secondary
+# key, each preceded by its length as a 32 bit big endian integer. Without
+# compression, values are written as they are encoded, without a tag.
+_RAW_VALUE_TAG = '\x00'
+_ZLIB_BLOCK_TAG = '\x01'
+
+
+def encode_shuffle_values(values, compression_level):
+  """Returns the value of a compressed shuffle entry holding encoded values.
+
+  Several values are always stored as a compressed block. A single value is
+  stored as it is unless compressing it saves space.
+  """
+  stream = StringIO.StringIO()
+  for value in values:
+    stream.write(struct.pack('>I', len(value)))
+    stream.write(value)
+  block = zlib.compress(stream.getvalue(), compression_level)
+  stream.close()
+  if len(values) == 1 and len(block) >= len(value):
+    return _RAW_VALUE_TAG + value
+  return _ZLIB_BLOCK_TAG + block
+
+
+def decode_shuffle_values(value):
+  """Yields the encoded values held by an encode_shuffle_values() result.
+
+  Only values written by a sink with a compression level may be decoded.
+  """
+  tag = value[:1]
+  if tag == _RAW_VALUE_TAG:
+    yield value[1:]
+  elif tag == _ZLIB_BLOCK_TAG:
+    block = zlib.decompress(buffer(value, 1))
+    offset = 0
+    while offset < len(block):
+      size, = struct.unpack_from('>I', block, offset)
+      offset += 4
+      yield block[offset:offset + size]
+      offset += size
+  else:
+    raise ValueError('Invalid shuffle value tag %r.' % tag)
+
+
+class SynchronizedShuffleReader(object):
+  """Serializes the Read calls made on a shuffle reader by several threads.
+
+  Shuffle readers are shared among all the entries iterables of a source, and
+  with read ahead enabled the iterables read from background threads.
+  """
+
+  def __init__(self, reader):
+    self.reader = reader
+    self._lock = threading.Lock()
+
+  def Read(self, start_position, end_position):  # pylint: disable=invalid-name
+    with self._lock:
+      return self.reader.Read(start_position, end_position)
+
+
+class _SpilledChunk(object):
+  """The location of a chunk read ahead and spilled to local disk."""
+
+  def __init__(self, offset, length):
+    self.offset = offset
+    self.length = length
+
+
+class ChunkPrefetcher(object):
+  """Reads the chunks between two shuffle positions ahead of their use.
+
+  A background thread keeps reading chunks as long as fewer than max_chunks
+  chunks, holding fewer than max_bytes bytes in total, are waiting in memory
+  to be consumed. At least one chunk is always read ahead, whatever its size,
+  so that progress is made. Once memory is full, chunks are spilled to a local
+  file instead, as long as fewer than spill_max_bytes bytes are waiting there.
+  Iterating yields the chunks in order, and re-raises in the consuming thread
+  any exception raised while reading. Once closed, the background thread
+  stops and iterating yields no more chunks.
+  """
+
+  def __init__(self, reader, start_position, end_position, max_chunks,
+               max_bytes, spill_max_bytes=0):
+    self.reader = reader
+    self.start_position = start_position
+    self.end_position = end_position
+    self.max_chunks = max_chunks
+    self.max_bytes = max_bytes
+    self.spill_max_bytes = spill_max_bytes
+    # (chunk, is_last_chunk, exc_info) tuples read ahead but not yet consumed,
+    # where chunk is a _SpilledChunk for the chunks spilled to disk.
+    self._chunks = collections.deque()
+    self._buffered_chunks = 0
+    self._buffered_bytes = 0
+    self._spilled_bytes = 0
+    self._spill_file = None
+    self._closed = False
+    self._condition = threading.Condition()
+    self._thread = threading.Thread(target=self._run)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def set_budget(self, max_bytes, spill_max_bytes):
+    """Changes the memory and disk budgets of the chunks read ahead."""
+    with self._condition:
+      self.max_bytes = max_bytes
+      self.spill_max_bytes = spill_max_bytes
+      self._condition.notify_all()
+
+  def _has_room(self):
+    return not self._buffered_chunks or (
+        self._buffered_chunks < self.max_chunks and
+        self._buffered_bytes < self.max_bytes)
+
+  def _can_spill(self):
+    return self._spilled_bytes < self.spill_max_bytes
+
+  def _spill(self, chunk):
+    if self._spill_file is None:
+      self._spill_file = tempfile.TemporaryFile(prefix='shuffle-read-ahead-')
+    self._spill_file.seek(0, os.SEEK_END)
+    spilled_chunk = _SpilledChunk(self._spill_file.tell(), len(chunk))
+    self._spill_file.write(chunk)
+    self._spilled_bytes += len(chunk)
+    return spilled_chunk
+
+  def _unspill(self, spilled_chunk):
+    self._spill_file.seek(spilled_chunk.offset)
+    chunk = self._spill_file.read(spilled_chunk.length)
+    self._spilled_bytes -= spilled_chunk.length
+    if not self._spilled_bytes:
+      # Reuse the file from its start once all its chunks were consumed.
+      self._spill_file.seek(0)
+      self._spill_file.truncate()
+    return chunk
+
+  def _run(self):
+    start_position = self.start_position
+    try:
+      while True:
+        with self._condition:
+          while (not self._closed and not self._has_room() and
+                 not self._can_spill()):
+            self._condition.wait()
+          if self._closed:
+            return
+        chunk, next_position = self.reader.Read(
+            start_position, self.end_position)
+        # An empty string signals the last chunk.
+        is_last_chunk = not next_position
+        with self._condition:
+          if self._closed:
+            return
+          if self._has_room():
+            self._chunks.append((chunk, is_last_chunk, None))
+            self._buffered_chunks += 1
+            self._buffered_bytes += len(chunk)
+          else:
+            self._chunks.append((self._spill(chunk), is_last_chunk, None))
+          self._condition.notify_all()
+        if is_last_chunk:
+          return
+        start_position = next_position
+    except Exception:  # pylint: disable=broad-except
+      with self._condition:
+        self._chunks.append((None, True, sys.exc_info()))
+        self._condition.notify_all()
+
+  def __iter__(self):
+    while True:
+      with self._condition:
+        while not self._chunks and not self._closed:
+          self._condition.wait()
+        if self._closed:
+          return
+        chunk, is_last_chunk, exc_info = self._chunks.popleft()
+        if isinstance(chunk, _SpilledChunk):
+          chunk = self._unspill(chunk)
+        elif chunk is not None:
+          self._buffered_chunks -= 1
+          self._buffered_bytes -= len(chunk)
+        self._condition.notify_all()
+      if exc_info is not None:
+        raise exc_info[0], exc_info[1], exc_info[2]
+      yield chunk
+      if is_last_chunk:
+        return
+
+  def close(self):
+    """Stops reading ahead. The chunks not consumed yet are dropped."""
+    with self._condition:
+      self._closed = True
+      self._chunks.clear()
+      self._buffered_chunks = 0
+      self._buffered_bytes = 0
+      self._spilled_bytes = 0
+      if self._spill_file is not None:
+        self._spill_file.close()
+        self._spill_file = None
+      self._condition.notify_all()
+
+
 class ShuffleEntriesIterable(object):
   """An iterable over all entries between two positions filtered by key.
 
@@ -161,7 +441,12 @@ class ShuffleEntriesIterable(object):
   None and start and nd positions are ''.
   """
 
-  def __init__(self, reader, start_position='', end_position='', key=None):
+  DEFAULT_READ_AHEAD_MAX_BYTES = 32 << 20
+
+  def __init__(self, reader, start_position='', end_position='', key=None,
+               read_ahead_chunks=0,
+               read_ahead_max_bytes=DEFAULT_READ_AHEAD_MAX_BYTES,
+               prefetchers=None):
     """Constructs an iterable for reading sequentially entries in a range.
 
     The iterable object can be used to get all the shuffle entries associated
@@ -175,36 +460,78 @@ class ShuffleEntriesIterable(object):
       end_position: The shuffle position where reading will stop.
       key: The key to match for all shuffle entries if not None. The iteration
         stops when a record with a different key is encountered.
-
+      read_ahead_chunks: If positive, the number of chunks a ChunkPrefetcher
+        reads ahead in the background while the entries of the current chunk
+        are consumed. The reader must then be safe to call from several
+        threads, e.g. a SynchronizedShuffleReader.
+      read_ahead_max_bytes: The most bytes of chunks read ahead at a time.
+      prefetchers: The set of the ChunkPrefetchers reading ahead for this
+        iterable, shared with the iterables cloned from it so that close()
+        stops them all.
     """
     self.reader = reader
     self.start_position = start_position
     self.end_position = end_position
     self.key = key
+    self.read_ahead_chunks = read_ahead_chunks
+    self.read_ahead_max_bytes = read_ahead_max_bytes
+    self.prefetchers = set() if prefetchers is None else prefetchers
     self._pushed_back_entry = None
 
+  def close(self):
+    """Stops the background threads reading ahead for this iterable.
+
+    Iterations still going on end once the chunks they hold are consumed.
+    """
+    for prefetcher in list(self.prefetchers):
+      prefetcher.close()
+    self.prefetchers.clear()
+
+  def truncate(self, end_position):
+    """Notes that no group starting at or after end_position will be read.
+
+    Entries are still read past end_position, for the last group to be
+    read whole, so this only matters to iterables reading ahead from
+    several places of their range.
+    """
+    pass
+
   def push_back(self, entry):
     """Pushes back one entry to support simple look ahead scenarios."""
     if self._pushed_back_entry is not None:
       raise RuntimeError('There is already an entry pushed back.')
     self._pushed_back_entry = entry
 
-  def __iter__(self):
-    last_chunk_seen = False
+  def _iter_chunks(self):
+    if self.read_ahead_chunks > 0:
+      prefetcher = ChunkPrefetcher(
+          self.reader, self.start_position, self.end_position,
+          self.read_ahead_chunks, self.read_ahead_max_bytes)
+      self.prefetchers.add(prefetcher)
+      try:
+        for chunk in prefetcher:
+          yield chunk
+      finally:
+        # Also stops the background thread when iteration is abandoned, e.g.
+        # once the entries of a key have all been read.
+        prefetcher.close()
+        self.prefetchers.discard(prefetcher)
+      return
     start_position = self.start_position
-    end_position = self.end_position
-    while not last_chunk_seen:
-      chunk, next_position = self.reader.Read(start_position, end_position)
+    while True:
+      chunk, next_position = self.reader.Read(start_position, self.end_position)
+      yield chunk
       if not next_position:  # An empty string signals the last chunk.
-        last_chunk_seen = True
+        return
+      # Move on to the next chunk.
+      start_position = next_position
+
+  def __iter__(self):
+    for chunk in self._iter_chunks():
       # Yield records inside the chunk just read.
-      read_bytes, total_bytes = 0, len(chunk)
-      stream = StringIO.StringIO(chunk)
-      while read_bytes < total_bytes:
-        entry = ShuffleEntry.from_stream(stream)
+      for entry in iter_chunk_entries(chunk):
         if self.key is not None and self.key != entry.key:
           return
-        read_bytes += entry.size
         yield entry
         # Check if anything was pushed back. We do this until there is no
         # value pushed back since it is quite possible to have values pushed
@@ -212,8 +539,115 @@ class ShuffleEntriesIterable(object):
         while self._pushed_back_entry is not None:
           to_return, self._pushed_back_entry = self._pushed_back_entry, None
           yield to_return
-      # Move on to the next chunk.
-      start_position = next_position
+
+
+class ConcurrentShuffleEntriesIterable(ShuffleEntriesIterable):
+  """An iterable over all entries of a range, read as concurrent sub-ranges.
+
+  The range is cut at the given split positions, and the chunks of every
+  sub-range are read ahead by a ChunkPrefetcher of their own as soon as the
+  iteration starts, so that the reads of all the sub-ranges overlap. Entries
+  are still yielded in position order, as if the whole range was read
+  sequentially, so groups spanning several sub-ranges are kept whole.
+
+  The sub-ranges share the read ahead memory budget. If read_ahead_spill_bytes
+  is positive, the sub-ranges after the one being consumed keep reading ahead
+  once their share is full by spilling chunks to local disk, sharing that
+  many bytes, so that their reads still overlap with the consumption of the
+  earlier sub-ranges. A sub-range gets the memory shares of the sub-ranges
+  consumed before it once it is reached, and stops spilling.
+
+  Once truncated, the sub-ranges starting at or after the new end position
+  only read one chunk ahead, in case the last group read extends into them.
+  """
+
+  def __init__(self, readers, start_position='', end_position='',
+               split_positions=(), read_ahead_chunks=1,
+               read_ahead_max_bytes=(
+                   ShuffleEntriesIterable.DEFAULT_READ_AHEAD_MAX_BYTES),
+               read_ahead_spill_bytes=0):
+    """Constructs an iterable reading the sub-ranges of a range concurrently.
+
+    Args:
+      readers: A shuffle reader object for each sub-range. The readers are
+        called from the background threads of the prefetchers; a reader
+        shared by several sub-ranges must be a SynchronizedShuffleReader. The
+        first reader is also the one used by clones, e.g. for reiteration.
+      start_position: The first shuffle position to read from.
+      end_position: The shuffle position where reading will stop.
+      split_positions: The increasing positions, strictly between the start
+        and end positions, at which the range is cut into sub-ranges.
+      read_ahead_chunks: The number of chunks read ahead in memory for each
+        sub-range.
+      read_ahead_max_bytes: The most bytes of chunks read ahead in memory at a
+        time, shared by the sub-ranges.
+      read_ahead_spill_bytes: The most bytes of chunks the sub-ranges after
+        the one being consumed spill to local disk at a time, in total.
+    """
+    super(ConcurrentShuffleEntriesIterable, self).__init__(
+        readers[0], start_position, end_position,
+        read_ahead_chunks=max(1, read_ahead_chunks),
+        read_ahead_max_bytes=read_ahead_max_bytes)
+    self.readers = readers
+    self.split_positions = list(split_positions)
+    self.read_ahead_spill_bytes = read_ahead_spill_bytes
+    # The sub-ranges being read ahead, as (start position, prefetcher) pairs,
+    # and the position the range was truncated at, if any. Dynamic splits
+    # truncate the range from another thread.
+    self._sub_ranges = []
+    self._truncated_position = None
+    self._lock = threading.Lock()
+    if len(self.readers) != len(self.split_positions) + 1:
+      raise ValueError('Expected %d readers for %d split positions, got %d.' %
+                       (len(self.split_positions) + 1,
+                        len(self.split_positions), len(self.readers)))
+
+  def _is_truncated_before(self, position):
+    return (self._truncated_position is not None and
+            position >= self._truncated_position)
+
+  def truncate(self, end_position):
+    with self._lock:
+      if not self._is_truncated_before(end_position):
+        self._truncated_position = end_position
+      for start, prefetcher in self._sub_ranges:
+        if self._is_truncated_before(start):
+          prefetcher.set_budget(0, 0)
+
+  def _iter_chunks(self):
+    bounds = ([self.start_position] + self.split_positions +
+              [self.end_position])
+    num_ranges = len(self.readers)
+    share = max(1, self.read_ahead_max_bytes // num_ranges)
+    spill_share = self.read_ahead_spill_bytes // max(1, num_ranges - 1)
+    with self._lock:
+      for index, (reader, start, end) in enumerate(
+          zip(self.readers, bounds, bounds[1:])):
+        if self._is_truncated_before(start):
+          max_bytes, spill_max_bytes = 0, 0
+        else:
+          max_bytes, spill_max_bytes = share, spill_share if index else 0
+        prefetcher = ChunkPrefetcher(
+            reader, start, end, self.read_ahead_chunks, max_bytes,
+            spill_max_bytes=spill_max_bytes)
+        self._sub_ranges.append((start, prefetcher))
+        self.prefetchers.add(prefetcher)
+      sub_ranges = list(self._sub_ranges)
+    try:
+      for index, (start, prefetcher) in enumerate(sub_ranges):
+        with self._lock:
+          if index and not self._is_truncated_before(start):
+            # The sub-ranges consumed so far no longer use their shares.
+            prefetcher.set_budget(share * (index + 1), 0)
+        for chunk in prefetcher:
+          yield chunk
+        prefetcher.close()
+    finally:
+      with self._lock:
+        for _, prefetcher in sub_ranges:
+          prefetcher.close()
+          self.prefetchers.discard(prefetcher)
+        self._sub_ranges = []
 
 
 class ShuffleEntriesIterator(object):
@@ -244,7 +678,23 @@ class ShuffleEntriesIterator(object):
     """Clones the current iterator with a new key, start, and end position."""
     return ShuffleEntriesIterator(
         ShuffleEntriesIterable(
-            self.iterable.reader, start_position, end_position, key))
+            self.iterable.reader, start_position, end_position, key,
+            self.iterable.read_ahead_chunks,
+            self.iterable.read_ahead_max_bytes,
+            prefetchers=self.iterable.prefetchers))
+
+
+def _with_secondary_key(secondary_key, value, reified):
+  """Returns the (secondary key, value) pair of a value read from a shuffle.
+
+  Reified values are decoded as windowed values, and are returned as windowed
+  (secondary key, value) pairs with the same timestamp and windows, of the
+  same class as the values the windowed value coder decodes.
+  """
+  if reified:
+    return coder_impl.WindowedValue(
+        (secondary_key, value.value), value.timestamp, value.windows)
+  return secondary_key, value
 
 
 class ShuffleKeyValuesIterable(observable.ObservableMixin):
@@ -254,17 +704,35 @@ class ShuffleKeyValuesIterable(observable.ObservableMixin):
   iterables every time __iter__ gets called. This way the values can be
   reiterated. The first time __iter__ is called no cloning happens.
   This supports the very common case of going once over all values for all keys.
+
+  If the encoded values of the key total at most cache_max_bytes bytes, the
+  first iteration keeps them in memory and reiterations decode them from
+  there rather than reading them from the shuffle again.
+
+  If secondary_key_coder is not None, the values are (secondary key, value)
+  tuples, in the order of the encoded secondary keys. Windowed (reified)
+  values are returned as windowed (secondary key, value) tuples instead.
+
+  If compressed_values is True, entry values are decoded with
+  decode_shuffle_values().
   """
 
   def __init__(self, entries_iterator, key, value_coder,
-               start_position, end_position=''):
+               start_position, end_position='', cache_max_bytes=0,
+               secondary_key_coder=None, compressed_values=False):
     super(ShuffleKeyValuesIterable, self).__init__()
     self.key = key
+    self.compressed_values = compressed_values
     self.value_coder = value_coder
+    self.secondary_key_coder = secondary_key_coder
     self.start_position = start_position
     self.end_position = end_position
+    self.cache_max_bytes = cache_max_bytes
     self.entries_iterator = entries_iterator
     self.first_values_iterator = None
+    # The encoded values of the key, once the first iteration has read them
+    # all, unless they take more than cache_max_bytes.
+    self.cached_values = None
 
   def __iter__(self):
     if self.first_values_iterator is None:
@@ -274,6 +742,15 @@ class ShuffleKeyValuesIterable(observable.ObservableMixin):
       # available.
       self.first_values_iterator = self.values_iterator()
       return self.first_values_iterator
+    elif self.cached_values is not None:
+      if self.secondary_key_coder is None:
+        return itertools.imap(self.value_coder.decode, self.cached_values)
+      secondary_key_coder = self.secondary_key_coder
+      value_coder = self.value_coder
+      reified = isinstance(value_coder, coder_impl.WindowedValueCoderImpl)
+      return (_with_secondary_key(secondary_key_coder.decode(secondary_key),
+                                  value_coder.decode(value), reified)
+              for secondary_key, value in self.cached_values)
     else:
       # If this is not the first time __iter__ is called we will clone the
       # underlying iterables so that we can reiterate as many times as we
@@ -282,9 +759,16 @@ class ShuffleKeyValuesIterable(observable.ObservableMixin):
           self.entries_iterator.clone(
               self.start_position, self.end_position, self.key),
           self.key, self.value_coder,
-          self.start_position, self.end_position).values_iterator()
+          self.start_position, self.end_position,
+          secondary_key_coder=self.secondary_key_coder,
+          compressed_values=self.compressed_values).values_iterator()
 
   def values_iterator(self):
+    secondary_key_coder = self.secondary_key_coder
+    compressed_values = self.compressed_values
+    reified = isinstance(self.value_coder, coder_impl.WindowedValueCoderImpl)
+    values_to_cache = [] if self.cache_max_bytes > 0 else None
+    cached_bytes = 0
     for entry in self.entries_iterator:
       if self.key != entry.key:
         # Remember the end_position so that if we reiterate over the values
@@ -292,9 +776,25 @@ class ShuffleKeyValuesIterable(observable.ObservableMixin):
         self.end_position = entry.position
         self.entries_iterator.push_back(entry)
         break
-      decoded_value = self.value_coder.decode(entry.value)
-      self.notify_observers(entry.value, is_encoded=True)
-      yield decoded_value
+      for value in (decode_shuffle_values(entry.value) if compressed_values
+                    else (entry.value,)):
+        if values_to_cache is not None:
+          cached_bytes += len(value) + len(entry.secondary_key)
+          if cached_bytes > self.cache_max_bytes:
+            values_to_cache = None
+          elif secondary_key_coder is None:
+            values_to_cache.append(value)
+          else:
+            values_to_cache.append((entry.secondary_key, value))
+        decoded_value = self.value_coder.decode(value)
+        self.notify_observers(value, is_encoded=True)
+        if secondary_key_coder is not None:
+          decoded_value = _with_secondary_key(
+              secondary_key_coder.decode(entry.secondary_key), decoded_value,
+              reified)
+        yield decoded_value
+    # Only reached once all the values of the key have been read.
+    self.cached_values = values_to_cache
 
   def __str__(self):
     return '<%s>' % self._str_internal()
@@ -307,7 +807,12 @@ class ShuffleKeyValuesIterable(observable.ObservableMixin):
 
 
 class ShuffleReaderBase(iobase.NativeSourceReader):
-  """A base class for grouped and ungrouped shuffle readers."""
+  """A base class for grouped and ungrouped shuffle readers.
+
+  Readers track the position of the last group or entry they returned with a
+  GroupedShuffleRangeTracker, which they use to report progress and to accept
+  dynamic split requests.
+  """
 
   def __init__(self, shuffle_source, reader=None):
     self.source = shuffle_source
@@ -315,20 +820,148 @@ class ShuffleReaderBase(iobase.NativeSourceReader):
     self.entries_iterable = None
     self.key_coder = self.source.key_coder.get_impl()
     self.value_coder = self.source.value_coder.get_impl()
+    self.secondary_key_coder = (
+        self.source.secondary_key_coder.get_impl()
+        if self.source.secondary_key_coder is not None else None)
+    self._range_tracker = range_trackers.GroupedShuffleRangeTracker(
+        decoded_start_pos=shuffle_source.start_position,
+        decoded_stop_pos=shuffle_source.end_position)
+    # Wall time at which reading started, to extrapolate the remaining time.
+    self._start_time = None
 
   def __enter__(self):
+    test_reader_injected = self.reader is not None
+    self._start_time = time.time()
     if self.reader is None:
-      self.reader = shuffle_client.PyShuffleReader(
+      self.reader = _create_shuffle_reader(
           _shuffle_decode(self.source.config_bytes))
     # Initialize the shuffle entries iterable. For now we read from start to
     # end which is enough for plain GroupByKey operations.
     if self.entries_iterable is None:
-      self.entries_iterable = ShuffleEntriesIterable(
-          self.reader, self.source.start_position, self.source.end_position)
+      split_positions = self._concurrent_split_positions()
+      reader = self.reader
+      if self.source.read_ahead_chunks > 0 or split_positions:
+        reader = SynchronizedShuffleReader(reader)
+      if split_positions:
+        # Each sub-range gets a shuffle reader of its own so that their reads
+        # are not serialized, unless a test reader was injected.
+        readers = [reader]
+        for _ in split_positions:
+          readers.append(
+              reader if test_reader_injected else _create_shuffle_reader(
+                  _shuffle_decode(self.source.config_bytes)))
+        self.entries_iterable = ConcurrentShuffleEntriesIterable(
+            readers, self.source.start_position, self.source.end_position,
+            split_positions,
+            read_ahead_chunks=self.source.read_ahead_chunks,
+            read_ahead_max_bytes=self.source.read_ahead_max_bytes,
+            read_ahead_spill_bytes=self.source.read_ahead_spill_bytes)
+      else:
+        self.entries_iterable = ShuffleEntriesIterable(
+            reader, self.source.start_position, self.source.end_position,
+            read_ahead_chunks=self.source.read_ahead_chunks,
+            read_ahead_max_bytes=self.source.read_ahead_max_bytes)
     return self
 
+  def _concurrent_split_positions(self):
+    """Returns the positions cutting the range into concurrent sub-ranges.
+
+    The positions are interpolated to cut the range into sub-ranges of about
+    the same size. Positions too close to each other to be distinct are
+    dropped, so there may be fewer sub-ranges than requested.
+    """
+    split_positions = []
+    num_ranges = self.source.concurrent_ranges
+    for i in range(1, num_ranges):
+      position = self._range_tracker.position_at_fraction(
+          float(i) / num_ranges)
+      if (position > (split_positions[-1] if split_positions
+                      else self.source.start_position) and
+          (not self.source.end_position or
+           position < self.source.end_position)):
+        split_positions.append(position)
+    return split_positions
+
   def __exit__(self, exception_type, exception_value, traceback):
-    pass
+    if self.entries_iterable is not None:
+      # Stops reading ahead even when iteration was abandoned early.
+      self.entries_iterable.close()
+
+  def _try_claim(self, position):
+    """Records that the group or entry at position is about to be returned.
+
+    Returns:
+      False if the position is past the end of the range being read, in which
+      case nothing else should be returned.
+    """
+    last_group_start = self._range_tracker.last_group_start()
+    is_at_split_point = (
+        last_group_start is None or position != last_group_start)
+
+    if is_at_split_point:
+      return self._range_tracker.try_claim(position)
+    else:
+      self._range_tracker.set_current_position(position)
+      return True
+
+  def get_progress(self):
+    last_group_start = self._range_tracker.last_group_start()
+    if last_group_start is None:
+      return None
+    reader_position = iobase.ReaderPosition(
+        shuffle_position=base64.urlsafe_b64encode(last_group_start))
+    fraction_consumed = self._range_tracker.fraction_consumed()
+    return iobase.ReaderProgress(
+        position=reader_position,
+        percent_complete=fraction_consumed,
+        remaining_time=self._remaining_time(fraction_consumed))
+
+  def _remaining_time(self, fraction_consumed):
+    """Extrapolates the time left to read the range from the time spent.
+
+    Returns:
+      The estimate as a duration string (e.g. '1.500s'), or None if nothing
+      has been consumed yet to extrapolate from.
+    """
+    if self._start_time is None or not 0 < fraction_consumed < 1:
+      return None
+    elapsed = max(0.0, time.time() - self._start_time)
+    return '%.3fs' % (elapsed * (1 - fraction_consumed) / fraction_consumed)
+
+  def request_dynamic_split(self, dynamic_split_request):
+    assert dynamic_split_request is not None
+    split_request_progress = dynamic_split_request.progress
+    if split_request_progress.position is None:
+      percent_complete = split_request_progress.percent_complete
+      if percent_complete is None or not 0 < percent_complete < 1:
+        logging.warning('%s only supports split at a Position or at a'
+                        ' percentage of work in the range (0, 1).'
+                        ' Requested: %r', self.__class__.__name__,
+                        dynamic_split_request)
+        return
+      encoded_shuffle_position = base64.urlsafe_b64encode(
+          self._range_tracker.position_at_fraction(percent_complete))
+    else:
+      encoded_shuffle_position = (
+          split_request_progress.position.shuffle_position)
+    if encoded_shuffle_position is None:
+      logging.warning('%s only supports split at a shuffle'
+                      ' position. Requested: %r', self.__class__.__name__,
+                      split_request_progress.position)
+      return
+
+    decoded_split_position = _shuffle_decode(encoded_shuffle_position)
+    if self._range_tracker.try_split(decoded_split_position):
+      if self.entries_iterable is not None:
+        self.entries_iterable.truncate(decoded_split_position)
+      logging.info('Split %s at %s', self.__class__.__name__,
+                   encoded_shuffle_position)
+      split_position = iobase.ReaderPosition(
+          shuffle_position=encoded_shuffle_position)
+      return iobase.DynamicSplitResultWithPosition(split_position)
+    else:
+      logging.info('Refusing to split %s %r at %s', self.__class__.__name__,
+                   self, encoded_shuffle_position)
 
 
 class GroupedShuffleReader(ShuffleReaderBase):
@@ -336,9 +969,6 @@ class GroupedShuffleReader(ShuffleReaderBase):
 
   def __init__(self, shuffle_source, reader=None):
     super(GroupedShuffleReader, self).__init__(shuffle_source, reader)
-    self._range_tracker = range_trackers.GroupedShuffleRangeTracker(
-        decoded_start_pos=shuffle_source.start_position,
-        decoded_stop_pos=shuffle_source.end_position)
 
   def __iter__(self):
     entries_iterator = ShuffleEntriesIterator(self.entries_iterable)
@@ -346,21 +976,16 @@ class GroupedShuffleReader(ShuffleReaderBase):
       entries_iterator.push_back(entry)
       key_values = ShuffleKeyValuesIterable(
           entries_iterator,
-          entry.key, self.value_coder, entry.position)
-      group_start = entry.position
-
-      last_group_start = self._range_tracker.last_group_start()
-      is_at_split_point = (
-          last_group_start is None or group_start != last_group_start)
-
-      if is_at_split_point:
-        if not self._range_tracker.try_claim(group_start):
-          # If an end position is defined, reader has read all records up to the
-          # defined end position, otherwise, reader has read all records of the
-          # source.
-          return
-      else:
-        self._range_tracker.set_current_position(group_start)
+          entry.key, self.value_coder, entry.position,
+          cache_max_bytes=self.source.reiteration_cache_bytes,
+          secondary_key_coder=self.secondary_key_coder,
+          compressed_values=self.source.compressed_values)
+
+      if not self._try_claim(entry.position):
+        # If an end position is defined, reader has read all records up to the
+        # defined end position, otherwise, reader has read all records of the
+        # source.
+        return
 
       yield (self.key_coder.decode(entry.key), key_values)
       # We need to drain the iterator returned just in case this
@@ -373,37 +998,6 @@ class GroupedShuffleReader(ShuffleReaderBase):
       for _ in drain_iterator:
         pass
 
-  def get_progress(self):
-    last_group_start = self._range_tracker.last_group_start()
-    if last_group_start is None:
-      return None
-    reader_position = iobase.ReaderPosition(
-        shuffle_position=base64.urlsafe_b64encode(last_group_start))
-    return iobase.ReaderProgress(position=reader_position)
-
-  def request_dynamic_split(self, dynamic_split_request):
-    assert dynamic_split_request is not None
-    split_request_progress = dynamic_split_request.progress
-    if split_request_progress.position is None:
-      logging.warning('GroupingShuffleReader only supports split at a Position.'
-                      ' Requested: %r', dynamic_split_request)
-      return
-    encoded_shuffle_position = split_request_progress.position.shuffle_position
-    if encoded_shuffle_position is None:
-      logging.warning('GroupingShuffleReader only supports split at a shuffle'
-                      ' position. Requested: %r'
-                      , split_request_progress.position)
-      return
-
-    if self._range_tracker.try_split(_shuffle_decode(encoded_shuffle_position)):
-      logging.info('Split GroupedShuffleReader at %s', encoded_shuffle_position)
-      split_position = iobase.ReaderPosition(
-          shuffle_position=encoded_shuffle_position)
-      return iobase.DynamicSplitResultWithPosition(split_position)
-    else:
-      logging.info('Refusing to split GroupedShuffleReader %r at %s'
-                   , self, encoded_shuffle_position)
-
 
 class UngroupedShuffleReader(ShuffleReaderBase):
   """A shuffle reader providing ungrouped reading."""
@@ -412,15 +1006,65 @@ class UngroupedShuffleReader(ShuffleReaderBase):
     super(UngroupedShuffleReader, self).__init__(shuffle_source, reader)
 
   def __iter__(self):
+    decode = self.value_coder.decode
+    if not self.source.compressed_values:
+      for entry in self.entries_iterable:
+        if not self._try_claim(entry.position):
+          return
+        yield decode(entry.value)
+      return
     for entry in self.entries_iterable:
-      yield self.value_coder.decode(entry.value)
+      if not self._try_claim(entry.position):
+        return
+      for value in decode_shuffle_values(entry.value):
+        yield decode(value)
 
 
 class ShuffleSourceBase(iobase.NativeSource):
-  """A base class for grouped and ungrouped shuffle sources."""
+  """A base class for grouped and ungrouped shuffle sources.
+
+  If read_ahead_chunks is positive, readers read up to that many chunks (and
+  at most read_ahead_max_bytes bytes) ahead in a background thread, so that
+  fetching chunks from the shuffler overlaps with processing their entries.
+  Grouped readers keep the values of keys taking at
+  most reiteration_cache_bytes bytes in memory for reiterations.
+
+  If secondary_key_coder is not None, grouped readers return the values of
+  each key as (secondary key, value) tuples decoded with it, sorted by the
+  encoded secondary keys.
+
+  If concurrent_ranges is greater than 1, readers cut their position range
+  into that many sub-ranges of about the same size and read them
+  concurrently, each with its own shuffle reader, while still returning the
+  entries in position order. If read_ahead_spill_bytes is positive, the
+  sub-ranges after the one being consumed may spill up to that many bytes of
+  chunks read ahead to local disk, in total, once memory is full.
+
+  If compressed_values is True, the values were written by a ShuffleSink
+  with a compression level, and readers decompress them. It must be set
+  exactly when the writing sink compressed, since nothing in the values
+  themselves tells whether they are compressed.
+  """
 
-  def __init__(self, config_bytes, coder, start_position='', end_position=''):
+  DEFAULT_REITERATION_CACHE_BYTES = 64 << 10
+
+  def __init__(self, config_bytes, coder, start_position='', end_position='',
+               read_ahead_chunks=0,
+               read_ahead_max_bytes=(
+                   ShuffleEntriesIterable.DEFAULT_READ_AHEAD_MAX_BYTES),
+               reiteration_cache_bytes=None,
+               secondary_key_coder=None, concurrent_ranges=1,
+               compressed_values=False, read_ahead_spill_bytes=0):
     self.config_bytes = config_bytes
+    self.read_ahead_spill_bytes = read_ahead_spill_bytes
+    self.compressed_values = compressed_values
+    self.concurrent_ranges = concurrent_ranges
+    self.secondary_key_coder = secondary_key_coder
+    self.reiteration_cache_bytes = (
+        self.DEFAULT_REITERATION_CACHE_BYTES if reiteration_cache_bytes is None
+        else reiteration_cache_bytes)
+    self.read_ahead_chunks = read_ahead_chunks
+    self.read_ahead_max_bytes = read_ahead_max_bytes
     self.key_coder, self.value_coder = (
         coder if isinstance(coder, tuple) else (coder, coder))
     self.start_position = (start_position if not start_position
@@ -450,8 +1094,76 @@ class UngroupedShuffleSource(ShuffleSourceBase):
     return UngroupedShuffleReader(self, reader=test_reader)
 
 
+class ShuffleBufferFlusher(object):
+  """Writes buffers of shuffle entries to a shuffle writer in the background.
+
+  Buffers are written in the order they are flushed, by a single thread, so
+  that encoding the next buffer overlaps with writing the previous ones. At
+  most max_pending buffers wait to be written besides the one being written;
+  flush blocks when that many are pending. An exception raised while writing
+  is re-raised by the next call to flush or close, and no further buffers are
+  written.
+  """
+
+  def __init__(self, writer, max_pending):
+    self.writer = writer
+    self._queue = Queue.Queue(max_pending)
+    self._exc_info = None
+    self._aborted = False
+    self._thread = threading.Thread(target=self._run)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def _run(self):
+    while True:
+      buf = self._queue.get()
+      if buf is None:
+        return
+      if self._exc_info is None and not self._aborted:
+        try:
+          self.writer.Write(buf)
+        except Exception:  # pylint: disable=broad-except
+          self._exc_info = sys.exc_info()
+
+  def _raise_if_failed(self):
+    if self._exc_info is not None:
+      exc_info = self._exc_info
+      raise exc_info[0], exc_info[1], exc_info[2]
+
+  def flush(self, buf):
+    self._raise_if_failed()
+    self._queue.put(buf)
+
+  def close(self):
+    """Waits for all the flushed buffers to be written."""
+    self._queue.put(None)
+    self._thread.join()
+    self._raise_if_failed()
+
+  def abort(self):
+    """Stops the background thread without writing the pending buffers."""
+    self._aborted = True
+    self._queue.put(None)
+    self._thread.join()
+
+
 class ShuffleSinkWriter(iobase.NativeSinkWriter):
-  """A sink writer for ShuffleSink."""
+  """A sink writer for ShuffleSink.
+
+  Entries are encoded into a buffer which is written to the shuffle writer
+  once it holds more than the sink's buffer_bytes. If the sink's
+  flush_queue_depth is positive, full buffers are handed to a
+  ShuffleBufferFlusher and encoding continues into a new buffer while they
+  are written.
+
+  If the sink has a compression level, the values of each key and secondary
+  key are gathered in a block until the buffer is written or the block holds
+  MAX_BLOCK_BYTES bytes, and each block is compressed into a single entry.
+  The shuffler sorts the entries of the buffers it is given, so values can
+  only be compressed together when they share their key and secondary key.
+  """
+
+  MAX_BLOCK_BYTES = 1 << 20
 
   def __init__(self, shuffle_sink, writer=None):
     self.sink = shuffle_sink
@@ -460,43 +1172,119 @@ class ShuffleSinkWriter(iobase.NativeSinkWriter):
     self.bytes_buffered = 0
     self.key_coder = self.sink.key_coder.get_impl()
     self.value_coder = self.sink.value_coder.get_impl()
+    self.flusher = None
+    # Maps (key, secondary key) pairs to [block bytes, encoded values] lists.
+    self.blocks = None if self.sink.compression_level is None else {}
 
   def __enter__(self):
     if self.writer is None:
-      self.writer = shuffle_client.PyShuffleWriter(
+      self.writer = _create_shuffle_writer(
           _shuffle_decode(self.sink.config_bytes))
+    if self.sink.flush_queue_depth > 0:
+      self.flusher = ShuffleBufferFlusher(
+          self.writer, self.sink.flush_queue_depth)
     return self
 
   def __exit__(self, exception_type, exception_value, traceback):
+    try:
+      if self.bytes_buffered:
+        self._flush()
+    finally:
+      self.stream.close()
+      try:
+        if self.flusher is not None:
+          # All the buffers must be written, in order, before closing the
+          # writer. This also stops the background thread if writing failed.
+          flusher, self.flusher = self.flusher, None
+          flusher.close()
+      finally:
+        self.writer.Close()
+
+  def abort(self):
+    """Closes the writer of a failed work item, dropping buffered entries."""
+    self.stream.close()
+    self.blocks = None
+    try:
+      if self.flusher is not None:
+        flusher, self.flusher = self.flusher, None
+        flusher.abort()
+    finally:
+      if self.writer is not None:
+        self.writer.Close()
+
+  def _flush(self):
+    if self.blocks:
+      for (key, secondary_key), (_, values) in self.blocks.iteritems():
+        self._write_block(key, secondary_key, values)
+      self.blocks.clear()
     value = self.stream.getvalue()
-    if value:
-      self.writer.Write(value)
-      self.bytes_buffered = 0
     self.stream.close()
-    self.writer.Close()
+    self.stream = StringIO.StringIO()
+    self.bytes_buffered = 0
+    if self.flusher is not None:
+      self.flusher.flush(value)
+    else:
+      self.writer.Write(value)
 
-  def Write(self, key, secondary_key, value):
-    entry = ShuffleEntry(
-        self.key_coder.encode(key),
-        secondary_key,
-        self.value_coder.encode(value),
-        position=None)
+  def _write_entry(self, key, secondary_key, value):
+    entry = ShuffleEntry(key, secondary_key, value, position=None)
     entry.to_bytes(self.stream, with_position=False)
     self.bytes_buffered += entry.size
-    if self.bytes_buffered > 10 << 20:
-      self.writer.Write(self.stream.getvalue())
-      self.stream.close()
-      self.stream = StringIO.StringIO()
-      self.bytes_buffered = 0
+
+  def _write_block(self, key, secondary_key, values):
+    self._write_entry(
+        key, secondary_key,
+        encode_shuffle_values(values, self.sink.compression_level))
+
+  def Write(self, key, secondary_key, value):
+    encoded_key = self.key_coder.encode(key)
+    encoded_value = self.value_coder.encode(value)
+    if self.blocks is None:
+      self._write_entry(encoded_key, secondary_key, encoded_value)
+    else:
+      block_key = encoded_key, secondary_key
+      block = self.blocks.get(block_key)
+      if block is None:
+        block = self.blocks[block_key] = [0, []]
+      block[0] += 4 + len(encoded_value)
+      block[1].append(encoded_value)
+      self.bytes_buffered += 4 + len(encoded_value)
+      if block[0] >= self.MAX_BLOCK_BYTES:
+        del self.blocks[block_key]
+        self.bytes_buffered -= block[0]
+        self._write_block(encoded_key, secondary_key, block[1])
+    if self.bytes_buffered > self.sink.buffer_bytes:
+      self._flush()
 
 
 class ShuffleSink(iobase.NativeSink):
-  """A sink that writes to a shuffled dataset."""
+  """A sink that writes to a shuffled dataset.
+
+  Writers buffer up to buffer_bytes bytes of entries before writing them to
+  the shuffler, and keep up to flush_queue_depth full buffers queued for a
+  background thread to write (0 writes them synchronously). None selects the
+  default for either.
+
+  If compression_level is not None, writers zlib-compress blocks of values at
+  that level (see ShuffleSinkWriter), and the sources reading them back need
+  compressed_values set. Otherwise values are written exactly as encoded.
+  Keys are never compressed since the shuffler sorts on them.
+  """
+
+  DEFAULT_BUFFER_BYTES = 10 << 20
+  DEFAULT_FLUSH_QUEUE_DEPTH = 1
 
-  def __init__(self, config_bytes, coder):
+  def __init__(self, config_bytes, coder, buffer_bytes=None,
+               flush_queue_depth=None, compression_level=None):
     self.config_bytes = config_bytes
+    self.compression_level = compression_level
     self.key_coder, self.value_coder = (
         coder if isinstance(coder, tuple) else (coder, coder))
+    self.buffer_bytes = (
+        self.DEFAULT_BUFFER_BYTES if buffer_bytes is None else buffer_bytes)
+    self.flush_queue_depth = (
+        self.DEFAULT_FLUSH_QUEUE_DEPTH if flush_queue_depth is None
+        else flush_queue_depth)
 
   def writer(self, test_writer=None):
     return ShuffleSinkWriter(self, writer=test_writer)
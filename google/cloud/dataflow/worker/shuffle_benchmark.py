@@ -0,0 +1,139 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Microbenchmarks for shuffle reads and writes.
+
+By default, compares iter_chunk_entries with reading entries one at a time
+through ShuffleEntry.from_stream, as shuffle reads used to do. With
+--local_shuffle, times a GroupByKey-like load written through a ShuffleSink
+and read back through a GroupedShuffleSource, on a local shuffle, first
+sequentially then as --concurrent_ranges concurrent sub-ranges, which may
+spill up to 256MB of chunks read ahead to local disk. Every read
+from the local shuffle waits --read_latency_ms, standing in for the round
+trip to a shuffler. Run with:
+
+  python -m google.cloud.dataflow.worker.shuffle_benchmark [--local_shuffle]
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import argparse
+import base64
+import cStringIO as StringIO
+import shutil
+import tempfile
+import time
+
+from google.cloud.dataflow import coders
+from google.cloud.dataflow.worker import localshuffle
+from google.cloud.dataflow.worker import shuffle
+
+
+def make_chunk(num_entries, value_size):
+  stream = StringIO.StringIO()
+  for i in xrange(num_entries):
+    key = 'key-%08d' % (i // 10)
+    shuffle.ShuffleEntry(
+        key, key, 'v' * value_size, 'position-%08d' % i).to_bytes(stream)
+  return stream.getvalue()
+
+
+def parse_with_stream(chunk):
+  read_bytes, total_bytes = 0, len(chunk)
+  stream = StringIO.StringIO(chunk)
+  while read_bytes < total_bytes:
+    entry = shuffle.ShuffleEntry.from_stream(stream)
+    read_bytes += entry.size
+    yield entry
+
+
+def parse_in_place(chunk):
+  return shuffle.iter_chunk_entries(chunk)
+
+
+def run_benchmark(num_entries, value_size, num_runs):
+  chunk = make_chunk(num_entries, value_size)
+  print('Chunk of %d entries, %d bytes.' % (num_entries, len(chunk)))
+  assert list(parse_with_stream(chunk)) == list(parse_in_place(chunk))
+  for parse in (parse_with_stream, parse_in_place):
+    timings = []
+    for _ in xrange(num_runs):
+      start = time.time()
+      for _ in parse(chunk):
+        pass
+      timings.append(time.time() - start)
+    best = min(timings)
+    print('%-20s %8.2f ms %10.0f entries/s' % (
+        parse.__name__, best * 1000, num_entries / best))
+
+
+def run_local_shuffle_benchmark(num_entries, value_size, num_keys=1000,
+                                num_writers=4, read_latency_ms=0,
+                                concurrent_ranges=4, read_ahead_chunks=2,
+                                read_ahead_spill_bytes=256 << 20):
+  directory = tempfile.mkdtemp()
+  try:
+    config = localshuffle.local_shuffle_config(
+        directory, read_latency_ms / 1000.0)
+    coder = coders.BytesCoder()
+    value = 'v' * value_size
+    start = time.time()
+    sink = shuffle.ShuffleSink(config, coder=coder)
+    for writer_index in xrange(num_writers):
+      with sink.writer() as writer:
+        for i in xrange(writer_index, num_entries, num_writers):
+          writer.Write('key-%08d' % (i % num_keys), '', value)
+    write_secs = time.time() - start
+    print('Wrote %d entries in %.2f s.' % (num_entries, write_secs))
+    # Concurrent reads cut the range between its start and end positions.
+    start_position = base64.urlsafe_b64encode('\0' * 8)
+    end_position = base64.urlsafe_b64encode(
+        localshuffle.LocalShuffleReader(directory).end_position)
+    for num_ranges in (1, concurrent_ranges):
+      source = shuffle.GroupedShuffleSource(
+          config, coder=coder, start_position=start_position,
+          end_position=end_position, read_ahead_chunks=read_ahead_chunks,
+          concurrent_ranges=num_ranges,
+          read_ahead_spill_bytes=read_ahead_spill_bytes)
+      start = time.time()
+      num_values = 0
+      with source.reader() as reader:
+        for _, values in reader:
+          for _ in values:
+            num_values += 1
+      read_secs = time.time() - start
+      assert num_values == num_entries
+      print('Grouped them in %.2f s reading %d range(s) with %d ms reads.' % (
+          read_secs, num_ranges, read_latency_ms))
+  finally:
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--num_entries', type=int, default=100000)
+  parser.add_argument('--value_size', type=int, default=100)
+  parser.add_argument('--num_runs', type=int, default=5)
+  parser.add_argument('--local_shuffle', action='store_true')
+  parser.add_argument('--read_latency_ms', type=int, default=20)
+  parser.add_argument('--concurrent_ranges', type=int, default=4)
+  args = parser.parse_args()
+  if args.local_shuffle:
+    run_local_shuffle_benchmark(
+        args.num_entries, args.value_size,
+        read_latency_ms=args.read_latency_ms,
+        concurrent_ranges=args.concurrent_ranges)
+  else:
+    run_benchmark(args.num_entries, args.value_size, args.num_runs)
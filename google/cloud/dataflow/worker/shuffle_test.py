@@ -17,10 +17,18 @@
 import base64
 import cStringIO as StringIO
 import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
 
+import mock
 from google.cloud.dataflow import coders
 from google.cloud.dataflow.io import iobase
+from google.cloud.dataflow.worker import localshuffle
+from google.cloud.dataflow.worker import shuffle
 from google.cloud.dataflow.worker.shuffle import GroupedShuffleSource
 from google.cloud.dataflow.worker.shuffle import ShuffleEntry
 from google.cloud.dataflow.worker.shuffle import ShuffleSink
@@ -50,8 +58,12 @@ class FakeShuffleReader(object):
   - keys appear in lexicographic order
   """
 
-  def __init__(self, chunk_descriptors):
+  def __init__(self, chunk_descriptors, compression_level=None,
+               secondary_keys=False):
     """Initializes the fake shuffle from a list of lists of (k,v) pairs."""
+    self.compression_level = compression_level
+    # If set, entries have 's-<value>' as their secondary keys.
+    self.secondary_keys = secondary_keys
     self.all_vals = []
     self.chunk_starts = []
     last_index = 0
@@ -66,10 +78,14 @@ class FakeShuffleReader(object):
     coder = Base64Coder()
     position = start_index
     for key, value in descriptor:
+      encoded_value = coder.encode(value)
+      if self.compression_level is not None:
+        encoded_value = shuffle.encode_shuffle_values(
+            [encoded_value], self.compression_level)
       ShuffleEntry(
           coder.encode(key),
-          '',
-          coder.encode(value),
+          's-' + value if self.secondary_keys else '',
+          encoded_value,
           position=str(position)).to_bytes(stream)
       position += 1
     value = stream.getvalue()
@@ -98,7 +114,9 @@ class FakeShuffleReader(object):
 class FakeShuffleWriter(object):
   """A fake shuffle writter recording what entries were written."""
 
-  def __init__(self):
+  def __init__(self, compressed_values=False):
+    self.compressed_values = compressed_values
+    self.closed = False
     # The list of (key, 2nd-key, value) tuples written. The attribute will
     # get its real value only when close() is called.
     self.values = []
@@ -112,12 +130,31 @@ class FakeShuffleWriter(object):
           ShuffleEntry.from_stream(stream, with_position=False))
 
   def Close(self):  # pylint: disable=invalid-name
+    self.closed = True
     coder = Base64Coder()
     for entry in self._entries:
-      self.values.append((
-          coder.decode(entry.key),
-          coder.decode(entry.secondary_key),
-          coder.decode(entry.value)))
+      for value in (shuffle.decode_shuffle_values(entry.value)
+                    if self.compressed_values else [entry.value]):
+        self.values.append((
+            coder.decode(entry.key),
+            coder.decode(entry.secondary_key),
+            coder.decode(value)))
+
+
+class SlowShuffleWriter(FakeShuffleWriter):
+  """A fake shuffle writer taking its time to write, or failing to."""
+
+  def __init__(self, fail=False):
+    super(SlowShuffleWriter, self).__init__()
+    self.fail = fail
+    self.num_writes = 0
+
+  def Write(self, entries):  # pylint: disable=invalid-name
+    self.num_writes += 1
+    time.sleep(0.001)
+    if self.fail:
+      raise IOError('Failed to write.')
+    super(SlowShuffleWriter, self).Write(entries)
 
 
 class TestShuffleEntry(unittest.TestCase):
@@ -154,11 +191,179 @@ class TestShuffleEntry(unittest.TestCase):
     self.assertEqual(entry_bytes[2], '\x00')
     self.assertEqual(entry_bytes[3], '\x03')
 
+  def check_iter_chunk_entries(self):
+    entries = [ShuffleEntry('abc', 'xyz123', '0123456789', position='zyx'),
+               ShuffleEntry('', '', '', position=''),
+               ShuffleEntry('k' * 300, 'k', 'v' * 70000, position='p')]
+    stream = StringIO.StringIO()
+    for entry in entries:
+      entry.to_bytes(stream)
+    chunk = stream.getvalue()
+    self.assertEqual(entries, list(shuffle.iter_chunk_entries(chunk)))
+    self.assertEqual([], list(shuffle.iter_chunk_entries('')))
+    with self.assertRaises(Exception):
+      list(shuffle.iter_chunk_entries(chunk[:-1]))
+    with self.assertRaises(Exception):
+      list(shuffle.iter_chunk_entries(chunk[:-70002]))
+
+  def test_iter_chunk_entries(self):
+    self.check_iter_chunk_entries()
+
+  def test_iter_chunk_entries_without_compiled_stream(self):
+    with mock.patch.object(shuffle, 'InputStream', None):
+      self.check_iter_chunk_entries()
+
 
 TEST_CHUNK1 = [('a', '1'), ('b', '0'), ('b', '1'), ('c', '0')]
 TEST_CHUNK2 = [('c', '1'), ('c', '2'), ('c', '3'), ('c', '4')]
 
 
+class RecordingShuffleReader(FakeShuffleReader):
+  """A fake shuffle reader recording the start positions of its reads."""
+
+  def __init__(self, chunk_descriptors, fail_at=None):
+    super(RecordingShuffleReader, self).__init__(chunk_descriptors)
+    self.fail_at = fail_at
+    self.reads = []
+
+  def Read(self, first, last):  # pylint: disable=invalid-name
+    self.reads.append(first)
+    if first == self.fail_at:
+      raise IOError('Failed to read at %r.' % first)
+    return super(RecordingShuffleReader, self).Read(first, last)
+
+
+class TestChunkPrefetcher(unittest.TestCase):
+
+  CHUNKS = [[('a', '%d' % i)] for i in range(6)]
+
+  def wait_for_reads(self, reader, num_reads):
+    deadline = time.time() + 10
+    while len(reader.reads) < num_reads and time.time() < deadline:
+      time.sleep(0.001)
+    # Give the prefetcher a chance to read more than it should.
+    time.sleep(0.05)
+    self.assertEqual(num_reads, len(reader.reads))
+
+  def test_reads_all_chunks_in_order(self):
+    reader = RecordingShuffleReader(self.CHUNKS)
+    prefetcher = shuffle.ChunkPrefetcher(reader, '', '', 2, 1 << 20)
+    entries = [entry for chunk in prefetcher
+               for entry in shuffle.iter_chunk_entries(chunk)]
+    self.assertEqual(['%d' % i for i in range(6)],
+                     [base64.b64decode(e.value) for e in entries])
+    self.assertEqual(['', '1', '2', '3', '4', '5'], reader.reads)
+
+  def test_chunks_in_flight_are_bounded(self):
+    reader = RecordingShuffleReader(self.CHUNKS)
+    prefetcher = shuffle.ChunkPrefetcher(reader, '', '', 2, 1 << 20)
+    chunks = iter(prefetcher)
+    self.wait_for_reads(reader, 2)
+    next(chunks)
+    self.wait_for_reads(reader, 3)
+    prefetcher.close()
+
+  def test_bytes_in_flight_are_bounded(self):
+    reader = RecordingShuffleReader(self.CHUNKS)
+    # At least one chunk is read ahead even if larger than the budget.
+    prefetcher = shuffle.ChunkPrefetcher(reader, '', '', 4, 1)
+    chunks = iter(prefetcher)
+    self.wait_for_reads(reader, 1)
+    next(chunks)
+    self.wait_for_reads(reader, 2)
+    prefetcher.close()
+
+  def test_spills_once_memory_is_full(self):
+    reader = RecordingShuffleReader(self.CHUNKS)
+    chunk_bytes = len(reader.Read('', '')[0])
+    reader.reads = []
+    # One chunk fits in memory and two on disk.
+    prefetcher = shuffle.ChunkPrefetcher(
+        reader, '', '', 1, 1 << 20, spill_max_bytes=2 * chunk_bytes)
+    self.wait_for_reads(reader, 3)
+    self.assertEqual(2 * chunk_bytes, prefetcher._spilled_bytes)
+    entries = [entry for chunk in prefetcher
+               for entry in shuffle.iter_chunk_entries(chunk)]
+    self.assertEqual(['%d' % i for i in range(6)],
+                     [base64.b64decode(e.value) for e in entries])
+    self.assertEqual(0, prefetcher._spilled_bytes)
+    prefetcher.close()
+
+  def test_set_budget_stops_spilling(self):
+    reader = RecordingShuffleReader(self.CHUNKS)
+    prefetcher = shuffle.ChunkPrefetcher(
+        reader, '', '', 1, 1 << 20, spill_max_bytes=1)
+    chunks = iter(prefetcher)
+    self.wait_for_reads(reader, 2)
+    prefetcher.set_budget(1 << 20, 0)
+    # The chunk consumed from memory is replaced there, and no more spilled.
+    next(chunks)
+    self.wait_for_reads(reader, 3)
+    prefetcher.close()
+
+  def test_read_error_is_raised_when_reached(self):
+    reader = RecordingShuffleReader(self.CHUNKS, fail_at='2')
+    chunks = iter(shuffle.ChunkPrefetcher(reader, '', '', 2, 1 << 20))
+    next(chunks)
+    next(chunks)
+    with self.assertRaisesRegexp(IOError, 'Failed to read'):
+      next(chunks)
+
+  def test_close_stops_reading(self):
+    reader = RecordingShuffleReader(self.CHUNKS)
+    prefetcher = shuffle.ChunkPrefetcher(reader, '', '', 1, 1 << 20)
+    self.wait_for_reads(reader, 1)
+    prefetcher.close()
+    prefetcher._thread.join(10)
+    self.assertFalse(prefetcher._thread.is_alive())
+    self.assertEqual([''], reader.reads)
+
+  def test_iteration_ends_once_closed(self):
+    reader = RecordingShuffleReader(self.CHUNKS)
+    prefetcher = shuffle.ChunkPrefetcher(reader, '', '', 1, 1 << 20)
+    chunks = iter(prefetcher)
+    next(chunks)
+    prefetcher.close()
+    self.assertEqual([], list(chunks))
+
+  def test_synchronized_reader(self):
+    reader = RecordingShuffleReader(self.CHUNKS)
+    synchronized_reader = shuffle.SynchronizedShuffleReader(reader)
+    threads = [
+        threading.Thread(target=synchronized_reader.Read, args=(str(i), ''))
+        for i in range(6)]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+    self.assertEqual(set(str(i) for i in range(6)), set(reader.reads))
+
+
+class TestShuffleValues(unittest.TestCase):
+
+  def test_compressible_value(self):
+    value = 'abc' * 100
+    encoded = shuffle.encode_shuffle_values([value], 6)
+    self.assertLess(len(encoded), len(value) / 10)
+    self.assertEqual([value], list(shuffle.decode_shuffle_values(encoded)))
+
+  def test_incompressible_value(self):
+    for value in ('', 'abc', os.urandom(1000)):
+      encoded = shuffle.encode_shuffle_values([value], 6)
+      self.assertEqual(len(value) + 1, len(encoded))
+      self.assertEqual([value], list(shuffle.decode_shuffle_values(encoded)))
+
+  def test_block_of_values(self):
+    values = ['value-%d' % i for i in range(100)] + ['']
+    encoded = shuffle.encode_shuffle_values(values, 6)
+    self.assertLess(len(encoded), sum(len(v) for v in values) / 2)
+    self.assertEqual(values, list(shuffle.decode_shuffle_values(encoded)))
+
+  def test_invalid_value(self):
+    with self.assertRaisesRegexp(ValueError, 'Invalid shuffle value'):
+      list(shuffle.decode_shuffle_values('xyz'))
+
+
 class TestGroupedShuffleSource(unittest.TestCase):
 
   def test_basics(self):
@@ -195,6 +400,37 @@ class TestGroupedShuffleSource(unittest.TestCase):
     self.assertEqual(TEST_CHUNK1 + TEST_CHUNK2, result)
     self.assertEqual(expected_progress_record, progress_record)
 
+  def test_percent_complete_reporting(self):
+    source = GroupedShuffleSource(
+        config_bytes='not used', coder=Base64Coder(),
+        start_position=base64.urlsafe_b64encode('0'),
+        end_position=base64.urlsafe_b64encode('4'))
+
+    chunks = [TEST_CHUNK1, TEST_CHUNK2]
+    percent_complete_record = []
+    with source.reader(test_reader=FakeShuffleReader(chunks)) as reader:
+      for _ in reader:
+        percent_complete_record.append(reader.get_progress().percent_complete)
+    self.assertEqual([0.0, 0.25, 0.75], percent_complete_record)
+
+  def test_remaining_time_reporting(self):
+    source = GroupedShuffleSource(
+        config_bytes='not used', coder=Base64Coder(),
+        start_position=base64.urlsafe_b64encode('0'),
+        end_position=base64.urlsafe_b64encode('4'))
+
+    chunks = [TEST_CHUNK1, TEST_CHUNK2]
+    remaining_time_record = []
+    with source.reader(test_reader=FakeShuffleReader(chunks)) as reader:
+      # Pretend that reading started 12 seconds ago.
+      reader._start_time -= 12
+      for _ in reader:
+        remaining_time = reader.get_progress().remaining_time
+        remaining_time_record.append(
+            remaining_time and round(float(remaining_time.rstrip('s'))))
+    # Nothing is extrapolated before the first fraction of the range is read.
+    self.assertEqual([None, 36, 4], remaining_time_record)
+
   def try_splitting_reader_at(self, reader, split_request, expected_response):
     actual_response = reader.request_dynamic_split(split_request)
 
@@ -250,6 +486,31 @@ class TestGroupedShuffleSource(unittest.TestCase):
           iobase.DynamicSplitResultWithPosition(iobase.ReaderPosition(
               shuffle_position=base64.urlsafe_b64encode('3'))))
 
+  def test_dynamic_splitting_at_percent_complete(self):
+    source = GroupedShuffleSource(
+        config_bytes='not used',
+        coder=Base64Coder(),
+        start_position=base64.urlsafe_b64encode('0'),
+        end_position=base64.urlsafe_b64encode('4'))
+
+    chunks = [TEST_CHUNK1, TEST_CHUNK2]
+
+    with source.reader(test_reader=FakeShuffleReader(chunks)) as reader:
+      reader_iter = iter(reader)
+      next(reader_iter)
+      self.try_splitting_reader_at(
+          reader,
+          iobase.DynamicSplitRequest(iobase.ReaderProgress(
+              percent_complete=1.0)),
+          None)
+      self.try_splitting_reader_at(
+          reader,
+          iobase.DynamicSplitRequest(iobase.ReaderProgress(
+              percent_complete=0.5)),
+          iobase.DynamicSplitResultWithPosition(iobase.ReaderPosition(
+              shuffle_position=base64.urlsafe_b64encode('2'))))
+      self.assertEqual(['b'], [key for key, _ in reader_iter])
+
   def test_dynamic_splitting_with_range(self):
     source = GroupedShuffleSource(
         config_bytes='not used',
@@ -312,6 +573,214 @@ class TestGroupedShuffleSource(unittest.TestCase):
     self.assertEqual(list(saved_iterators['b']), ['0', '1'])
     self.assertEqual(list(saved_iterators['c']), ['0', '1', '2', '3', '4'])
 
+  def check_reiteration_cache(self, reiteration_cache_bytes,
+                              expected_rereads):
+    source = GroupedShuffleSource(
+        config_bytes='not used', coder=Base64Coder(),
+        reiteration_cache_bytes=reiteration_cache_bytes)
+
+    chunks = [TEST_CHUNK1, TEST_CHUNK2]
+    fake_reader = RecordingShuffleReader(chunks)
+    saved_iterators = {}
+    with source.reader(test_reader=fake_reader) as reader:
+      for key, key_values in reader:
+        saved_iterators[key] = key_values
+        # Values left unread are drained, and cached, by the reader.
+        next(iter(key_values))
+    num_reads = len(fake_reader.reads)
+    for _ in range(2):
+      self.assertEqual(list(saved_iterators['a']), ['1'])
+      self.assertEqual(list(saved_iterators['b']), ['0', '1'])
+      self.assertEqual(list(saved_iterators['c']), ['0', '1', '2', '3', '4'])
+    self.assertEqual(expected_rereads, len(fake_reader.reads) - num_reads)
+
+  def test_reiteration_from_cache(self):
+    self.check_reiteration_cache(1 << 10, 0)
+
+  def test_reiteration_over_cache_limit(self):
+    # Only the values of 'a' and 'b' fit, with base64 encoded values of 4 bytes.
+    # The values of 'c' span two chunks.
+    self.check_reiteration_cache(8, 4)
+
+  def test_reiteration_without_cache(self):
+    self.check_reiteration_cache(0, 8)
+
+  def test_read_ahead(self):
+    """Tests reading and reiterating while chunks are read ahead."""
+    source = GroupedShuffleSource(
+        config_bytes='not used', coder=Base64Coder(), read_ahead_chunks=2)
+
+    chunks = [TEST_CHUNK1, TEST_CHUNK2]
+    result = []
+    saved_iterators = {}
+    with source.reader(test_reader=FakeShuffleReader(chunks)) as reader:
+      for key, key_values in reader:
+        saved_iterators[key] = key_values
+        for value in key_values:
+          result.append((key, value))
+    self.assertEqual(TEST_CHUNK1 + TEST_CHUNK2, result)
+    for _ in range(2):
+      self.assertEqual(list(saved_iterators['a']), ['1'])
+      self.assertEqual(list(saved_iterators['b']), ['0', '1'])
+      self.assertEqual(list(saved_iterators['c']), ['0', '1', '2', '3', '4'])
+
+  def concurrent_source(self, concurrent_ranges, read_ahead_spill_bytes=0):
+    return GroupedShuffleSource(
+        config_bytes='not used', coder=Base64Coder(),
+        start_position=base64.urlsafe_b64encode('0'),
+        end_position=base64.urlsafe_b64encode('8'),
+        concurrent_ranges=concurrent_ranges,
+        read_ahead_spill_bytes=read_ahead_spill_bytes)
+
+  def assert_stopped(self, prefetchers):
+    for prefetcher in prefetchers:
+      prefetcher._thread.join(10)
+      self.assertFalse(prefetcher._thread.is_alive())
+
+  def test_concurrent_ranges(self):
+    """Tests reading sub-ranges concurrently, cutting the group of 'c'."""
+    chunks = [TEST_CHUNK1, TEST_CHUNK2]
+    fake_reader = RecordingShuffleReader(chunks)
+    result = []
+    saved_iterators = {}
+    with self.concurrent_source(4).reader(test_reader=fake_reader) as reader:
+      self.assertEqual(['2', '4', '6'], reader.entries_iterable.split_positions)
+      for key, key_values in reader:
+        saved_iterators[key] = key_values
+        for value in key_values:
+          result.append((key, value))
+    self.assertEqual(TEST_CHUNK1 + TEST_CHUNK2, result)
+    # Every sub-range was read from its own start.
+    self.assertTrue(set(['0', '2', '4', '6']).issubset(fake_reader.reads))
+    self.assertEqual(list(saved_iterators['c']), ['0', '1', '2', '3', '4'])
+
+  def test_concurrent_ranges_dynamic_splitting(self):
+    chunks = [TEST_CHUNK1, TEST_CHUNK2]
+    with self.concurrent_source(2).reader(
+        test_reader=FakeShuffleReader(chunks)) as reader:
+      reader_iter = iter(reader)
+      self.assertEqual('a', next(reader_iter)[0])
+      self.try_splitting_reader_at(
+          reader,
+          iobase.DynamicSplitRequest(iobase.ReaderProgress(
+              position=iobase.ReaderPosition(
+                  shuffle_position=base64.urlsafe_b64encode('2')))),
+          iobase.DynamicSplitResultWithPosition(iobase.ReaderPosition(
+              shuffle_position=base64.urlsafe_b64encode('2'))))
+      self.assertEqual(['b'], [key for key, _ in reader_iter])
+
+  def test_concurrent_ranges_spill_budget(self):
+    chunks = [TEST_CHUNK1, TEST_CHUNK2]
+    for spill_bytes, expected_spill_bytes in ((0, [0, 0, 0, 0]),
+                                              (300, [0, 100, 100, 100])):
+      with self.concurrent_source(4, spill_bytes).reader(
+          test_reader=FakeShuffleReader(chunks)) as reader:
+        reader_iter = iter(reader)
+        next(reader_iter)
+        # The sub-ranges after the first one share the spill budget.
+        self.assertEqual(
+            expected_spill_bytes,
+            [p.spill_max_bytes
+             for _, p in reader.entries_iterable._sub_ranges])
+
+  def test_exit_stops_reading_ahead(self):
+    chunks = [TEST_CHUNK1, TEST_CHUNK2]
+    with self.concurrent_source(4).reader(
+        test_reader=RecordingShuffleReader(chunks)) as reader:
+      # The iteration is abandoned but not garbage collected before exiting.
+      reader_iter = iter(reader)
+      self.assertEqual('a', next(reader_iter)[0])
+      prefetchers = list(reader.entries_iterable.prefetchers)
+      self.assertEqual(4, len(prefetchers))
+    self.assert_stopped(prefetchers)
+    source = GroupedShuffleSource(
+        config_bytes='not used', coder=Base64Coder(), read_ahead_chunks=1)
+    with source.reader(test_reader=FakeShuffleReader(chunks)) as reader:
+      reader_iter = iter(reader)
+      self.assertEqual('a', next(reader_iter)[0])
+      prefetchers = list(reader.entries_iterable.prefetchers)
+      self.assertEqual(1, len(prefetchers))
+    self.assert_stopped(prefetchers)
+
+  def test_dynamic_split_stops_reading_ahead_past_split(self):
+    chunks = [TEST_CHUNK1, TEST_CHUNK2]
+    with self.concurrent_source(4).reader(
+        test_reader=RecordingShuffleReader(chunks)) as reader:
+      reader_iter = iter(reader)
+      self.assertEqual('a', next(reader_iter)[0])
+      self.try_splitting_reader_at(
+          reader,
+          iobase.DynamicSplitRequest(iobase.ReaderProgress(
+              position=iobase.ReaderPosition(
+                  shuffle_position=base64.urlsafe_b64encode('4')))),
+          iobase.DynamicSplitResultWithPosition(iobase.ReaderPosition(
+              shuffle_position=base64.urlsafe_b64encode('4'))))
+      # The sub-ranges past the split only read one chunk ahead.
+      self.assertEqual(
+          [('0', True), ('2', True), ('4', False), ('6', False)],
+          [(start, p.max_bytes > 0)
+           for start, p in reader.entries_iterable._sub_ranges])
+      self.assertEqual(['b', 'c'], [key for key, _ in reader_iter])
+
+  def test_compressed_values(self):
+    source = GroupedShuffleSource(
+        config_bytes='not used', coder=Base64Coder(), compressed_values=True)
+
+    chunks = [[(k, v * 100) for k, v in chunk]
+              for chunk in (TEST_CHUNK1, TEST_CHUNK2)]
+    fake_reader = FakeShuffleReader(chunks, compression_level=6)
+    result = []
+    saved_iterators = {}
+    with source.reader(test_reader=fake_reader) as reader:
+      for key, key_values in reader:
+        saved_iterators[key] = key_values
+        for value in key_values:
+          result.append((key, value))
+    self.assertEqual(chunks[0] + chunks[1], result)
+    self.assertEqual(['0' * 100, '1' * 100], list(saved_iterators['b']))
+
+  def test_compressed_blocks(self):
+    directory = tempfile.mkdtemp()
+    try:
+      config = localshuffle.local_shuffle_config(directory)
+      coder = coders.BytesCoder()
+      sink = ShuffleSink(config, coder=coder, compression_level=6)
+      with sink.writer() as writer:
+        for i in range(100):
+          writer.Write('k%d' % (i % 3), '', 'value-%d' % i)
+      source = GroupedShuffleSource(config, coder=coder,
+                                    compressed_values=True)
+      with source.reader() as reader:
+        result = [(k, sorted(vs)) for k, vs in reader]
+    finally:
+      shutil.rmtree(directory)
+    self.assertEqual(
+        [('k%d' % k, sorted('value-%d' % i for i in range(k, 100, 3)))
+         for k in range(3)],
+        result)
+
+  def test_sorted_values(self):
+    source = GroupedShuffleSource(
+        config_bytes='not used', coder=Base64Coder(),
+        secondary_key_coder=coders.BytesCoder(), reiteration_cache_bytes=14)
+
+    chunks = [[('a', 'x'), ('a', 'y'), ('b', 'z')],
+              [('c', '0'), ('c', '1'), ('c', '2'), ('c', '3')]]
+    fake_reader = FakeShuffleReader(chunks, secondary_keys=True)
+    result = []
+    saved_iterators = {}
+    with source.reader(test_reader=fake_reader) as reader:
+      for key, key_values in reader:
+        saved_iterators[key] = key_values
+        result.append((key, list(key_values)))
+    expected = [('a', [('s-x', 'x'), ('s-y', 'y')]), ('b', [('s-z', 'z')]),
+                ('c', [('s-%d' % i, str(i)) for i in range(4)])]
+    self.assertEqual(expected, result)
+    # Reiterations, from the cache for 'a' and 'b' but not 'c'.
+    self.assertEqual(expected, [(k, list(saved_iterators[k])) for k in 'abc'])
+    self.assertIsNotNone(saved_iterators['a'].cached_values)
+    self.assertIsNone(saved_iterators['c'].cached_values)
+
   def test_iterator_drained(self):
     result = []
     source = GroupedShuffleSource(
@@ -344,6 +813,65 @@ class TestUngroupedShuffleSource(unittest.TestCase):
     # We get only the values from the (k, 2nd-k, v) tuples.
     self.assertEqual([e[1] for e in TEST_CHUNK1 + TEST_CHUNK2], result)
 
+  def test_progress_reporting(self):
+    source = UngroupedShuffleSource(
+        config_bytes='not used', coder=Base64Coder())
+
+    chunks = [TEST_CHUNK1, TEST_CHUNK2]
+    progress_record = []
+    with source.reader(test_reader=FakeShuffleReader(chunks)) as reader:
+      self.assertIsNone(reader.get_progress())
+      for _ in reader:
+        progress_record.append(
+            reader.get_progress().position.shuffle_position)
+    self.assertEqual([base64.urlsafe_b64encode(str(i)) for i in range(8)],
+                     progress_record)
+
+  def split_request(self, position):
+    return iobase.DynamicSplitRequest(iobase.ReaderProgress(
+        position=iobase.ReaderPosition(
+            shuffle_position=base64.urlsafe_b64encode(position))))
+
+  def test_dynamic_splitting(self):
+    source = UngroupedShuffleSource(
+        config_bytes='not used', coder=Base64Coder(),
+        end_position=base64.urlsafe_b64encode('7'))
+
+    chunks = [TEST_CHUNK1, TEST_CHUNK2]
+    with source.reader(test_reader=FakeShuffleReader(chunks)) as reader:
+      # Cannot split an unstarted reader.
+      self.assertIsNone(reader.request_dynamic_split(self.split_request('3')))
+      reader_iter = iter(reader)
+      result = [next(reader_iter), next(reader_iter)]
+      # Cannot split at or before the current position, or out of range.
+      self.assertIsNone(reader.request_dynamic_split(self.split_request('1')))
+      self.assertIsNone(reader.request_dynamic_split(self.split_request('7')))
+
+      split_result = reader.request_dynamic_split(self.split_request('5'))
+      self.assertEqual(base64.urlsafe_b64encode('5'),
+                       split_result.stop_position.shuffle_position)
+      result.extend(reader_iter)
+    self.assertEqual([e[1] for e in TEST_CHUNK1 + TEST_CHUNK2][:5], result)
+
+  def test_compressed_values(self):
+    source = UngroupedShuffleSource(
+        config_bytes='not used', coder=Base64Coder(), compressed_values=True)
+
+    chunks = [TEST_CHUNK1, TEST_CHUNK2]
+    fake_reader = FakeShuffleReader(chunks, compression_level=9)
+    with source.reader(test_reader=fake_reader) as reader:
+      result = list(reader)
+    self.assertEqual([e[1] for e in TEST_CHUNK1 + TEST_CHUNK2], result)
+
+  def test_read_ahead(self):
+    source = UngroupedShuffleSource(
+        config_bytes='not used', coder=Base64Coder(), read_ahead_chunks=1)
+
+    chunks = [TEST_CHUNK1, TEST_CHUNK2]
+    with source.reader(test_reader=FakeShuffleReader(chunks)) as reader:
+      result = list(reader)
+    self.assertEqual([e[1] for e in TEST_CHUNK1 + TEST_CHUNK2], result)
+
 
 class TestShuffleSink(unittest.TestCase):
 
@@ -355,6 +883,93 @@ class TestShuffleSink(unittest.TestCase):
       for entry in entries:
         writer.Write(*entry)
     self.assertEqual(entries, fake_writer.values)
+    # Without compression, entries hold the encoded values as they are.
+    self.assertEqual([base64.b64encode(v) for _, _, v in entries],
+                     [e.value for e in fake_writer._entries])
+
+  def test_compressed_values(self):
+    source = ShuffleSink(config_bytes='not used', coder=Base64Coder(),
+                         compression_level=6)
+    entries = [('a', '', '1' * 100), ('b', '', '0'), ('b', '', 'xyz' * 100),
+               ('b', base64.b64encode('s'), 'y')]
+    fake_writer = FakeShuffleWriter(compressed_values=True)
+    with source.writer(test_writer=fake_writer) as writer:
+      for entry in entries:
+        writer.Write(*entry)
+    self.assertEqual(sorted(entries[:3] + [('b', 's', 'y')]),
+                     sorted(fake_writer.values))
+    # The values of each key and secondary key are written as one block.
+    self.assertEqual(3, len(fake_writer._entries))
+    self.assertLess(sum(len(e.value) for e in fake_writer._entries), 150)
+
+  def test_compressed_blocks_are_bounded(self):
+    source = ShuffleSink(config_bytes='not used', coder=Base64Coder(),
+                         compression_level=6)
+    value = 'v' * (shuffle.ShuffleSinkWriter.MAX_BLOCK_BYTES // 4)
+    fake_writer = FakeShuffleWriter(compressed_values=True)
+    with source.writer(test_writer=fake_writer) as writer:
+      for _ in range(6):
+        writer.Write('a', '', value)
+    self.assertEqual([('a', '', value)] * 6, fake_writer.values)
+    # Blocks are written once they hold MAX_BLOCK_BYTES bytes.
+    self.assertEqual(2, len(fake_writer._entries))
+
+  def check_buffered_writes(self, flush_queue_depth):
+    source = ShuffleSink(config_bytes='not used', coder=Base64Coder(),
+                         buffer_bytes=40, flush_queue_depth=flush_queue_depth)
+    entries = [('k%d' % i, '', 'v%d' % i) for i in range(20)]
+    fake_writer = SlowShuffleWriter()
+    with source.writer(test_writer=fake_writer) as writer:
+      for entry in entries:
+        writer.Write(*entry)
+    self.assertEqual(entries, fake_writer.values)
+    # Each buffer holds two entries of 20 bytes or so.
+    self.assertEqual(10, fake_writer.num_writes)
+
+  def test_synchronous_writes(self):
+    self.check_buffered_writes(0)
+
+  def test_background_writes(self):
+    self.check_buffered_writes(1)
+    self.check_buffered_writes(3)
+
+  def test_background_write_error(self):
+    source = ShuffleSink(config_bytes='not used', coder=Base64Coder(),
+                         buffer_bytes=40)
+    fake_writer = SlowShuffleWriter(fail=True)
+    with self.assertRaisesRegexp(IOError, 'Failed to write'):
+      with source.writer(test_writer=fake_writer) as writer:
+        for i in range(20):
+          writer.Write('k%d' % i, '', 'v%d' % i)
+    # Nothing is written after the failure.
+    self.assertEqual(1, fake_writer.num_writes)
+    self.assertTrue(fake_writer.closed)
+
+  def test_abort(self):
+    source = ShuffleSink(config_bytes='not used', coder=Base64Coder(),
+                         buffer_bytes=40)
+    fake_writer = SlowShuffleWriter()
+    writer = source.writer(test_writer=fake_writer)
+    writer.__enter__()
+    flusher = writer.flusher
+    for i in range(5):
+      writer.Write('k%d' % i, '', 'v%d' % i)
+    writer.abort()
+    # The background thread is stopped and the partial buffer is dropped.
+    self.assertFalse(flusher._thread.is_alive())
+    self.assertTrue(fake_writer.closed)
+    self.assertLessEqual(fake_writer.num_writes, 2)
+
+  def test_final_write_error(self):
+    source = ShuffleSink(config_bytes='not used', coder=Base64Coder(),
+                         flush_queue_depth=0)
+    fake_writer = SlowShuffleWriter(fail=True)
+    with self.assertRaisesRegexp(IOError, 'Failed to write'):
+      with source.writer(test_writer=fake_writer) as writer:
+        writer.Write('k', '', 'v')
+    # The shuffle writer is closed even though the last buffer failed.
+    self.assertEqual(1, fake_writer.num_writes)
+    self.assertTrue(fake_writer.closed)
 
 
 if __name__ == '__main__':
@@ -14,20 +14,221 @@
 
 """Utilities for handling side inputs."""
 
+import array
+import bisect
 import collections
+import hashlib
+import heapq
+import itertools
+import logging
+import mmap
+import struct
+import tempfile
+import threading
 
+from google.cloud.dataflow import coders
+from google.cloud.dataflow.internal import pickler
 
 
-def get_iterator_fn_for_sources(sources):
-  """Returns callable that returns iterator over elements for given sources."""
+def get_iterator_fn_for_sources(sources, size_observer=None):
+  """Returns callable that returns iterator over elements for given sources.
+
+  Args:
+    sources: the sources to read, in order.
+    size_observer: if not None, a callable invoked with the estimated encoded
+      size of the elements read, as given by the coder of their source. Only
+      a sample of the elements is sized: the size of each sampled element
+      stands in for all the elements read since the previous sample.
+  """
   def _inner():
+    sampler = _SizeSampler()
     for source in sources:
+      if size_observer is not None:
+        coder = getattr(source, 'coder', None) or coders.PickleCoder()
       with source.reader() as reader:
         for value in reader:
+          if size_observer is not None:
+            weight = sampler.next()
+            if weight:
+              size_observer(_estimate_size(coder, value) * weight)
           yield value
   return _inner
 
 
+def _estimate_size(coder, value):
+  """Returns the estimated encoded size of value, or 0 if it can't be sized.
+
+  Size estimation is best effort: it only drives the spilling and caching of
+  side inputs, and must not fail their read.
+  """
+  try:
+    return coder.estimate_size(value)
+  except Exception as exn:  # pylint: disable=broad-except
+    logging.debug('Unable to estimate the size of %r with %s: %s',
+                  value, coder, exn)
+    return 0
+
+
+class _SizeSampler(object):
+  """Decides which elements of a sequence to size.
+
+  The first 10 elements are always sampled. After that, about one element is
+  sampled per tenth of the elements read so far, so that sizing stays cheap
+  for large side inputs while the total estimate keeps up with their growth.
+  """
+
+  def __init__(self):
+    self._count = 0
+    self._last_sample = 0
+    self._next_sample = 1
+
+  def next(self):
+    """Counts one element and returns how many elements its size stands for.
+
+    Returns:
+      0 if the element should not be sized, else the number of elements read
+      since the previous sample, including this one.
+    """
+    self._count += 1
+    if self._count < self._next_sample:
+      return 0
+    weight = self._count - self._last_sample
+    self._last_sample = self._count
+    self._next_sample = self._count + max(1, self._count // 10)
+    return weight
+
+
+def get_coder_for_sources(sources):
+  """Returns a coder able to encode the elements read from all of sources."""
+  source_coders = [getattr(source, 'coder', None) for source in sources]
+  if source_coders and source_coders[0] is not None and all(
+      coder == source_coders[0] for coder in source_coders[1:]):
+    return source_coders[0]
+  return coders.PickleCoder()
+
+
+class SizeCounter(object):
+  """A size observer adding up the sizes it is called with."""
+
+  def __init__(self):
+    self.size = 0
+
+  def __call__(self, size):
+    self.size += size
+
+
+def read_list(values, size_counter, spill_bytes, coder):
+  """Returns a list of values, spilled to local disk if it gets too large.
+
+  Args:
+    values: an iterator over the elements of the list.
+    size_counter: a SizeCounter observing the elements of values as they are
+      read.
+    spill_bytes: the estimated encoded size, in bytes, over which the list is
+      written to local disk instead of being kept in memory.
+    coder: the coder used to encode the elements written to disk.
+
+  Returns:
+    A list, or a DiskBackedList if the elements were spilled.
+  """
+  result = []
+  for value in values:
+    result.append(value)
+    if size_counter.size > spill_bytes:
+      return DiskBackedList(itertools.chain(result, values), coder)
+  return result
+
+
+def read_dict(items, size_counter, spill_bytes, coder):
+  """Returns a dict of items, spilled to local disk if it gets too large.
+
+  Args:
+    items: an iterator over the (key, value) items of the dict.
+    size_counter: a SizeCounter observing the items as they are read.
+    spill_bytes: the estimated encoded size, in bytes, over which the dict is
+      written to local disk instead of being kept in memory.
+    coder: the KV coder used to encode the items written to disk.
+
+  Returns:
+    A dict, or a DiskBackedDict if the items were spilled.
+  """
+  result = {}
+  for key, value in items:
+    result[key] = value
+    if size_counter.size > spill_bytes:
+      return DiskBackedDict(itertools.chain(result.iteritems(), items), coder)
+  return result
+
+
+def get_cache_key(sources, view_class, view_options):
+  """Returns a key identifying a side input view read from sources.
+
+  Side input sources are deserialized anew for every work item, so the key
+  is derived from their serialized form rather than from object identity.
+
+  Args:
+    sources: the sources the side input is read from.
+    view_class: the PCollectionView class of the side input.
+    view_options: the options of the side input view.
+
+  Returns:
+    A string key, or None if the sources cannot be serialized.
+  """
+  try:
+    return hashlib.sha1(
+        pickler.dumps((sources, view_class, view_options))).hexdigest()
+  except Exception as exn:  # pylint: disable=broad-except
+    logging.debug('Side input from %s cannot be cached: %s', sources, exn)
+    return None
+
+
+class SideInputCache(object):
+  """A worker-level cache of materialized side input views.
+
+  Views are shared by all the work items a worker runs, so DoFns must not
+  mutate them. Once the total estimated size of the cached views goes over
+  max_bytes the least recently used ones are evicted. Views larger than
+  max_bytes are never cached.
+  """
+
+  def __init__(self, max_bytes):
+    self.max_bytes = max_bytes
+    self.size = 0
+    self.hits = 0
+    self.misses = 0
+    # Maps keys to (view, size) tuples, least recently used first.
+    self._entries = collections.OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, key):
+    """Returns a (found, view) tuple for the view cached under key."""
+    with self._lock:
+      entry = self._entries.pop(key, None)
+      if entry is None:
+        self.misses += 1
+        return False, None
+      self._entries[key] = entry
+      self.hits += 1
+      return True, entry[0]
+
+  def put(self, key, view, size):
+    """Caches view under key, evicting least recently used views if needed."""
+    if size > self.max_bytes:
+      return
+    with self._lock:
+      old_entry = self._entries.pop(key, None)
+      if old_entry is not None:
+        self.size -= old_entry[1]
+      self._entries[key] = view, size
+      self.size += size
+      while self.size > self.max_bytes:
+        _, (_, evicted_size) = self._entries.popitem(last=False)
+        self.size -= evicted_size
+
+  def __len__(self):
+    return len(self._entries)
+
+
 class EmulatedIterable(collections.Iterable):
   """Emulates an iterable for a side input."""
 
@@ -36,3 +237,206 @@ class EmulatedIterable(collections.Iterable):
 
   def __iter__(self):
     return self.iterator_fn()
+
+
+class _DiskBackedView(object):
+  """Base class of side input views kept encoded in a local file.
+
+  The file is unlinked as soon as it is created and memory-mapped once
+  written, so it goes away with the view and reading an entry only touches
+  the pages it spans.
+  """
+
+  def __init__(self):
+    self._file = tempfile.TemporaryFile(prefix='sideinput-')
+    self._offset = 0
+    self._data = None
+
+  def _write(self, encoded):
+    """Appends encoded to the file and returns the offset it was written at."""
+    offset = self._offset
+    self._file.write(encoded)
+    self._offset += len(encoded)
+    return offset
+
+  def _map(self):
+    self._file.flush()
+    # Empty files cannot be mapped, but are never read from either.
+    if self._offset:
+      self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+    else:
+      self._data = ''
+
+  @property
+  def memory_size(self):
+    """The size, in bytes, of the in-memory index of the view."""
+    raise NotImplementedError
+
+  @property
+  def disk_size(self):
+    """The size, in bytes, of the local file of the view."""
+    return self._offset
+
+
+class DiskBackedList(_DiskBackedView, collections.Sequence):
+  """A read-only list whose elements are decoded from disk on demand.
+
+  An in-memory index holds the file offset of every element.
+  """
+
+  def __init__(self, values, coder):
+    super(DiskBackedList, self).__init__()
+    self._coder_impl = coder.get_impl()
+    self._offsets = array.array('l')
+    for value in values:
+      self._offsets.append(self._write(self._coder_impl.encode(value)))
+    self._offsets.append(self._offset)
+    self._map()
+
+  def __len__(self):
+    return len(self._offsets) - 1
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      return [self[i] for i in xrange(*index.indices(len(self)))]
+    if index < 0:
+      index += len(self)
+    if not 0 <= index < len(self):
+      raise IndexError('list index out of range')
+    return self._coder_impl.decode(
+        self._data[self._offsets[index]:self._offsets[index + 1]])
+
+  def __iter__(self):
+    for index in xrange(len(self)):
+      yield self[index]
+
+  @property
+  def memory_size(self):
+    return self._offsets.itemsize * len(self._offsets)
+
+
+class DiskBackedDict(_DiskBackedView, collections.Mapping):
+  """A read-only dict whose items are decoded from disk on demand.
+
+  Every item is written as its length-prefixed encoded key followed by its
+  encoded value. The in-memory index holds the hash of every key, sorted,
+  along with the file offsets of its item, so a lookup is a binary search
+  followed by decoding the keys of the items with the same hash.
+
+  The index is sorted externally: the (hash, start, end) entries of the items
+  are sorted in runs of at most RUN_ENTRIES, written to a local file, and the
+  runs merged into the index, so that building it takes little more memory
+  than the index itself.
+  """
+
+  _KEY_LENGTH = struct.Struct('>i')
+  # Native longs, as in the index arrays.
+  _ENTRY = struct.Struct('lll')
+
+  RUN_ENTRIES = 1 << 16
+
+  def __init__(self, items, coder):
+    super(DiskBackedDict, self).__init__()
+    if not coder.is_kv_coder():
+      coder = coders.PickleCoder()
+    self._key_coder_impl = coder.key_coder().get_impl()
+    self._value_coder_impl = coder.value_coder().get_impl()
+    with tempfile.TemporaryFile(prefix='sideinput-runs-') as runs_file:
+      run_offsets = [0]
+      run = []
+      for key, value in items:
+        encoded_key = self._key_coder_impl.encode(key)
+        start = self._write(self._KEY_LENGTH.pack(len(encoded_key)))
+        self._write(encoded_key)
+        self._write(self._value_coder_impl.encode(value))
+        run.append((hash(key), start, self._offset))
+        if len(run) == self.RUN_ENTRIES:
+          run_offsets.append(self._write_run(runs_file, run))
+          run = []
+      self._map()
+      if len(run_offsets) > 1:
+        run_offsets.append(self._write_run(runs_file, run))
+        runs_file.flush()
+        entries = heapq.merge(*[
+            self._read_run(runs_file, start, end)
+            for start, end in zip(run_offsets, run_offsets[1:])])
+      else:
+        run.sort()
+        entries = run
+      self._build_index(entries)
+
+  def _write_run(self, runs_file, run):
+    """Sorts and appends run to runs_file and returns the offset of its end."""
+    run.sort()
+    for entry in run:
+      runs_file.write(self._ENTRY.pack(*entry))
+    return runs_file.tell()
+
+  def _read_run(self, runs_file, start, end):
+    """Yields the entries of the run written to runs_file from start to end."""
+    chunk_bytes = self._ENTRY.size * 1024
+    while start < end:
+      # The merge interleaves reads from all the runs.
+      runs_file.seek(start)
+      chunk = runs_file.read(min(chunk_bytes, end - start))
+      start += len(chunk)
+      for offset in xrange(0, len(chunk), self._ENTRY.size):
+        yield self._ENTRY.unpack_from(chunk, offset)
+
+  def _build_index(self, entries):
+    """Builds the index from the (hash, start, end) entries, sorted."""
+    # Keep only the last item written for every key, as dict() would.
+    self._hashes = array.array('l')
+    self._starts = array.array('l')
+    self._ends = array.array('l')
+    for key_hash, group in itertools.groupby(entries, key=lambda e: e[0]):
+      group = list(group)
+      if len(group) > 1:
+        last_by_key = {}
+        for entry in group:
+          last_by_key[self._read_key(entry[1])] = entry
+        group = sorted(last_by_key.values())
+      for _, start, end in group:
+        self._hashes.append(key_hash)
+        self._starts.append(start)
+        self._ends.append(end)
+
+  def _read_key(self, start):
+    key_start = start + self._KEY_LENGTH.size
+    key_length, = self._KEY_LENGTH.unpack_from(self._data, start)
+    return self._key_coder_impl.decode(
+        self._data[key_start:key_start + key_length])
+
+  def _find(self, key):
+    """Returns the index position of key, or -1 if it is missing."""
+    key_hash = hash(key)
+    index = bisect.bisect_left(self._hashes, key_hash)
+    while index < len(self._hashes) and self._hashes[index] == key_hash:
+      if self._read_key(self._starts[index]) == key:
+        return index
+      index += 1
+    return -1
+
+  def __len__(self):
+    return len(self._hashes)
+
+  def __contains__(self, key):
+    return self._find(key) >= 0
+
+  def __getitem__(self, key):
+    index = self._find(key)
+    if index < 0:
+      raise KeyError(key)
+    start = self._starts[index]
+    key_length, = self._KEY_LENGTH.unpack_from(self._data, start)
+    return self._value_coder_impl.decode(
+        self._data[start + self._KEY_LENGTH.size + key_length:
+                   self._ends[index]])
+
+  def __iter__(self):
+    for start in self._starts:
+      yield self._read_key(start)
+
+  @property
+  def memory_size(self):
+    return self._hashes.itemsize * len(self._hashes) * 3
@@ -18,6 +18,8 @@ import logging
 import unittest
 
 
+from google.cloud.dataflow import coders
+from google.cloud.dataflow.worker import inmemory
 from google.cloud.dataflow.worker import sideinputs
 
 
@@ -44,6 +46,143 @@ class EmulatedCollectionsTest(unittest.TestCase):
         self.assertEqual(('%d' % i) * (200 * 1024 * 1024), j)
 
 
+
+class SideInputCacheTest(unittest.TestCase):
+
+  def test_get_and_put(self):
+    cache = sideinputs.SideInputCache(max_bytes=100)
+    self.assertEqual((False, None), cache.get('a'))
+    cache.put('a', [1, 2, 3], 10)
+    self.assertEqual((True, [1, 2, 3]), cache.get('a'))
+    self.assertEqual(1, cache.hits)
+    self.assertEqual(1, cache.misses)
+    self.assertEqual(10, cache.size)
+
+  def test_evicts_least_recently_used(self):
+    cache = sideinputs.SideInputCache(max_bytes=100)
+    cache.put('a', 'A', 40)
+    cache.put('b', 'B', 40)
+    cache.get('a')
+    cache.put('c', 'C', 40)
+    self.assertEqual((False, None), cache.get('b'))
+    self.assertEqual((True, 'A'), cache.get('a'))
+    self.assertEqual((True, 'C'), cache.get('c'))
+    self.assertEqual(80, cache.size)
+
+  def test_does_not_cache_views_over_budget(self):
+    cache = sideinputs.SideInputCache(max_bytes=100)
+    cache.put('a', 'A', 40)
+    cache.put('b', 'B', 101)
+    self.assertEqual(1, len(cache))
+    self.assertEqual((True, 'A'), cache.get('a'))
+
+
+class DiskBackedViewsTest(unittest.TestCase):
+
+  def test_disk_backed_list(self):
+    values = ['a', 'bb', '', 'ccc' * 100]
+    view = sideinputs.DiskBackedList(iter(values), coders.BytesCoder())
+    self.assertEqual(4, len(view))
+    self.assertEqual(values, list(view))
+    self.assertEqual('ccc' * 100, view[-1])
+    self.assertEqual(['bb', ''], view[1:3])
+    self.assertIn('bb', view)
+    with self.assertRaises(IndexError):
+      view[4]  # pylint: disable=pointless-statement
+
+  def test_empty_disk_backed_views(self):
+    self.assertEqual([], list(
+        sideinputs.DiskBackedList(iter([]), coders.PickleCoder())))
+    view = sideinputs.DiskBackedDict(iter([]), coders.PickleCoder())
+    self.assertEqual(0, len(view))
+    self.assertNotIn('a', view)
+
+  def test_disk_backed_dict(self):
+    coder = coders.TupleCoder((coders.PickleCoder(), coders.VarIntCoder()))
+    items = [('a', 1), (1, 2), ((1, 'b'), 3), ('a', 4), (1.0, 5)]
+    view = sideinputs.DiskBackedDict(iter(items), coder)
+    # As for dict(), later items replace the earlier ones with an equal key.
+    self.assertEqual(dict(items), dict(view.iteritems()))
+    self.assertEqual(3, len(view))
+    self.assertEqual(4, view['a'])
+    self.assertEqual(5, view[1])
+    self.assertEqual(3, view.get((1, 'b')))
+    self.assertIsNone(view.get('b'))
+    self.assertNotIn('b', view)
+    with self.assertRaises(KeyError):
+      view['b']  # pylint: disable=pointless-statement
+
+  def test_disk_backed_dict_merges_sorted_runs(self):
+    class SmallRunsDict(sideinputs.DiskBackedDict):
+      RUN_ENTRIES = 3
+    items = [(i % 7, i) for i in range(20)] + [('a', 1), (2.0, 'b')]
+    view = SmallRunsDict(iter(items), coders.PickleCoder())
+    self.assertEqual(dict(items), dict(view.iteritems()))
+    self.assertEqual(sorted(view._hashes), list(view._hashes))
+    self.assertEqual(view.memory_size, 8 * 3 * len(view))
+    self.assertGreater(view.disk_size, 0)
+
+  def test_read_list_spills_once_over_threshold(self):
+    size_counter = sideinputs.SizeCounter()
+    def values(n):
+      for i in range(n):
+        size_counter(10)
+        yield i
+    self.assertEqual(
+        [0, 1, 2],
+        sideinputs.read_list(values(3), size_counter, 30, coders.PickleCoder()))
+    view = sideinputs.read_list(
+        values(5), size_counter, 30, coders.PickleCoder())
+    self.assertIsInstance(view, sideinputs.DiskBackedList)
+    self.assertEqual([0, 1, 2, 3, 4], list(view))
+
+  def test_read_dict_spills_once_over_threshold(self):
+    size_counter = sideinputs.SizeCounter()
+    def items():
+      for i in range(10):
+        size_counter(10)
+        yield i % 4, i
+    view = sideinputs.read_dict(
+        items(), size_counter, 30, coders.PickleCoder())
+    self.assertIsInstance(view, sideinputs.DiskBackedDict)
+    self.assertEqual({0: 8, 1: 9, 2: 6, 3: 7}, dict(view.iteritems()))
+
+
+class SizingCoder(coders.PickleCoder):
+  """A coder counting the elements it sizes, each of size 10."""
+
+  def __init__(self, fail=False):
+    self.fail = fail
+    self.sized = 0
+
+  def estimate_size(self, value):
+    if self.fail:
+      raise ValueError('Cannot size %r' % value)
+    self.sized += 1
+    return 10
+
+
+class SourceSizingTest(unittest.TestCase):
+
+  def _read(self, coder, n):
+    source = inmemory.InMemorySource(
+        [coder.encode(i) for i in range(n)], coder)
+    size_counter = sideinputs.SizeCounter()
+    values = list(
+        sideinputs.get_iterator_fn_for_sources([source], size_counter)())
+    self.assertEqual(range(n), values)
+    return size_counter.size
+
+  def test_sizes_a_sample_of_elements(self):
+    coder = SizingCoder()
+    # Only the elements read since the last sample are left unaccounted.
+    self.assertGreater(self._read(coder, 1000), 9000)
+    self.assertLess(coder.sized, 100)
+
+  def test_sizing_is_best_effort(self):
+    self.assertEqual(0, self._read(SizingCoder(fail=True), 100))
+
+
 if __name__ == '__main__':
   logging.getLogger().setLevel(logging.INFO)
   unittest.main()
@@ -0,0 +1,149 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Attribution of execution time to the steps of a map task by sampling."""
+
+import collections
+import threading
+import time
+
+from google.cloud.dataflow.utils.counters import Counter
+
+
+class ExecutionState(object):
+  """A state a step can be in, e.g. processing elements or finishing.
+
+  Attributes:
+    step_name: the name of the step.
+    state_name: the name of the state within the step, e.g. 'process'.
+    msecs: the wall-clock milliseconds attributed to the state so far.
+  """
+
+  def __init__(self, step_name, state_name, counter):
+    self.step_name = step_name
+    self.state_name = state_name
+    self.msecs = 0.0
+    self._counter = counter
+    self._committed_msecs = 0
+
+  def add_msecs(self, msecs):
+    self.msecs += msecs
+    if self._counter is not None:
+      whole_msecs = int(self.msecs)
+      if whole_msecs > self._committed_msecs:
+        self._counter.update(whole_msecs - self._committed_msecs)
+        self._committed_msecs = whole_msecs
+
+  def __repr__(self):
+    return '<ExecutionState %s-%s %d msecs>' % (
+        self.step_name, self.state_name, self.msecs)
+
+
+class _ScopedState(object):
+  """A context manager entering a state of a StateSampler."""
+
+  def __init__(self, sampler, state):
+    self.sampler = sampler
+    self.state = state
+    self.saved_state = None
+
+  def __enter__(self):
+    self.saved_state = self.sampler.current_state
+    self.sampler.current_state = self.state
+
+  def __exit__(self, *unused_exc_info):
+    self.sampler.current_state = self.saved_state
+
+
+class StateSampler(object):
+  """Attributes the time spent by an executing thread to execution states.
+
+  The executing thread only records which state it is in by setting
+  current_state, which is cheap enough to do for every element. A separate
+  thread wakes up every sampling period and attributes the wall-clock time
+  elapsed since its previous sample to the current state.
+
+  The time attributed to all the states of a step is exported as a
+  '<step>-msecs' SUM counter of the given counter factory, which is updated
+  as samples are taken.
+  """
+
+  DEFAULT_SAMPLING_PERIOD_MSECS = 200
+
+  def __init__(self, counter_factory=None,
+               sampling_period_msecs=DEFAULT_SAMPLING_PERIOD_MSECS):
+    self.counter_factory = counter_factory
+    self.sampling_period_msecs = sampling_period_msecs
+    # The state of the executing thread, or None if it is not in any state.
+    self.current_state = None
+    # States are only ever added, by the executing thread, so the list can be
+    # read by other threads without locking.
+    self._states = {}
+    self._state_list = []
+    self._stopped = threading.Event()
+    self._thread = None
+
+  def get_state(self, step_name, state_name):
+    """Returns the ExecutionState for state_name of step step_name."""
+    state = self._states.get((step_name, state_name))
+    if state is None:
+      counter = None
+      if self.counter_factory is not None:
+        counter = self.counter_factory.get_counter(
+            '%s-msecs' % step_name, Counter.SUM)
+      state = ExecutionState(step_name, state_name, counter)
+      self._states[step_name, state_name] = state
+      self._state_list.append(state)
+    return state
+
+  def scoped_state(self, state):
+    """Returns a context manager in which the executing thread is in state."""
+    return _ScopedState(self, state)
+
+  def start(self):
+    self._stopped.clear()
+    self._thread = threading.Thread(target=self._run)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def stop(self):
+    self._stopped.set()
+    if self._thread is not None:
+      self._thread.join()
+      self._thread = None
+
+  def _run(self):
+    last_sample_time = time.time()
+    while not self._stopped.wait(self.sampling_period_msecs / 1000.0):
+      last_sample_time = self.sample(last_sample_time)
+
+  def sample(self, last_sample_time):
+    """Attributes the time since last_sample_time, and returns the time now."""
+    now = time.time()
+    state = self.current_state
+    if state is not None:
+      state.add_msecs((now - last_sample_time) * 1000)
+    return now
+
+  def get_states(self):
+    """Returns the ExecutionStates created so far, in creation order."""
+    return list(self._state_list)
+
+  def get_step_msecs(self):
+    """Returns an ordered mapping of step names to attributed msecs."""
+    step_msecs = collections.OrderedDict()
+    for state in self.get_states():
+      step_msecs[state.step_name] = (
+          step_msecs.get(state.step_name, 0) + state.msecs)
+    return step_msecs
@@ -0,0 +1,71 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the state sampler."""
+
+import logging
+import time
+import unittest
+
+from google.cloud.dataflow.utils.counters import CounterFactory
+from google.cloud.dataflow.worker import statesampler
+
+
+class StateSamplerTest(unittest.TestCase):
+
+  def test_samples_are_attributed_to_current_state(self):
+    counter_factory = CounterFactory()
+    sampler = statesampler.StateSampler(counter_factory)
+    process_a = sampler.get_state('a', 'process')
+    process_b = sampler.get_state('b', 'process')
+    finish_a = sampler.get_state('a', 'finish')
+    self.assertIs(process_a, sampler.get_state('a', 'process'))
+
+    now = sampler.sample(0)  # Time outside of any state is not attributed.
+    with sampler.scoped_state(process_a):
+      now = sampler.sample(now - 0.0105)
+      with sampler.scoped_state(process_b):
+        now = sampler.sample(now - 0.002)
+      self.assertIs(process_a, sampler.current_state)
+      now = sampler.sample(now - 0.001)
+    self.assertIsNone(sampler.current_state)
+    with sampler.scoped_state(finish_a):
+      sampler.sample(now - 0.003)
+
+    self.assertEqual([process_a, process_b, finish_a], sampler.get_states())
+    self.assertAlmostEqual(11.5, process_a.msecs, places=1)
+    self.assertAlmostEqual(2, process_b.msecs, places=1)
+    self.assertAlmostEqual(14.5, sampler.get_step_msecs()['a'], places=1)
+    counters = dict((c.name, c.value()) for c in counter_factory.get_counters())
+    # Counters only ever hold whole msecs.
+    self.assertEqual({'a-msecs': 14, 'b-msecs': 2}, counters)
+
+  def test_sampling_thread(self):
+    sampler = statesampler.StateSampler(sampling_period_msecs=1)
+    state = sampler.get_state('a', 'process')
+    sampler.start()
+    with sampler.scoped_state(state):
+      time.sleep(0.05)
+    sampler.stop()
+    msecs = state.msecs
+    self.assertTrue(0 < msecs, msecs)
+    # Nothing is attributed once the sampler is stopped.
+    with sampler.scoped_state(state):
+      time.sleep(0.01)
+    self.assertEqual(msecs, state.msecs)
+
+
+if __name__ == '__main__':
+  logging.getLogger().setLevel(logging.INFO)
+  unittest.main()
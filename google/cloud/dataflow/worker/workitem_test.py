@@ -461,12 +461,21 @@ class WorkItemTest(unittest.TestCase):
                 end_shuffle_position='opaque',
                 shuffle_reader_config='opaque',
                 coder=CODER,
-                output_coders=[CODER]),
+                output_coders=[CODER],
+                sort_values=False),
             maptask.WorkerWrite(fileio.NativeTextFileSink(
                 file_path_prefix='gs://somefile',
                 append_trailing_newlines=True,
                 coder=CODER), input=(0, 0), output_coders=(CODER,))]))
 
+  def test_sorted_shuffle_source_to_text_sink(self):
+    shuffle_source_spec = dict(
+        GROUPING_SHUFFLE_SOURCE_SPEC,
+        sort_values={'value': True, '@type': 'http://bool'})
+    work = workitem.get_work_items(
+        get_shuffle_source_to_text_sink_message(shuffle_source_spec))
+    self.assertTrue(work.map_task.operations[0].sort_values)
+
   def test_ungrouped_shuffle_source_to_text_sink(self):
     work = workitem.get_work_items(
         get_shuffle_source_to_text_sink_message(UNGROUPED_SHUFFLE_SOURCE_SPEC))